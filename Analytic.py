@@ -0,0 +1,179 @@
+# Purpose: Closed-form signal equations for standard spin echo & gradient echo contrasts
+
+# Numpy library
+import numpy as np
+
+from Phantom import Phantom
+from MRISequence import *
+from Simulator import ProgressMeter, encode, k_trajectory, reconstruct
+from Waveform import RF_OPERATION, RELAXATION_OPERATION, SPOILER_OPERATION, READOUT_OPERATION
+
+SPIN_ECHO = "SE"
+GRADIENT_ECHO = "GE"
+
+# Transverse magnetization left at the next excitation below which an unspoiled sequence counts as spoiled
+SPOILING_TOLERANCE = 1e-3
+
+
+# Recognise the contrast of a sequence and the relaxation intervals the Bloch engine applies to it
+def analyze(sequence:MRISequence):
+    """
+    Supported: a gradient echo (one hard pulse of 0° < α <= 90°) or a 90°-180° spin echo, one
+    readout per TR, no spoiler before the echo, no flip angle train. Anything else needs a
+    Bloch simulation. Without a spoiler between the readout and the next excitation the
+    closed forms only hold once the transverse magnetization has decayed (see
+    AnalyticEngine.supports).
+
+    The intervals are sums of the relaxation operations of the compiled sequence: the Bloch
+    chain only relaxes in the gaps between components (pulses, gradients & readouts take no
+    time), so they are shorter than the nominal TR & TE of the sequence (the bundled SE
+    relaxes 230 ms per TR and 70 ms until its echo for TR = 250 ms, TE = 90 ms).
+
+    Returns:
+    contrast (str): SPIN_ECHO, GRADIENT_ECHO or None.
+    timing (dict): {"TR": relaxation per TR, "TE": excitation to readout, "tau": excitation to
+        refocusing (spin echo), "residual": readout to the next excitation, 0 when spoiled}
+        in ms, None when not supported.
+    """
+    if not sequence.get_TR() or sequence.get_train() is not None:
+        return None, None
+
+    # Pulses, readouts & spoilers with the relaxation elapsed since the start of the TR
+    elapsed = 0
+    events = []
+    for name, value in sequence.get_waveform().operations:
+        if name == RELAXATION_OPERATION:
+            elapsed += value
+        elif name in (RF_OPERATION, READOUT_OPERATION, SPOILER_OPERATION):
+            events.append((name, value, elapsed))
+
+    names = [name for name, _, _ in events]
+    if names.count(READOUT_OPERATION) != 1 or RF_OPERATION not in names:
+        return None, None
+
+    # Transverse magnetization never spoiled before the echo
+    first, readout = names.index(RF_OPERATION), names.index(READOUT_OPERATION)
+    spoilers = [index for index, name in enumerate(names) if name == SPOILER_OPERATION]
+    if any(first < index < readout for index in spoilers):
+        return None, None
+    # Decay from the readout to the next excitation when nothing spoils it
+    residual = 0 if spoilers else elapsed - events[readout][2] + events[first][2]
+
+    core = [(name, value, time) for name, value, time in events if name != SPOILER_OPERATION]
+    if any(name == RF_OPERATION and isinstance(value, tuple) for name, value, _ in core):
+        return None, None # Shaped pulses
+    core_names = [name for name, _, _ in core]
+    angles = [abs(value) for name, value, _ in core if name == RF_OPERATION]
+
+    if core_names == [RF_OPERATION, READOUT_OPERATION] and 0 < angles[0] <= 90:
+        return GRADIENT_ECHO, {"TR": elapsed, "TE": core[1][2] - core[0][2], "residual": residual}
+    if core_names == [RF_OPERATION, RF_OPERATION, READOUT_OPERATION] and angles == [90, 180]:
+        return SPIN_ECHO, {"TR": elapsed, "TE": core[2][2] - core[0][2], "tau": core[1][2] - core[0][2],
+                           "residual": residual}
+    return None, None
+
+
+# Contrast of a sequence (SPIN_ECHO, GRADIENT_ECHO or None, see analyze)
+def classify(sequence:MRISequence):
+    return analyze(sequence)[0]
+
+
+# Analytic engine
+class AnalyticEngine():
+    """
+    Steady state signal of every voxel from its PD/T1/T2*/B1+/off resonance in O(N²), with
+    the relaxation intervals of the Bloch engine (see analyze): TR and TE below are the
+    relaxation per TR and from the excitation to the readout, tau from the excitation to the
+    refocusing pulse.
+
+    Spin echo:      PD (1 - 2 exp(-(TR - tau)/T1) + exp(-TR/T1)) exp(-TE/T2*)
+    Gradient echo:  PD sin(α) (1 - E1) / (1 - cos(α) E1) exp(-TE/T2*),  E1 = exp(-TR/T1)
+
+    Transverse decay uses T2* as the Bloch engine does (its isochromats do not refocus T2'),
+    α is scaled by the B1+ map and the echo keeps the off resonance phase accrued until the
+    readout. The echo is encoded at the k space positions the gradient moments of the sequence
+    reach (see k_trajectory), as in the Bloch engine. The Bloch engine starts from the relaxed
+    phantom and keeps precessing during the readout samples, so its k space differs in the
+    first gradient echo TRs and, with an off resonance map, along the frequency encoding.
+    Unspoiled sequences are supported once the transverse magnetization left at the next
+    excitation is below SPOILING_TOLERANCE in every voxel.
+    """
+    # Constructor
+    def __init__(self, phantom:Phantom, sequence:MRISequence):
+        self.phantom = phantom
+        self.sequence = sequence
+        self.contrast, self.timing = analyze(sequence)
+        self.k_space = np.zeros((0, 0), dtype=complex)
+        self._isRunning = True
+
+    # Can the sequence be computed analytically (imperfect spin echo pulses & echoes of earlier TRs cannot)
+    def supports(self):
+        if self.contrast is None:
+            return False
+        if self.contrast == SPIN_ECHO and not np.all(np.asarray(self.phantom.B1) == 1):
+            return False
+        if self.timing["residual"]:
+            with np.errstate(divide='ignore'):
+                left = np.exp(-self.timing["residual"] / np.asarray(self.phantom.t2_star, dtype=float))
+            return bool(np.max(left) < SPOILING_TOLERANCE)
+        return True
+
+    # Transverse magnetization at the echo
+    def signal(self):
+        if not self.supports():
+            raise ValueError("Sequence is not a standard spin echo or gradient echo")
+
+        TR, TE = self.timing["TR"], self.timing["TE"]
+        PD, t1, t2_star = self.phantom.PD, self.phantom.t1, self.phantom.t2_star
+        angles = [value for name, value in self.sequence.get_waveform().operations if name == RF_OPERATION]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            E1 = np.exp(-TR/t1)
+            E2 = np.exp(-TE/t2_star)
+            if self.contrast == SPIN_ECHO:
+                tau = self.timing["tau"]
+                magnitude = PD * (1 - 2*np.exp(-(TR - tau)/t1) + E1) * E2
+                # Excited along ±y and refocused to the opposite side, the phase before the
+                # refocusing pulse is reversed
+                phase = np.exp(-2j * np.pi * self.phantom.dB * ((TE - 2*tau) / 1000))
+                return -1j * np.sign(angles[0]) * magnitude * phase
+
+            angle = np.radians(angles[0] * np.asarray(self.phantom.B1))
+            magnitude = PD * np.sin(angle) * (1 - E1) / (1 - np.cos(angle)*E1) * E2
+            # Excited along +y
+            return 1j * magnitude * np.exp(-2j * np.pi * self.phantom.dB * (TE / 1000))
+
+    # Same interface as the Bloch simulator
+    def run(self, progress=None, line_update=None, k_space:np.ndarray=None, stats=None):
+        N = self.phantom.width
+        meter = ProgressMeter(N)
+        lines = self.sequence.get_pe_order(N)
+        positions = k_trajectory(self.sequence.get_waveform().operations, lines, N)
+        result = encode(np.nan_to_num(self.signal()), lines, positions)
+        if k_space is None:
+            k_space = result
+        else:
+            k_space[...] = result
+        self.k_space = k_space
+
+        if line_update is not None:
+            for pe_gradient in lines:
+                line_update(pe_gradient)
+        if progress is not None:
+            progress(100)
+        if stats is not None:
+            stats(meter.update(self.phantom.width, self.phantom.width**2))
+        return self.k_space
+
+    # Nothing to interrupt, kept for parity with the simulator
+    def pause(self):
+        self._isRunning = False
+
+    def isRunning(self):
+        return self._isRunning
+
+
+# Compute the k space & image of a standard sequence (raises ValueError if unsupported)
+def analytic_simulate(phantom:Phantom, sequence:MRISequence):
+    k_space = AnalyticEngine(phantom, sequence).run()
+    return k_space, reconstruct(k_space)
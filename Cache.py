@@ -0,0 +1,166 @@
+# Purpose: Content-addressed cache of simulation results (memory LRU + disk)
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Numpy library
+import numpy as np
+
+from Simulator import ENGINE_VERSION, phantom_digest
+from RFPulse import is_pulse_file
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "mri-simulator")
+DEFAULT_DISK_BYTES = 1024**3 # Disk cache budget, least recently used results are deleted first
+
+
+# Description of a component, with the samples of a pulse read from a file rather than its path
+def component_description(component):
+    description = sorted(vars(component).items())
+    shape = getattr(component, "shape", None)
+    if is_pulse_file(shape):
+        samples = np.ascontiguousarray(np.load(shape), dtype=float)
+        description.append(("shape_samples", hashlib.sha256(samples.tobytes()).hexdigest()))
+    return [type(component).__name__, description]
+
+
+# Hash of everything a simulation result depends on
+def simulation_key(phantom, sequence):
+    digest = hashlib.sha256()
+    digest.update(f"engine={ENGINE_VERSION}".encode())
+
+    # Phantom maps & the starting magnetization
+    digest.update(phantom_digest(phantom).encode())
+
+    # Compiled sequence
+    description = {"TR": sequence.get_TR(),
+                   "TE": sequence.get_TE(),
+                   "trajectory": sequence.get_trajectory(),
+                   "ordering": [sequence.get_ordering(), sequence.seed],
+                   "components": [component_description(component) for component in sequence.get_components()]}
+    digest.update(json.dumps(description, default=str).encode())
+
+    return digest.hexdigest()
+
+
+# Simulation result cache
+class SimulationCache():
+    def __init__(self, max_items:int=16, directory:str=None, max_disk_bytes:int=DEFAULT_DISK_BYTES):
+        """
+        Parameters:
+        max_items (int): Number of results kept in memory.
+        directory (str): Directory of the disk cache, None to keep results in memory only.
+        max_disk_bytes (int): Size of the disk cache, the results used least recently (oldest
+            modification time, refreshed on every hit) are deleted first. None for no limit.
+        """
+        self.max_items = max_items
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.items = OrderedDict()
+        self.lock = threading.RLock() # Results are stored from worker threads
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.items)
+
+    def key(self, phantom, sequence):
+        return simulation_key(phantom, sequence)
+
+    def path(self, key:str):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    # Get a result {"k_space", "image", "M"} or None, its arrays are read only (shared by every hit)
+    def get(self, key:str):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+
+            if self.directory is not None and os.path.exists(self.path(key)):
+                try:
+                    with np.load(self.path(key)) as data:
+                        result = {name: data[name] for name in data.files}
+                    os.utime(self.path(key)) # Recently used
+                except (OSError, ValueError):
+                    self.remove_file(self.path(key))
+                else:
+                    self.remember(key, result)
+                    self.hits += 1
+                    return result
+
+            self.misses += 1
+            return None
+
+    # Store copies of a result
+    def put(self, key:str, k_space:np.ndarray, image:np.ndarray, M:np.ndarray):
+        result = {"k_space": np.array(k_space), "image": np.array(image), "M": np.array(M)}
+        self.remember(key, result)
+
+        if self.directory is not None:
+            # Write then rename so a crash never leaves a truncated entry, under a name of its own
+            # as the same result may be stored by several threads
+            descriptor, temporary = tempfile.mkstemp(suffix=".tmp", prefix=key, dir=self.directory)
+            try:
+                with os.fdopen(descriptor, "wb") as file:
+                    np.savez(file, **result)
+            except BaseException:
+                self.remove_file(temporary)
+                raise
+            with self.lock:
+                os.replace(temporary, self.path(key))
+                self.evict()
+
+        return result
+
+    # Delete the least recently used results until the disk cache fits its budget
+    def evict(self):
+        if self.max_disk_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            self.remove_file(os.path.join(self.directory, name))
+            total -= size
+
+    def remove_file(self, path:str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # Add to the in memory LRU, read only so no caller can alter later hits
+    def remember(self, key:str, result:dict):
+        for array in result.values():
+            array.flags.writeable = False
+        with self.lock:
+            self.items[key] = result
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    # Remove every result
+    def clear(self, disk:bool=False):
+        with self.lock:
+            self.items.clear()
+            if disk and self.directory is not None:
+                for name in os.listdir(self.directory):
+                    if name.endswith(".npz"):
+                        self.remove_file(os.path.join(self.directory, name))
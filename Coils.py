@@ -0,0 +1,166 @@
+# Purpose: Receive coil arrays, undersampled acquisitions and parallel imaging reconstructions (SENSE, GRAPPA)
+
+# Numpy library
+import numpy as np
+
+from Phantom import Phantom
+from MRISequence import MRISequence, order_lines
+from Simulator import Simulator, SnapshotStore
+
+DEFAULT_COILS = 8
+DEFAULT_REGULARIZATION = 1e-3 # Tikhonov weight relative to the mean eigenvalue
+
+
+# Synthetic sensitivities of coils evenly spaced on a ring around the field of view
+def coil_sensitivities(N:int, coils:int=DEFAULT_COILS, radius:float=1.0):
+    """
+    Every coil is a long wire parallel to B0 at angle 2πc/C on a circle of the given radius
+    (in fields of view, the phantom spans -0.5 .. 0.5), so its sensitivity falls off as 1/d
+    with a phase following the direction of its field.
+
+    Returns:
+    sensitivities (np.ndarray): Complex maps (coils, N, N), root sum of squares peaking at 1.
+    """
+    positions = (np.arange(N) + 0.5) / N - 0.5
+    z = positions[:, None] + 1j * positions[None, :] # x along the first axis, y along the second
+    centers = radius * np.exp(2j * np.pi * np.arange(coils) / coils)
+
+    sensitivities = 1 / (z[None] - centers[:, None, None])
+    return sensitivities / np.sqrt((np.abs(sensitivities)**2).sum(axis=0)).max()
+
+
+# Phase encoding lines of the calibration (ACS) block at the center of k space
+def acs_range(N:int, acs:int):
+    start = max(N // 2 - acs // 2, 0)
+    return start, min(start + acs, N)
+
+
+# Phase encoding lines acquired: every acceleration-th line and the calibration block
+def sampling_mask(N:int, acceleration:int=1, acs:int=0):
+    if acceleration < 1:
+        raise ValueError("Acceleration must be at least 1")
+    mask = np.arange(N) % acceleration == 0
+    start, stop = acs_range(N, acs)
+    mask[start:stop] = True
+    return mask
+
+
+def sampled_lines(N:int, acceleration:int=1, acs:int=0):
+    return np.flatnonzero(sampling_mask(N, acceleration, acs))
+
+
+# Simulate an undersampled multi coil acquisition (one simulation, every coil at once)
+def acquire(phantom:Phantom, sequence:MRISequence, sensitivities:np.ndarray, acceleration:int=1, acs:int=0,
+            progress=None, snapshots:SnapshotStore=None):
+    """
+    The acquired lines follow the phase encoding order of the sequence.
+
+    Returns:
+    k_spaces (np.ndarray): Complex k spaces (coils, N, N), zero on the lines not acquired.
+    """
+    lines = order_lines(sampled_lines(phantom.width, acceleration, acs), phantom.width, sequence.get_ordering(), sequence.seed)
+    return Simulator(phantom, sequence, snapshots, coils=sensitivities, lines=lines).run(progress=progress)
+
+
+# Complex image of every coil
+def coil_images(k_spaces:np.ndarray):
+    return np.fft.ifft2(k_spaces, axes=(-2, -1))
+
+
+# Combine coil images: sensitivity weighted when the maps are known, root sum of squares otherwise
+def combine(images:np.ndarray, sensitivities:np.ndarray=None):
+    if sensitivities is None:
+        return np.sqrt((np.abs(images)**2).sum(axis=0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        combined = (np.conj(sensitivities) * images).sum(axis=0) / (np.abs(sensitivities)**2).sum(axis=0)
+    return np.abs(np.nan_to_num(combined))
+
+
+# Regularized least squares solution of A x = b for stacks of small systems
+def solve(A:np.ndarray, b:np.ndarray, regularization:float):
+    AhA = np.conj(np.swapaxes(A, -1, -2)) @ A
+    scale = np.trace(AhA, axis1=-2, axis2=-1).real[..., None, None] / AhA.shape[-1]
+    AhA = AhA + regularization * scale * np.eye(AhA.shape[-1])
+    return np.linalg.solve(AhA, np.conj(np.swapaxes(A, -1, -2)) @ b)
+
+
+# SENSE: unfold the aliased coil images with the sensitivity maps
+def sense_reconstruct(k_spaces:np.ndarray, sensitivities:np.ndarray, acceleration:int, regularization:float=0):
+    """
+    Only the regularly sampled lines (every acceleration-th) are used, extra calibration
+    lines are ignored.
+
+    Parameters:
+    k_spaces (np.ndarray): Undersampled k spaces (coils, N, N).
+    sensitivities (np.ndarray): Coil maps (coils, N, N).
+    acceleration (int): Undersampling factor along the phase encoding axis (divides N).
+    regularization (float): Tikhonov weight relative to the mean eigenvalue of each system.
+
+    Returns:
+    image (np.ndarray): Magnitude image (N, N).
+    """
+    C, N, _ = k_spaces.shape
+    if N % acceleration:
+        raise ValueError("The acceleration must divide the phantom size")
+    folded_size = N // acceleration
+
+    # Aliased images: every pixel y sums the pixels y + r N/acceleration
+    aliased = coil_images(k_spaces * sampling_mask(N, acceleration)) * acceleration
+
+    # One C x acceleration system per aliased pixel (x, y)
+    A = sensitivities.reshape(C, N, acceleration, folded_size).transpose(1, 3, 0, 2)
+    b = aliased[:, :, :folded_size].transpose(1, 2, 0)[..., None]
+    unfolded = solve(A, b, regularization)[..., 0] # (N, folded_size, acceleration)
+
+    return np.abs(unfolded.transpose(0, 2, 1).reshape(N, N))
+
+
+# GRAPPA: fill the missing lines from their acquired neighbours with weights calibrated on the ACS block
+def grappa_fill(k_spaces:np.ndarray, acceleration:int, acs:int, regularization:float=DEFAULT_REGULARIZATION):
+    """
+    Every missing line between the acquired lines ky and ky + acceleration is a linear
+    combination of both lines (3 frequency encoding neighbours, every coil).
+
+    Returns:
+    k_spaces (np.ndarray): Filled k spaces (coils, N, N), acquired lines unchanged.
+    """
+    C, N, _ = k_spaces.shape
+    R = acceleration
+    start, stop = acs_range(N, acs)
+    if stop - start < R + 1:
+        raise ValueError("GRAPPA needs at least acceleration + 1 calibration lines")
+
+    padded = np.pad(k_spaces, ((0, 0), (1, 1), (0, 0)))
+
+    # Kernel sources (N x blocks, coils x 2 lines x 3 neighbours) of the blocks starting at lines
+    def sources(lines):
+        points = np.stack([padded[:, dx:dx + N][:, :, (lines + dy) % N] for dy in (0, R) for dx in range(3)])
+        return points.transpose(2, 3, 1, 0).reshape(N * len(lines), -1)
+
+    # Missing lines (N x blocks, coils x (R - 1)) of the blocks starting at lines
+    def targets(lines):
+        points = np.stack([k_spaces[:, :, (lines + dy) % N] for dy in range(1, R)])
+        return points.transpose(2, 3, 1, 0).reshape(N * len(lines), -1)
+
+    calibration = np.arange(start, stop - R)
+    weights = solve(sources(calibration), targets(calibration), regularization)
+
+    blocks = np.arange(0, N, R)
+    estimates = (sources(blocks) @ weights).reshape(N, len(blocks), C, R - 1)
+
+    acquired = sampling_mask(N, R, acs)
+    filled = np.array(k_spaces)
+    for dy in range(1, R):
+        lines = (blocks + dy) % N
+        missing = ~acquired[lines]
+        filled[:, :, lines[missing]] = estimates[..., dy - 1][:, missing].transpose(2, 0, 1)
+    return filled
+
+
+def grappa_reconstruct(k_spaces:np.ndarray, acceleration:int, acs:int, regularization:float=DEFAULT_REGULARIZATION):
+    """
+    Returns:
+    image (np.ndarray): Root sum of squares magnitude image (N, N).
+    """
+    return combine(coil_images(grappa_fill(k_spaces, acceleration, acs, regularization)))
@@ -14,12 +14,15 @@ class Component:
         
 # Radio frequency pulse component
 class RFComponent(Component):
-    def __init__(self, time, duration, angle):
+    def __init__(self, time, duration, angle, shape="hard", samples=None, tbw=None):
         super().__init__(time, duration)
         self.angle = angle
+        self.shape = shape # hard (instantaneous), sinc, gaussian, .npy path or samples
+        self.samples = samples # Time steps of the shaped pulse
+        self.tbw = tbw # Time bandwidth product
 
     def __repr__(self):
-        return f"RF t={self.time}ms duration={self.duration}ms angle={self.angle}°"
+        return f"RF t={self.time}ms duration={self.duration}ms angle={self.angle}° shape={self.shape}"
 
 
 # Relaxation component
@@ -33,10 +36,11 @@ class RelaxationComponent(Component):
 
 # Multi gradient component
 class MultiGradientComponent(Component):
-    def __init__(self, time, duration, sign, balanced=False):
+    def __init__(self, time, duration, sign, balanced=False, step=1):
         super().__init__(time, duration)
         self.sign = sign
         self.balanced = balanced
+        self.step = step # Phase encoding table scale
 
     def __repr__(self):
         return f"Multi Gradient t={self.time}ms duration={self.duration}ms"
@@ -44,7 +48,7 @@ class MultiGradientComponent(Component):
 
 # Gradient component        
 class GradientComponent(Component):
-    def __init__(self, time:float, duration:float, encoding:str, sign, balanced=False):
+    def __init__(self, time:float, duration:float, encoding:str, sign, balanced=False, step=1):
         super().__init__(time, duration)
         if encoding != "phase" and encoding != "frequency":
             raise ValueError("Encoding must be either phase or frequency")
@@ -52,6 +56,7 @@ class GradientComponent(Component):
         self.sign = sign        
         self.encoding = encoding
         self.balanced = balanced
+        self.step = step # Moment in half k space extents
 
     def __repr__(self):
         return f"{self.encoding} Gradient t={self.time}ms duration={self.duration}ms balanced={self.balanced}"
@@ -0,0 +1,245 @@
+# Purpose: Dynamic (cine) phantoms simulated frame by frame, recomputing only the voxels that changed
+
+# Numpy library
+import numpy as np
+
+from Phantom import Phantom, B1
+from MRISequence import MRISequence
+from Simulator import Simulator, reconstruct
+
+# Maps of a phantom, a voxel differing in any of them is recomputed
+MAPS = ("PD", "t1", "t2", "t2_star", "dB", "B1", "M")
+
+# Frames changing more than this fraction of the voxels are simulated in full
+DEFAULT_REFRESH = 0.5
+
+
+# Time series of phantoms of the same size
+class DynamicPhantom():
+    def __init__(self, frames:list):
+        if not frames:
+            raise ValueError("A dynamic phantom needs at least one frame")
+        if any((frame.width, frame.height) != (frames[0].width, frames[0].height) for frame in frames):
+            raise ValueError("Every frame must have the size of the first one")
+        self.frames = list(frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index:int):
+        return self.frames[index]
+
+    @property
+    def width(self):
+        return self.frames[0].width
+
+    # Voxels of frame 'index' differing from the previous frame (every voxel for the first one)
+    def changes(self, index:int):
+        frame = self.frames[index]
+        if index == 0:
+            return np.ones((frame.width, frame.height), dtype=bool)
+
+        previous = self.frames[index - 1]
+        changed = np.zeros((frame.width, frame.height), dtype=bool)
+        for name in MAPS:
+            difference = np.asarray(getattr(frame, name)) != np.asarray(getattr(previous, name))
+            changed |= difference.any(axis=-1) if difference.ndim == 3 else difference
+        return changed
+
+
+# Frames of a stack of phantom arrays (frames, N, N, channels), channels as in Phantom.set_numpy
+def frames_from_numpy(stack:np.ndarray):
+    frames = []
+    for array in stack:
+        frame = Phantom()
+        frame.set_numpy(np.asarray(array, dtype=float))
+        frames.append(frame)
+    return DynamicPhantom(frames)
+
+
+# Displacement fields (frames, N, N, 2) of rigid translations, one (dx, dy) in voxels per frame
+def translation_field(N:int, shifts):
+    shifts = np.asarray(shifts, dtype=float).reshape(-1, 2)
+    return np.broadcast_to(shifts[:, None, None, :], (len(shifts), N, N, 2)).copy()
+
+
+# Frames of a phantom moved by displacement fields (frames, N, N, 2) in voxels
+def motion_frames(phantom:Phantom, displacements:np.ndarray):
+    """
+    Every voxel of a frame takes the maps & magnetization of the phantom voxel it came from
+    (nearest voxel of x - dx, y - dy), voxels coming from outside the phantom are empty.
+    """
+    N = phantom.width
+    x, y = np.meshgrid(np.arange(N), np.arange(phantom.height), indexing='ij')
+    channels = [phantom.PD, phantom.t1, phantom.t2, phantom.t2_star, phantom.dB, phantom.B1]
+    stack = np.stack([np.asarray(channel, dtype=float) for channel in channels], axis=-1)
+    M = np.asarray(phantom.M, dtype=float)
+
+    frames = []
+    for displacement in np.asarray(displacements, dtype=float):
+        source_x = np.rint(x - displacement[..., 0]).astype(int)
+        source_y = np.rint(y - displacement[..., 1]).astype(int)
+        inside = (source_x >= 0) & (source_x < N) & (source_y >= 0) & (source_y < phantom.height)
+        source_x, source_y = np.clip(source_x, 0, N - 1), np.clip(source_y, 0, phantom.height - 1)
+
+        values = np.where(inside[..., None], stack[source_x, source_y], 0)
+        values[..., B1] = np.where(inside, values[..., B1], 1)
+        frame = Phantom()
+        frame.set_numpy(values)
+        frame.M = np.where(inside[..., None], M[source_x, source_y], 0)
+        frames.append(frame)
+    return DynamicPhantom(frames)
+
+
+# Frames of a contrast enhancement: the relaxation times of the masked voxels change every frame
+def enhancement_frames(phantom:Phantom, mask:np.ndarray, t1_values, t2_values=None):
+    """
+    Parameters:
+    mask (np.ndarray): Enhancing voxels (N, N).
+    t1_values (list): T1 of the enhancing voxels in every frame (ms).
+    t2_values (list): T2 (and T2*) of the enhancing voxels in every frame, unchanged if None.
+    """
+    frames = []
+    for index, t1 in enumerate(t1_values):
+        frame = phantom.copy()
+        frame.t1 = np.where(mask, t1, frame.t1)
+        if t2_values is not None:
+            frame.t2 = np.where(mask, t2_values[index], frame.t2)
+            frame.t2_star = np.where(mask, t2_values[index], frame.t2_star)
+        frames.append(frame)
+    return DynamicPhantom(frames)
+
+
+# Simulator of a subset of the voxels of a phantom (their contribution to the k space)
+class RegionSimulator(Simulator):
+    """
+    The voxels are simulated as a column of V voxels (maps of shape (V, 1)) of a phantom keeping
+    the width of the full one, so the magnetization chain costs V voxels per operation. Only
+    the readout needs the positions: the voxels are summed per frequency encoding row and the
+    rows are encoded at once, V + N x rows per line instead of 2 N² for the full phantom.
+    """
+    # Constructor
+    def __init__(self, phantom:Phantom, sequence:MRISequence, mask:np.ndarray, coils:np.ndarray=None, lines=None):
+        self.x, self.y = np.nonzero(mask) # Sorted by row
+        self.rows, self._row_starts = np.unique(self.x, return_index=True)
+
+        region = Phantom()
+        region.width, region.height = phantom.width, phantom.height
+        for name in MAPS:
+            values = np.asarray(getattr(phantom, name))[self.x, self.y]
+            setattr(region, name, values[:, None])
+
+        super().__init__(region, sequence, None, None, None if coils is None else coils[:, self.x, self.y], lines)
+
+    # Frequency encoding phases of the rows of the region (N, rows), cached per start position
+    def fe_table(self, kx_start:float):
+        table = self._fe_tables.get(kx_start)
+        if table is None:
+            N = self.phantom.width
+            table = np.exp(-2j * np.pi * np.outer(kx_start + np.arange(N), self.rows) / N)
+            self._fe_tables[kx_start] = table
+        return table
+
+    # Read the k space line of the region
+    def readout(self, kx_start:float, ky:float, M, duration:float=0):
+        N = self.phantom.width
+        Mxy = M[:, 0, 0] + 1j * M[:, 0, 1]
+        encoded = Mxy * self.pe_vector(ky)[self.y]
+        if self.coils is not None:
+            encoded = self.coils * encoded
+        table = self.fe_table(kx_start)
+
+        if not self._off_resonance or not duration:
+            self.voxel_updates += encoded.size
+            return np.add.reduceat(encoded, self._row_starts, axis=-1) @ table.T
+
+        # Off resonance keeps precessing between the N samples of the readout
+        step = self.precession_table(duration / N)[:, 0]
+        line = np.empty(encoded.shape[:-1] + (N,), dtype=complex)
+        for fe_gradient in range(N):
+            self.checkpoint()
+            self.voxel_updates += encoded.size
+            line[..., fe_gradient] = np.add.reduceat(encoded, self._row_starts, axis=-1) @ table[fe_gradient]
+            encoded = encoded * step
+        return line
+
+
+# Simulate every frame of a dynamic phantom, recomputing only the voxels changed since the previous frame
+def iterate_frames(dynamic:DynamicPhantom, sequence:MRISequence, coils:np.ndarray=None, lines=None,
+                   incremental:bool=True, refresh:float=DEFAULT_REFRESH):
+    """
+    Every frame is an acquisition starting from the magnetization of its phantom, which is
+    replaced by the magnetization at the end of the frame (as Simulator.run does). The k space
+    is linear in the voxels, so a frame is the previous frame plus the contribution of the
+    changed voxels with their new maps minus their contribution with the previous maps; the
+    unchanged voxels keep their k space contribution and final magnetization.
+
+    Parameters:
+    dynamic (DynamicPhantom): Frames.
+    sequence (MRISequence): Sequence acquired in every frame.
+    coils, lines: Receive sensitivities & acquired lines (see Simulator).
+    incremental (bool): Simulate every frame in full when False.
+    refresh (float): Fraction of changed voxels above which a frame is simulated in full.
+
+    Yields:
+    (np.ndarray, int): K space of every frame and the number of voxels simulated for it.
+    """
+    # Changes between the initial states, before the frames hold their final magnetization
+    changes = [dynamic.changes(index) for index in range(len(dynamic))]
+
+    k_space, M, previous = None, None, None
+    for frame, changed in zip(dynamic.frames, changes):
+        start = frame.copy()
+        count = int(changed.sum())
+
+        if k_space is None or not incremental or count > refresh * changed.size:
+            k_space = Simulator(frame, sequence, coils=coils, lines=lines).run()
+            M = np.copy(frame.M)
+            count = changed.size
+        else:
+            k_space = np.array(k_space)
+            M = np.array(M)
+            if count:
+                k_space -= RegionSimulator(previous, sequence, changed, coils, lines).run()
+                region = RegionSimulator(frame, sequence, changed, coils, lines)
+                k_space += region.run()
+                M[region.x, region.y] = region.phantom.M[:, 0]
+                count *= 2
+            frame.M = np.copy(M)
+
+        previous = start
+        yield k_space, count
+
+
+# Simulate a dynamic phantom (blocking)
+def simulate_frames(dynamic:DynamicPhantom, sequence:MRISequence, progress=None, coils:np.ndarray=None, lines=None,
+                    incremental:bool=True):
+    """
+    Returns:
+    k_spaces (np.ndarray): K space of every frame (frames, N, N), (frames, C, N, N) with coils.
+    images (np.ndarray): Magnitude images (frames, N, N).
+    """
+    k_spaces = []
+    for index, (k_space, _) in enumerate(iterate_frames(dynamic, sequence, coils, lines, incremental)):
+        k_spaces.append(k_space)
+        if progress is not None:
+            progress(round((index + 1) / len(dynamic) * 100))
+
+    k_spaces = np.stack(k_spaces)
+    return k_spaces, np.stack([reconstruct(k_space) for k_space in k_spaces])
+
+
+# K space of an object moving during the acquisition: every line is taken from the frame current when it is read
+def motion_k_space(k_spaces:np.ndarray, sequence:MRISequence):
+    """
+    The acquisition (lines in the order of the sequence) is split into as many consecutive
+    segments as frames, frame f being the position of the object during segment f.
+    """
+    N = k_spaces.shape[-1]
+    order = sequence.get_pe_order(N)
+    segments = np.arange(len(order)) * len(k_spaces) // len(order)
+
+    k_space = np.zeros(k_spaces.shape[1:], dtype=complex)
+    for line, frame in zip(order, segments):
+        k_space[..., line] = k_spaces[frame][..., line]
+    return k_space
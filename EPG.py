@@ -0,0 +1,174 @@
+# Purpose: Extended Phase Graph engine, dephasing states of every tissue class instead of isochromats
+
+# Numpy library
+import numpy as np
+import time
+
+from Phantom import Phantom
+from MRISequence import *
+from Simulator import Simulator, RF_OPERATION, RELAXATION_OPERATION, SPOILER_OPERATION, READOUT_OPERATION, X_AXIS, reconstruct
+from RFPulse import pulse_waveform, pulse_rotations
+
+# Dephasing orders kept (higher orders are dropped)
+DEFAULT_STATES = 64
+
+# Magnetization (Mx, My, Mz) to phase graph states (F+, F-, Z) and back
+TO_STATES = np.array([[1, 1j, 0],
+                      [1, -1j, 0],
+                      [0, 0, 1]])
+FROM_STATES = np.linalg.inv(TO_STATES)
+
+
+# Extended Phase Graph engine
+class EPGEngine(Simulator):
+    """
+    Every voxel belongs to a tissue class (same T1, T2, off resonance, B1+ and normalized
+    magnetization) and every class is described by its configuration states F+_k, F-_k, Z_k
+    for dephasing orders k = 0 .. max_states - 1, all classes updated at once:
+
+    RF pulse:    states = P R P⁻¹ states, with R the rotation of the Bloch simulator
+    Relaxation:  F *= E2, Z *= E1, Z_0 += 1 - E1, F± precess with the off resonance
+    Spoiler:     dephases the transverse states by one order (F+_k -> F+_k+1, F-_k+1 -> F-_k)
+
+    Spoiling and stimulated echoes are therefore exact up to the truncation of the highest
+    orders, for the cost of classes x states instead of voxels x isochromats. The imaging
+    gradients only move the k space position (as in the Bloch simulator) and the readouts
+    encode the F+_0 state of every voxel, scaled by its PD.
+
+    Transverse states decay with the phantom map named t2_map; the Bloch simulator uses
+    T2*, so pass t2_map="t2_star" to compare both engines.
+    """
+    # Constructor
+    def __init__(self, phantom:Phantom, sequence:MRISequence, max_states:int=DEFAULT_STATES, t2_map:str="t2", chunk_rows:int=None):
+        super().__init__(phantom, sequence, None, chunk_rows)
+        if max_states < 1:
+            raise ValueError("The phase graph needs at least one state")
+        self.max_states = int(max_states)
+        self.t2_map = t2_map
+        self._transitions = {}
+
+    # Any sequence with a readout (gradients only encode)
+    def supports(self):
+        return any(type(component) == ReadoutComponent for component in self.sequence.get_components())
+
+    # Simulate the sequence and yield the k space lines as they are read
+    def iterate(self, progress=None, stats=None):
+        self.prepare()
+        return super().iterate(progress, stats)
+
+    # Tissue classes of the phantom and their states at the current magnetization
+    def prepare(self):
+        phantom = self.phantom
+        shape = phantom.PD.shape
+
+        # Magnetization per unit of PD, relaxed where there is no signal
+        M = np.asarray(phantom.M, dtype=float).reshape(-1, 3)
+        PD = np.asarray(phantom.PD, dtype=float).ravel()
+        normalized = np.tile([0.0, 0.0, 1.0], (PD.size, 1))
+        np.divide(M, PD[:, None], out=normalized, where=PD[:, None] != 0)
+
+        keys = np.column_stack([np.ravel(phantom.t1), np.ravel(getattr(phantom, self.t2_map)),
+                                np.ravel(phantom.dB), np.ravel(phantom.B1), normalized])
+        keys, index = np.unique(keys, axis=0, return_inverse=True)
+        self.classes = keys
+        self._index = index.reshape(shape)
+
+        self._states = np.zeros((len(keys), 3, self.max_states), dtype=complex)
+        self._states[:, :, 0] = keys[:, 4:] @ TO_STATES.T
+        self._pending = []
+        self._transitions = {}
+
+    # Add an operation (applied lazily)
+    def advance(self, name:str, value):
+        self._pending.append((name, value))
+
+    # Apply the pending operations to the states
+    def apply(self):
+        states = self._states
+        for name, value in self._pending:
+            self.checkpoint()
+            self.voxel_updates += states.shape[0] * states.shape[2]
+            start = time.perf_counter()
+            if name == RF_OPERATION:
+                states = self.transition(value) @ states
+            elif name == RELAXATION_OPERATION:
+                states = self.relax(states, value)
+            elif name == SPOILER_OPERATION:
+                states = self.dephase(states)
+            self.timed(name, start)
+
+        self._states = states
+        self._pending = []
+        return states
+
+    # Apply the pending operations and return the magnetization of every voxel
+    def materialize(self):
+        return self.magnetization(self.apply())
+
+    # Read a k space line from (kx_start, ky) 'relaxation' ms after the current state
+    def read_line(self, kx_start:float, ky:float, relaxation:float, duration:float):
+        states = self.apply()
+        self.checkpoint()
+        start = time.perf_counter()
+        if relaxation > 0:
+            states = self.relax(states, relaxation)
+        line = self.readout(kx_start, ky, self.magnetization(states), duration)
+        self.timed(READOUT_OPERATION, start)
+        return line
+
+    # Net magnetization (F+_0, Z_0) of every voxel (N, N, 3)
+    def magnetization(self, states:np.ndarray):
+        Mxy = states[:, 0, 0]
+        net = np.stack([Mxy.real, Mxy.imag, states[:, 2, 0].real], axis=-1)
+        return net[self._index] * np.asarray(self.phantom.PD, dtype=float)[..., None]
+
+    # State transition matrices (classes, 3, 3) of an RF operation
+    def transition(self, pulse):
+        key = pulse if isinstance(pulse, tuple) else float(pulse)
+        transition = self._transitions.get(key)
+        if transition is None:
+            dB, B1 = self.classes[:, 2], self.classes[:, 3]
+            if isinstance(pulse, tuple):
+                angle, shape, samples, tbw, duration = pulse
+                waveform = pulse_waveform(shape if isinstance(shape, str) else list(shape), samples, tbw)
+                rotations = pulse_rotations(angle, waveform, duration or 0, dB, B1)
+            else:
+                # Rotated basis vectors are the columns of the rotations
+                basis = np.broadcast_to(np.eye(3), (len(self.classes), 3, 3))
+                rotations = np.swapaxes(self.rotation(basis, pulse * B1[:, None], X_AXIS), 1, 2)
+            transition = TO_STATES @ rotations @ FROM_STATES
+            self._transitions[key] = transition
+        return transition
+
+    # Relaxation & off resonance precession of the states during t ms
+    def relax(self, states:np.ndarray, t:float):
+        t1, t2, dB = self.classes[:, 0], self.classes[:, 1], self.classes[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            E1 = np.nan_to_num(np.exp(-t/t1))
+            E2 = np.nan_to_num(np.exp(-t/t2))
+
+        relaxed = np.empty_like(states)
+        relaxed[:, :2] = states[:, :2] * E2[:, None, None]
+        relaxed[:, 2] = states[:, 2] * E1[:, None]
+        relaxed[:, 2, 0] += 1 - E1
+
+        if self._off_resonance:
+            phase = np.exp(-2j * np.pi * dB * (t / 1000))
+            relaxed[:, 0] *= phase[:, None]
+            relaxed[:, 1] *= phase.conj()[:, None]
+        return relaxed
+
+    # Dephase the transverse states by one order (unbalanced gradient)
+    def dephase(self, states:np.ndarray):
+        dephased = np.array(states)
+        dephased[:, 0, 1:] = states[:, 0, :-1]
+        dephased[:, 1, :-1] = states[:, 1, 1:]
+        dephased[:, 1, -1] = 0
+        dephased[:, 0, 0] = dephased[:, 1, 0].conj()
+        return dephased
+
+
+# Compute the k space & image of a sequence with the phase graph engine
+def epg_simulate(phantom:Phantom, sequence:MRISequence, max_states:int=DEFAULT_STATES, t2_map:str="t2", progress=None):
+    k_space = EPGEngine(phantom, sequence, max_states, t2_map).run(progress=progress)
+    return k_space, reconstruct(k_space)
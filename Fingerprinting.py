@@ -0,0 +1,212 @@
+# Purpose: MR fingerprinting dictionaries simulated in batch and matched with SVD compression
+
+# Numpy library
+import numpy as np
+
+from Phantom import Phantom
+from MRISequence import MRISequence
+from Simulator import Simulator, X_AXIS
+
+DEFAULT_RANK = 25 # Singular vectors kept
+DEFAULT_CHUNK = 8192 # Entries simulated at once
+MATCH_BYTES = 64 * 1024**2 # Memory of the voxel x entry inner products of one match chunk
+TRAINING_ENTRIES = 2000 # Entries used to compute the SVD basis
+
+
+# Train of a sequence (MRISequence with a train section or the train itself)
+def get_train(train):
+    if isinstance(train, MRISequence):
+        train = train.get_train()
+    if train is None:
+        raise ValueError("Sequence has no fingerprinting train")
+    return train
+
+
+# Dense (T1, T2) grid, T2 <= T1
+def relaxation_grid(t1_values=None, t2_values=None):
+    t1_values = np.geomspace(50, 5000, 200) if t1_values is None else np.asarray(t1_values, dtype=float)
+    t2_values = np.geomspace(5, 2000, 200) if t2_values is None else np.asarray(t2_values, dtype=float)
+    t1, t2 = np.meshgrid(t1_values, t2_values, indexing='ij')
+    valid = t2 <= t1
+    return t1[valid], t2[valid]
+
+
+# Signal evolutions of many (T1, T2) pairs, simulated as one batch
+def simulate_evolutions(train, t1:np.ndarray, t2:np.ndarray, PD=1, physics:Simulator=None):
+    """
+    Every entry is one magnetization vector; each frame rotates all of them by the frame flip
+    angle, relaxes them to TE (signal), then to TR and spoils them if the train is spoiled.
+
+    Parameters:
+    train (dict | MRISequence): Fingerprinting train.
+    t1, t2 (np.ndarray): Relaxation times of the entries (E,).
+    PD (float | np.ndarray): Proton density of the entries.
+    physics (Simulator): Bloch simulator applying the rotations & relaxations, a new one when None.
+
+    Returns:
+    evolutions (np.ndarray): Complex transverse magnetization (E, frames).
+    """
+    train = get_train(train)
+    t1 = np.asarray(t1, dtype=float).ravel()
+    t2 = np.asarray(t2, dtype=float).ravel()
+    PD = np.broadcast_to(np.asarray(PD, dtype=float).ravel() if np.ndim(PD) else PD, t1.shape)
+    if physics is None:
+        physics = Simulator(Phantom(), MRISequence())
+
+    M = np.zeros((t1.size, 3))
+    M[:, 2] = PD
+    if train["inversion"]:
+        M = physics.rotation(M, 180, X_AXIS)
+        M = physics.relaxation(M, train["TI"], t1, t2, PD)
+
+    TE = train["TE"]
+    evolutions = np.empty((t1.size, len(train["flip_angles"])), dtype=complex)
+    for frame, (angle, TR) in enumerate(zip(train["flip_angles"], train["TR"])):
+        M = physics.rotation(M, angle, X_AXIS)
+        M = physics.relaxation(M, TE, t1, t2, PD)
+        evolutions[:, frame] = M[:, 0] + 1j * M[:, 1]
+        M = physics.relaxation(M, TR - TE, t1, t2, PD)
+        if train["spoiled"]:
+            M = physics.spoiler(M)
+
+    return np.nan_to_num(evolutions)
+
+
+# Compressed dictionary
+class Dictionary():
+    def __init__(self, t1:np.ndarray, t2:np.ndarray, atoms:np.ndarray, norms:np.ndarray, basis:np.ndarray, energy:float):
+        self.t1 = t1 # (E,)
+        self.t2 = t2 # (E,)
+        self.atoms = atoms # Normalized evolutions in the SVD basis (E, rank)
+        self.norms = norms # Norms of the evolutions (E,)
+        self.basis = basis # Temporal singular vectors (frames, rank)
+        self.energy = energy # Share of the training energy kept by the basis
+
+    def __len__(self):
+        return len(self.t1)
+
+    def __repr__(self):
+        return f"Dictionary entries={len(self)} frames={self.basis.shape[0]} rank={self.basis.shape[1]} energy={self.energy:.6f}"
+
+    # Project signals (..., frames) into the basis
+    def compress(self, signals:np.ndarray):
+        return signals @ self.basis
+
+
+# Simulate & compress a dictionary
+def build_dictionary(train, t1_values=None, t2_values=None, rank:int=DEFAULT_RANK, chunk:int=DEFAULT_CHUNK, progress=None):
+    """
+    Parameters:
+    train (dict | MRISequence): Fingerprinting train.
+    t1_values, t2_values (np.ndarray): Axes of the (T1, T2) grid (ms).
+    rank (int): Singular vectors kept.
+    chunk (int): Entries simulated at once.
+    progress (callable): Called with the progress percentage after each chunk.
+
+    Returns:
+    dictionary (Dictionary)
+    """
+    train = get_train(train)
+    t1, t2 = relaxation_grid(t1_values, t2_values)
+    physics = Simulator(Phantom(), MRISequence()) # One per dictionary, never shared between threads
+
+    # Temporal basis from a subset of the entries
+    training = np.linspace(0, len(t1) - 1, min(TRAINING_ENTRIES, len(t1))).astype(int)
+    _, singular_values, Vh = np.linalg.svd(simulate_evolutions(train, t1[training], t2[training], physics=physics), full_matrices=False)
+    rank = min(rank, len(singular_values))
+    basis = Vh[:rank].conj().T
+    energy = float((singular_values[:rank]**2).sum() / (singular_values**2).sum())
+
+    atoms = np.empty((len(t1), rank), dtype=complex)
+    norms = np.empty(len(t1))
+    for start in range(0, len(t1), chunk):
+        stop = min(start + chunk, len(t1))
+        evolutions = simulate_evolutions(train, t1[start:stop], t2[start:stop], physics=physics)
+        norms[start:stop] = np.linalg.norm(evolutions, axis=1)
+        atoms[start:stop] = (evolutions @ basis) / np.maximum(norms[start:stop], 1e-12)[:, None]
+        if progress is not None:
+            progress(round(stop / len(t1) * 100))
+
+    return Dictionary(t1, t2, atoms, norms, basis, energy)
+
+
+# Fingerprint images of a phantom (noise free, fully sampled)
+def simulate_phantom(phantom:Phantom, train):
+    """
+    The Bloch simulator of the phantom applies the train to the magnetization of every voxel,
+    from the relaxed state: its B1+ map scales the flip angles and its off resonance precesses
+    during every interval, which the dictionary entries do not model. The magnetization of
+    the phantom is left unchanged.
+
+    Returns:
+    images (np.ndarray): Complex images (frames, N, N).
+    """
+    train = get_train(train)
+    physics = Simulator(phantom, MRISequence())
+    t1, t2, PD = phantom.t1, phantom.t2, phantom.PD
+    B1 = None if np.all(phantom.B1 == 1) else phantom.B1
+
+    # Pulses scaled by the transmit field, relaxation & precession of every voxel
+    pulse = lambda M, angle: physics.rotation(M, angle if B1 is None else angle * B1, X_AXIS)
+    relax = lambda M, t: physics.precession(physics.relaxation(M, t, t1, t2, PD), t)
+
+    M = np.zeros(PD.shape + (3,))
+    M[..., 2] = PD
+    if train["inversion"]:
+        M = relax(pulse(M, 180), train["TI"])
+
+    TE = train["TE"]
+    images = np.empty((len(train["flip_angles"]),) + PD.shape, dtype=complex)
+    for frame, (angle, TR) in enumerate(zip(train["flip_angles"], train["TR"])):
+        M = relax(pulse(M, angle), TE)
+        images[frame] = M[..., 0] + 1j * M[..., 1]
+        M = relax(M, TR - TE)
+        if train["spoiled"]:
+            M = physics.spoiler(M)
+
+    return np.nan_to_num(images)
+
+
+# Best dictionary entry of every voxel
+def match(dictionary:Dictionary, images:np.ndarray, chunk:int=None):
+    """
+    Parameters:
+    dictionary (Dictionary)
+    images (np.ndarray): Fingerprint images (frames, N, N).
+    chunk (int): Voxels matched at once (chunk x entries inner products in memory), sized
+        to MATCH_BYTES by default.
+
+    Returns:
+    maps (dict): {"T1", "T2", "PD", "correlation"} (N, N), NaN where there is no signal.
+    """
+    shape = images.shape[1:]
+    signals = dictionary.compress(images.reshape(images.shape[0], -1).T) # (V, rank)
+    norms = np.linalg.norm(signals, axis=1)
+
+    # Voxels without signal are not matched
+    valid = norms > 0
+    indices = np.flatnonzero(valid)
+
+    if chunk is None:
+        chunk = max(1, MATCH_BYTES // (16 * len(dictionary)))
+
+    best = np.zeros(len(signals), dtype=int)
+    inner = np.zeros(len(signals))
+    conjugate_atoms = dictionary.atoms.conj().T
+    for start in range(0, len(indices), chunk):
+        voxels = indices[start:start + chunk]
+        products = np.abs(signals[voxels] @ conjugate_atoms)
+        best[voxels] = products.argmax(axis=1)
+        inner[voxels] = products[np.arange(len(voxels)), best[voxels]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = {"T1": dictionary.t1[best],
+                  "T2": dictionary.t2[best],
+                  "PD": inner / dictionary.norms[best],
+                  "correlation": inner / norms}
+
+    maps = {}
+    for name, value in values.items():
+        value = np.where(valid, value, np.nan)
+        maps[name] = value.reshape(shape)
+    return maps
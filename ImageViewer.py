@@ -33,7 +33,10 @@ class ImageViewer(viewer):
         # Annotation
         self.annot = self.axes.annotate("", xy=(0,0), xytext=(20,20), textcoords="offset points",
                     bbox=dict(boxstyle="round", fc="w"), arrowprops=dict(arrowstyle="->",color="white"))
+        self.annot.get_bbox_patch().set_alpha(0.75)
         self.annot.set_visible(False)
+        self.annot.set_animated(True)
+        self.overlays = [self.annot]
     
     ###############################################
     """Sequence Functions"""
@@ -49,13 +52,13 @@ class ImageViewer(viewer):
         # Draw the image        
         self.drawData(self.image, title=self.title)
         
-    def drawData(self, image, cmap=plt.cm.Greys_r, title=None):
+    def drawData(self, image, cmap=plt.cm.Greys_r, title=None, key=None):
         self.image = image
-        super().drawData(image, cmap=cmap, title=title)
+        super().drawData(image, cmap=cmap, title=title, key=key)
 
-    def drawData2(self, image, cmap=plt.cm.Greys_r):
+    def drawData2(self, image, cmap=plt.cm.Greys_r, key=None, regions=None):
         self.image = image
-        super().drawData2(image, cmap)
+        super().drawData2(image, cmap, key, regions)
         
     # Reset figure and variables
     def reset(self):
@@ -63,26 +66,8 @@ class ImageViewer(viewer):
         
     ###############################################
 
-    # Update annotation
-    def update_annotation(self, event):
-        self.annot.xy = event.xdata, event.ydata
-        self.annot.get_bbox_patch().set_alpha(0.75)
-        
-    def hover(self, event):
-        if event.xdata != None or event.ydata != None:
-            self.annot.set_visible(True)
-            self.update_annotation(event)
-
-            # X & Y
-            x = round(event.ydata)
-            y = round(event.xdata)
-            
-            # Set Text
-            index = f"{x} , {y}" # Index
-            intensity = np.round(self.image[x][y],4) # Image intensity
-            text = f"{index} = {intensity}"
-            self.annot.set_text(text)
-        else:
-            self.annot.set_visible(False)
-
-        self.fig.canvas.draw_idle()
\ No newline at end of file
+    # Hover text of a pixel
+    def inspect(self, x:int, y:int):
+        index = f"{x} , {y}" # Index
+        intensity = np.round(self.image[x][y],4) # Image intensity
+        return f"{index} = {intensity}"
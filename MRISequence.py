@@ -1,9 +1,30 @@
+import ast
+import operator
+import os
+
+# Numpy library
+import numpy as np
+
 from Component import *
+from Waveform import compile_waveform
+from RFPulse import is_pulse_file
 
 CARTESIAN_TRAJECTORY = "Cartesian"
 RADIAL_TRAJECTORY = "Radial"
 SPIRAL_TRAJECTORY = "Spiral"
 
+# Phase encoding orders
+SEQUENTIAL_ORDER = "sequential"
+CENTRIC_ORDER = "centric"
+REVERSE_CENTRIC_ORDER = "reverse_centric"
+INTERLEAVED_ORDER = "interleaved"
+RANDOM_ORDER = "random"
+
+PE_ORDERS = (SEQUENTIAL_ORDER, CENTRIC_ORDER, REVERSE_CENTRIC_ORDER, INTERLEAVED_ORDER, RANDOM_ORDER)
+
+# Operators allowed in time expressions
+TIME_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
 class MRISequence:
     def __init__(self):
         self.components = [] # List of components
@@ -11,12 +32,18 @@ class MRISequence:
         self.TR = 0 # Repetition Time
         self.TE = 0 # Echo Time
         self.trajectory = CARTESIAN_TRAJECTORY
+        self.train = None # Fingerprinting flip angle / TR train
+        self.ordering = SEQUENTIAL_ORDER # Phase encoding order
+        self.seed = 0 # Seed of the random order
+        self.waveform = None # Compiled operations & waveforms, built on first use
+        self.waveform_signature = None # Values the waveform was compiled from
         
     def __repr__(self):
         string = f"Sequence Length: {self.length}\n"
         string += f"TR: {self.TR}\n"
         string += f"TE: {self.TE}\n"
         string += f"Trajectory: {self.trajectory}\n"
+        string += f"PE Order: {self.ordering}\n"
         for component in self.components:
             string += f"{component}\n"
         
@@ -25,6 +52,7 @@ class MRISequence:
     def add_component(self, component):
         self.components.append(component)
         self.length += 1
+        self.waveform = None
     
     # Getters
     def get_components(self):
@@ -41,16 +69,58 @@ class MRISequence:
     
     def get_trajectory(self):
         return self.trajectory
+
+    def get_train(self):
+        return self.train
+
+    def get_ordering(self):
+        return self.ordering
+
+    # Operations & sampled waveforms of one TR, shared by the engines and the diagram
+    def get_waveform(self):
+        signature = self.signature()
+        if self.waveform is None or signature != self.waveform_signature:
+            self.waveform = compile_waveform(self.components, self.TR)
+            self.waveform_signature = signature
+        return self.waveform
+
+    # Values the compiled waveform depends on, components (and pulse files) can be edited in place
+    def signature(self):
+        def value(item):
+            if is_pulse_file(item):
+                try:
+                    stat = os.stat(item)
+                except OSError:
+                    return item
+                return (item, stat.st_mtime_ns, stat.st_size)
+            return item.tolist() if isinstance(item, np.ndarray) else item
+        return repr((self.TR, [(type(component).__name__, sorted((name, value(item)) for name, item in vars(component).items()))
+                               for component in self.components]))
+
+    # Phase encoding lines 0..N-1 in acquisition order
+    def get_pe_order(self, N:int):
+        return order_lines(range(N), N, self.ordering, self.seed)
     
     # Setters
     def set_TR(self, TR):
         self.TR = TR
+        self.waveform = None
         
     def set_TE(self, TE):
         self.TE = TE
     
     def set_trajectory(self, trajectory):
         self.trajectory = trajectory
+
+    def set_train(self, train):
+        self.train = train
+
+    def set_ordering(self, ordering:str, seed:int=None):
+        if ordering not in PE_ORDERS:
+            raise ValueError(f"PE order must be one of {', '.join(PE_ORDERS)}")
+        self.ordering = ordering
+        if seed is not None:
+            self.seed = seed
         
     # Sort
     def sort(self, by:str='time', reverse:bool=False):
@@ -60,6 +130,7 @@ class MRISequence:
         def get_duration(component):
             return component.duration
         
+        self.waveform = None
         if by == 'time':
             self.components.sort(key=get_time, reverse=reverse)
         elif by == 'duration':
@@ -90,4 +161,148 @@ class MRISequence:
         duration = self.TR - self.components[-1].time
         if duration > 0:
             decay_component = RelaxationComponent(self.components[-1].time, duration)
-            self.components.append(decay_component)
\ No newline at end of file
+            self.components.append(decay_component)
+            self.waveform = None
+
+# Sort phase encoding lines into an acquisition order
+def order_lines(lines, N:int, ordering:str=SEQUENTIAL_ORDER, seed:int=0, interleaves:int=2):
+    """
+    sequential:      increasing ky
+    centric:         from the k space center (line N/2) outwards, alternating sides
+    reverse_centric: from the edges to the center
+    interleaved:     every interleaves-th line, then the next ones shifted by one, ...
+    random:          reproducible permutation of the seed
+
+    Returns:
+    lines (list): The same lines in acquisition order.
+    """
+    lines = sorted(int(line) for line in lines)
+    center = N // 2
+    # Lines at the same distance: the one below the center first
+    centric = sorted(lines, key=lambda line: (abs(line - center), line > center))
+
+    if ordering == SEQUENTIAL_ORDER:
+        return lines
+    if ordering == CENTRIC_ORDER:
+        return centric
+    if ordering == REVERSE_CENTRIC_ORDER:
+        return centric[::-1]
+    if ordering == INTERLEAVED_ORDER:
+        return [line for offset in range(interleaves) for line in lines[offset::interleaves]]
+    if ordering == RANDOM_ORDER:
+        return [lines[i] for i in np.random.default_rng(seed).permutation(len(lines))]
+    raise ValueError(f"PE order must be one of {', '.join(PE_ORDERS)}")
+
+
+# Evaluate a time expression: numbers, TE, TR, + - * /, unary minus and parentheses only
+def evaluate_time(expression:str, TE, TR):
+    names = {"TE": TE, "TR": TR}
+
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in names:
+            if names[node.id] is None:
+                raise ValueError(f"{node.id} is not set")
+            return names[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in TIME_OPERATORS:
+            return TIME_OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -evaluate(node.operand)
+        raise ValueError(f"Invalid time expression: {expression!r}")
+
+    try:
+        return evaluate(ast.parse(expression, mode='eval'))
+    except (SyntaxError, ZeroDivisionError, TypeError) as e:
+        raise ValueError(f"Invalid time expression: {expression!r}") from e
+
+
+# Read time expression (e.g. "TE/2") of a sequence item
+def read_time(item, TE, TR):
+    return evaluate_time(str(item.get('time')), TE, TR)
+
+
+# Read the fingerprinting train section of a sequence
+def load_train(params:dict):
+    """
+    "train": {"flipAngles": [...], "TR": 12 or [...], "TE": 2, "inversion": true, "TI": 20, "spoiled": false}
+
+    Returns:
+    train (dict): {"flip_angles", "TR" (lists of the same length), "TE", "inversion", "TI", "spoiled"} or None.
+    """
+    train = params.get('train')
+    if train is None:
+        return None
+
+    flip_angles = [float(angle) for angle in train['flipAngles']]
+    TR = train.get('TR')
+    TR = [float(TR)] * len(flip_angles) if not isinstance(TR, list) else [float(value) for value in TR]
+    TE = float(train.get('TE', 0))
+    if len(TR) != len(flip_angles):
+        raise ValueError("The train needs one TR per flip angle")
+    if TR and TE > min(TR):
+        raise ValueError("TE of the train must be shorter than every TR")
+
+    return {"flip_angles": flip_angles,
+            "TR": TR,
+            "TE": TE,
+            "inversion": bool(train.get('inversion', False)),
+            "TI": float(train.get('TI', 0)),
+            "spoiled": bool(train.get('spoiled', False))}
+
+
+# Load a sequence from its json parameters (headless, no diagram)
+def load_sequence(params:dict):
+    sequence = MRISequence()
+
+    # Intervals
+    TR = params.get('TR')
+    TE = params.get('TE')
+    sequence.set_TR(TR)
+    sequence.set_TE(TE)
+    sequence.set_train(load_train(params))
+    sequence.set_ordering(params.get('peOrder', SEQUENTIAL_ORDER), params.get('peSeed', 0))
+
+    components = params.get('component')
+
+    ######## RF ########
+    for RF in components['RF']:
+        time = read_time(RF, TE, TR)
+        sequence.add_component(RFComponent(time, RF.get('duration'), RF.get('flipAngle'), RF.get('shape', 'hard'), RF.get('samples'), RF.get('tbw')))
+
+    ######## PE ########
+    PEs = components.get('PE')
+    # Multi PEs
+    for multi_PE in PEs.get('multi'):
+        time = read_time(multi_PE, TE, TR)
+        sequence.add_component(MultiGradientComponent(time, multi_PE.get('duration'), multi_PE.get('sign'), multi_PE.get('balanced'), multi_PE.get('step', 1)))
+
+    # Single PEs
+    for single_PE in PEs.get('single'):
+        time = read_time(single_PE, TE, TR)
+        sequence.add_component(GradientComponent(time, single_PE.get('duration'), "phase", single_PE.get('sign'), single_PE.get('balanced'), single_PE.get('step', 1)))
+
+    ######## FE ########
+    for FE in components.get('FE'):
+        time = read_time(FE, TE, TR)
+        sequence.add_component(GradientComponent(time, FE.get('duration'), "frequency", FE.get('sign'), FE.get('balanced'), FE.get('step', 1)))
+
+    ######## Spoiler ########
+    for spoiler in components.get('spoiler'):
+        time = read_time(spoiler, TE, TR)
+        sequence.add_component(SpoilerComponent(time, spoiler.get('duration')))
+
+    ######## readout/Signal ########
+    readout = components.get('readout')
+    sequence.set_trajectory(readout.get('trajectory'))
+    for signal in readout.get('signals'):
+        time = read_time(signal, TE, TR)
+        sequence.add_component(ReadoutComponent(time, signal.get('duration')))
+
+    # Sort & Add Relaxations
+    sequence.sort()
+    sequence.setup()
+
+    return sequence
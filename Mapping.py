@@ -0,0 +1,223 @@
+# Purpose: Quantitative T1/T2/PD maps fitted to stacks of reconstructions, all voxels at once
+
+import copy
+
+# Numpy library
+import numpy as np
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator, reconstruct
+from Analytic import AnalyticEngine
+
+# Voxels below this fraction of the brightest signal are not fitted
+DEFAULT_THRESHOLD = 0.02
+
+# Relaxation rates (1/ms) kept within RATE_MIN .. RATE_MAX
+RATE_MIN = 1e-5
+RATE_MAX = 10
+
+
+# Reconstructions of a sequence for every value of one parameter (e.g. TE or TR)
+def simulate_series(phantom:Phantom, params:dict, name:str, values, engine:str="bloch"):
+    """
+    Parameters:
+    phantom (Phantom): Phantom, simulated from its fully relaxed state for every value.
+    params (dict): Sequence JSON.
+    name (str): Top level sequence parameter to vary ("TE", "TR", ...).
+    values (list): Values of the parameter.
+    engine (str): "bloch" or "analytic".
+
+    Returns:
+    images (np.ndarray): Magnitude images (len(values), N, N).
+    """
+    images = []
+    for value in values:
+        series_params = copy.deepcopy(params)
+        series_params[name] = value
+        sequence = load_sequence(series_params)
+
+        series_phantom = phantom.copy()
+        series_phantom.reset_M()
+        if engine == "analytic":
+            k_space = AnalyticEngine(series_phantom, sequence).run()
+        else:
+            k_space = Simulator(series_phantom, sequence).run()
+        images.append(reconstruct(k_space))
+
+    return np.stack(images)
+
+
+# Voxels bright enough to fit
+def signal_mask(images:np.ndarray, threshold:float=DEFAULT_THRESHOLD):
+    peak = images.max(axis=0)
+    return peak > threshold * peak.max()
+
+
+# Batched Gauss-Newton (Levenberg damped) refinement of 2 parameter models
+def gauss_newton(model, params:np.ndarray, x:np.ndarray, y:np.ndarray, iterations:int=10, damping:float=1e-3):
+    """
+    Parameters:
+    model (callable): model(params (V, 2), x (K,)) -> (values (V, K), jacobian (V, K, 2)).
+    params (np.ndarray): Initial parameters (V, 2).
+    x (np.ndarray): Sequence parameter of every image (K,).
+    y (np.ndarray): Signals (V, K).
+
+    Returns:
+    params (np.ndarray): Refined parameters (V, 2).
+    """
+    for _ in range(iterations):
+        values, jacobian = model(params, x)
+        residual = y - values
+        JtJ = np.einsum('vki,vkj->vij', jacobian, jacobian)
+        Jtr = np.einsum('vki,vk->vi', jacobian, residual)
+
+        # Damping relative to the curvature of each parameter
+        JtJ[:, [0, 1], [0, 1]] *= 1 + damping
+        JtJ[:, [0, 1], [0, 1]] += 1e-12
+
+        params = params + np.linalg.solve(JtJ, Jtr[..., None])[..., 0]
+        # Amplitude >= 0, plausible rate
+        params[:, 0] = np.clip(params[:, 0], 0, None)
+        params[:, 1] = np.clip(params[:, 1], RATE_MIN, RATE_MAX)
+    return params
+
+
+# S = S0 exp(-TE R2)
+def exponential_decay(params:np.ndarray, TE:np.ndarray):
+    S0, R2 = params[:, :1], params[:, 1:]
+    decay = np.exp(-TE * R2)
+    jacobian = np.stack([decay, -TE * S0 * decay], axis=-1)
+    return S0 * decay, jacobian
+
+
+# S = A (1 - exp(-TR R1))
+def saturation_recovery(params:np.ndarray, TR:np.ndarray):
+    A, R1 = params[:, :1], params[:, 1:]
+    recovery = np.exp(-TR * R1)
+    jacobian = np.stack([1 - recovery, TR * A * recovery], axis=-1)
+    return A * (1 - recovery), jacobian
+
+
+# Decay time (T2 or T2*) & amplitude from an echo time series
+def fit_t2(images:np.ndarray, TE, mask:np.ndarray=None, iterations:int=10):
+    """
+    Log-linear fit (weighted by the squared signal) refined by Gauss-Newton on the magnitude.
+
+    Parameters:
+    images (np.ndarray): Magnitude images (K, N, N) at echo times TE (ms).
+    mask (np.ndarray): Voxels to fit, bright voxels by default.
+
+    Returns:
+    maps (dict): {"T2": (N, N) ms, "S0": (N, N)}, NaN outside the mask.
+    """
+    TE = np.asarray(TE, dtype=float)
+    mask = signal_mask(images) if mask is None else mask
+    y = images[:, mask].T # (V, K)
+
+    # Weighted linear regression of log(S) on TE
+    w = y**2
+    log_y = np.log(np.maximum(y, 1e-12))
+    sw, sx, sy = w.sum(1), (w * TE).sum(1), (w * log_y).sum(1)
+    sxx, sxy = (w * TE**2).sum(1), (w * TE * log_y).sum(1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (sw * sxy - sx * sy) / (sw * sxx - sx**2)
+    intercept = (sy - slope * sx) / sw
+    R2 = np.clip(np.nan_to_num(-slope), RATE_MIN, RATE_MAX)
+    params = np.stack([np.exp(intercept), R2], axis=-1)
+
+    params = gauss_newton(exponential_decay, params, TE, y, iterations)
+    return unpack(mask, {"S0": params[:, 0], "T2": 1 / params[:, 1]})
+
+
+# T1 & amplitude from a repetition time series (saturation recovery, TE << T1)
+def fit_t1(images:np.ndarray, TR, mask:np.ndarray=None, iterations:int=10, grid=None):
+    """
+    Grid search initialization (closed-form amplitude for every T1 of the grid) refined by
+    Gauss-Newton.
+
+    Parameters:
+    images (np.ndarray): Magnitude images (K, N, N) at repetition times TR (ms).
+    mask (np.ndarray): Voxels to fit, bright voxels by default.
+    grid (np.ndarray): T1 candidates of the initialization (ms).
+
+    Returns:
+    maps (dict): {"T1": (N, N) ms, "PD": (N, N)}, NaN outside the mask. PD carries the
+    exp(-TE/T2) weighting of the series.
+    """
+    TR = np.asarray(TR, dtype=float)
+    mask = signal_mask(images) if mask is None else mask
+    y = images[:, mask].T # (V, K)
+
+    grid = np.geomspace(10, 5000, 64) if grid is None else np.asarray(grid, dtype=float)
+    basis = 1 - np.exp(-TR[None, :] / grid[:, None]) # (G, K)
+    # Best amplitude of each candidate and the residual left
+    amplitude = y @ basis.T / (basis**2).sum(1)                      # (V, G)
+    residual = (y**2).sum(1)[:, None] - amplitude**2 * (basis**2).sum(1)
+    best = residual.argmin(axis=1)
+    params = np.stack([amplitude[np.arange(len(best)), best], 1 / grid[best]], axis=-1)
+
+    params = gauss_newton(saturation_recovery, params, TR, y, iterations)
+    return unpack(mask, {"PD": params[:, 0], "T1": 1 / params[:, 1]})
+
+
+# T1 & M0 from spoiled gradient echoes at several flip angles (DESPOT1, closed form)
+def fit_t1_vfa(images:np.ndarray, flip_angles, TR:float, mask:np.ndarray=None):
+    """
+    S / sin(α) = E1 S / tan(α) + M0 (1 - E1) is linear in S / tan(α), so E1 is the slope of
+    a per voxel regression.
+
+    Returns:
+    maps (dict): {"T1": (N, N) ms, "PD": (N, N)}, NaN outside the mask.
+    """
+    angles = np.radians(np.asarray(flip_angles, dtype=float))
+    mask = signal_mask(images) if mask is None else mask
+    y = images[:, mask].T # (V, K)
+
+    u = y / np.tan(angles)
+    v = y / np.sin(angles)
+    n = len(angles)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        E1 = (n * (u * v).sum(1) - u.sum(1) * v.sum(1)) / (n * (u**2).sum(1) - u.sum(1)**2)
+        E1 = np.clip(E1, 1e-9, 1 - 1e-9)
+        M0 = (v.sum(1) - E1 * u.sum(1)) / n / (1 - E1)
+        T1 = -TR / np.log(E1)
+    return unpack(mask, {"PD": M0, "T1": T1})
+
+
+# Maps of the fitted voxels, NaN elsewhere
+def unpack(mask:np.ndarray, values:dict):
+    maps = {}
+    for name, value in values.items():
+        image = np.full(mask.shape, np.nan)
+        image[mask] = value
+        maps[name] = image
+    return maps
+
+
+# Error statistics of a fitted map against the true map
+def compare(estimate:np.ndarray, truth:np.ndarray, mask:np.ndarray=None):
+    valid = np.isfinite(estimate) & np.isfinite(truth) & (truth > 0)
+    if mask is not None:
+        valid &= mask
+    if not np.any(valid):
+        return {"voxels": 0}
+
+    estimate, truth = estimate[valid], truth[valid]
+    relative = np.abs(estimate - truth) / truth
+    return {"voxels": int(valid.sum()),
+            "rmse": float(np.sqrt(np.mean((estimate - truth)**2))),
+            "median_relative_error": float(np.median(relative)),
+            "max_relative_error": float(relative.max()),
+            "correlation": float(np.corrcoef(estimate, truth)[0, 1]) if estimate.size > 1 and truth.std() > 0 else 1.0}
+
+
+# Compare the fitted maps against the phantom maps
+def compare_to_phantom(maps:dict, phantom:Phantom, t2_map:str="t2"):
+    """
+    T1 is compared with phantom.t1, T2 with the phantom map named t2_map and PD with phantom.PD.
+    The Bloch simulator decays the transverse magnetization with T2*, so pass t2_map="t2_star"
+    for its echo time series.
+    """
+    references = {"T1": phantom.t1, "T2": getattr(phantom, t2_map), "PD": phantom.PD}
+    return {name: compare(maps[name], reference) for name, reference in references.items() if name in maps}
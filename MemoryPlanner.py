@@ -0,0 +1,195 @@
+# Purpose: Estimate the peak memory of simulations and fit them under a memory budget
+
+import os
+
+# Numpy library
+import numpy as np
+
+from Component import RFComponent
+
+# Share of the available memory used when no budget is given
+DEFAULT_BUDGET_FRACTION = 0.8
+
+# Distinct tables cached by a run (readout start positions & precession intervals)
+FE_TABLES = 2
+PRECESSION_TABLES = 4
+
+# Smaller chunks barely save memory but slow the readout down
+MIN_CHUNK_ROWS = 64
+
+
+# Memory available to new allocations (bytes), None when unknown
+def available_memory():
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+# Resident memory of this process (bytes), None when unknown
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        # Peak instead of current size where /proc is missing (kilobytes on Linux, bytes on macOS)
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+# Default budget (bytes), None when the available memory is unknown
+def default_budget():
+    available = available_memory()
+    return None if available is None else int(available * DEFAULT_BUDGET_FRACTION)
+
+
+# Human readable size
+def format_bytes(nbytes:float):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(nbytes) < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+# Peak memory of simulations (bytes)
+def estimate_memory(N:int, precision=np.complex128, isochromats:int=1, batch:int=1, workers:int=1,
+                    snapshot_bytes:int=0, chunk_rows:int=None, off_resonance:bool=False,
+                    per_voxel_rf:bool=False, display:bool=False):
+    """
+    Parameters:
+    N (int): Phantom size (NxN).
+    precision (np.dtype): Complex type of the k space & encoding tables.
+    isochromats (int): Magnetization vectors per voxel.
+    batch (int): K spaces produced per run (realizations, coils).
+    workers (int): Concurrent runs.
+    snapshot_bytes (int): Budget of the snapshot store shared by the runs.
+    chunk_rows (int): Frequency encoding rows computed at once, None to cache whole tables.
+    off_resonance (bool): Precession tables are needed.
+    per_voxel_rf (bool): Shaped pulses or a B1+ map need per voxel rotations.
+    display (bool): The GUI keeps a magnitude copy of the k space.
+
+    Returns:
+    nbytes (int): Peak memory of all the runs.
+    """
+    complex_size = np.dtype(precision).itemsize
+    real_size = complex_size // 2
+    voxels = N * N
+
+    # Phantom maps (PD, T1, T2, T2*, dB, B1) and the magnetization with its final copy
+    per_run = 6 * voxels * real_size + 2 * 3 * voxels * real_size * isochromats
+    # Magnetization chain: current state and the temporaries of one operation
+    per_run += 3 * 3 * voxels * real_size * isochromats
+    # Readout: transverse magnetization and its phase encoded copies (one per coil)
+    per_run += (1 + batch) * voxels * complex_size * isochromats
+    # Frequency encoding tables
+    per_run += FE_TABLES * voxels * complex_size if chunk_rows is None else chunk_rows * N * complex_size
+    if off_resonance:
+        per_run += PRECESSION_TABLES * voxels * complex_size
+    if per_voxel_rf:
+        # Rotation lookup index & the gathered rotations
+        per_run += voxels * 8 + 9 * voxels * real_size * isochromats
+    # K spaces
+    per_run += batch * voxels * complex_size
+    if display:
+        per_run += batch * voxels * real_size
+
+    return workers * per_run + snapshot_bytes
+
+
+# Settings of a run that fits a budget
+class MemoryPlan():
+    def __init__(self, fits:bool, peak:int, budget:int, workers:int, snapshot_bytes:int, chunk_rows:int=None, degraded:bool=False):
+        self.fits = fits
+        self.peak = peak # Estimated peak memory (bytes)
+        self.budget = budget
+        self.workers = workers
+        self.snapshot_bytes = snapshot_bytes
+        self.chunk_rows = chunk_rows # None caches whole frequency encoding tables
+        self.degraded = degraded
+
+    def __repr__(self):
+        return f"MemoryPlan fits={self.fits} peak={format_bytes(self.peak)} workers={self.workers} chunk_rows={self.chunk_rows}"
+
+    # Explanation for the user
+    def message(self):
+        budget = "unknown" if self.budget is None else format_bytes(self.budget)
+        if not self.fits:
+            return f"The simulation needs about {format_bytes(self.peak)} of memory but the budget is {budget}. Use a smaller phantom."
+        if self.degraded:
+            return (f"The simulation was adjusted to fit the {budget} memory budget: {self.workers} worker(s), "
+                    f"{format_bytes(self.snapshot_bytes)} of snapshots, "
+                    f"{'whole' if self.chunk_rows is None else self.chunk_rows} encoding rows at once "
+                    f"(about {format_bytes(self.peak)}).")
+        return f"The simulation needs about {format_bytes(self.peak)} of memory (budget {budget})."
+
+    def to_dict(self):
+        return {"fits": self.fits, "peak": self.peak, "budget": self.budget, "workers": self.workers,
+                "snapshot_bytes": self.snapshot_bytes, "chunk_rows": self.chunk_rows, "degraded": self.degraded}
+
+
+# Fit runs of size N under a budget, degrading before refusing
+def plan_memory(N:int, budget:int=None, workers:int=1, snapshot_bytes:int=0, **options):
+    """
+    Degrade in order: compute the frequency encoding tables in row chunks, shrink the snapshot
+    store, run fewer workers (the memory they release goes back to the snapshots). The plan does not fit when one run with the smallest chunks and
+    no snapshots is still over the budget.
+
+    Parameters:
+    N (int): Phantom size (NxN).
+    budget (int): Memory budget (bytes), the default budget when None.
+    workers (int): Requested concurrent runs.
+    snapshot_bytes (int): Requested snapshot store budget.
+    options: Other estimate_memory arguments.
+
+    Returns:
+    plan (MemoryPlan)
+    """
+    if budget is None:
+        budget = default_budget()
+
+    estimate = lambda workers, snapshot_bytes, chunk_rows: estimate_memory(N, workers=workers, snapshot_bytes=snapshot_bytes, chunk_rows=chunk_rows, **options)
+
+    peak = estimate(workers, snapshot_bytes, None)
+    if budget is None or peak <= budget:
+        return MemoryPlan(True, peak, budget, workers, snapshot_bytes)
+
+    # Largest power of two row chunk that fits
+    chunk_rows = 1 << max(N - 1, 0).bit_length()
+    while chunk_rows > MIN_CHUNK_ROWS and estimate(workers, snapshot_bytes, chunk_rows) > budget:
+        chunk_rows //= 2
+
+    # Shrink the snapshot store to what is left
+    requested = snapshot_bytes
+    snapshot_bytes = int(min(requested, max(budget - estimate(workers, 0, chunk_rows), 0)))
+
+    # Fewer concurrent runs, the snapshots get what they release
+    while workers > 1 and estimate(workers, snapshot_bytes, chunk_rows) > budget:
+        workers -= 1
+        snapshot_bytes = int(min(requested, max(budget - estimate(workers, 0, chunk_rows), 0)))
+
+    peak = estimate(workers, snapshot_bytes, chunk_rows)
+    return MemoryPlan(peak <= budget, peak, budget, workers, snapshot_bytes, chunk_rows, degraded=True)
+
+
+# Plan a simulation of a phantom & a sequence
+def plan_simulation(phantom, sequence, budget:int=None, workers:int=1, snapshot_bytes:int=0, **options):
+    shaped = any(isinstance(component, RFComponent) and component.shape not in (None, "hard") for component in sequence.get_components())
+    options.setdefault("off_resonance", bool(np.any(phantom.dB)))
+    options.setdefault("per_voxel_rf", shaped or not np.all(phantom.B1 == 1))
+    return plan_memory(phantom.width, budget, workers, snapshot_bytes, **options)
@@ -0,0 +1,330 @@
+# Purpose: Live counters & gauges of the running simulations, exposed as Prometheus text over HTTP or in a file
+#
+# Metrics are disabled by default: the simulators only check REGISTRY.enabled once per TR.
+# Enable them with enable_metrics(port=..., path=...), the job server flags (--metrics,
+# --metrics-file) or, for the GUI, the MRI_METRICS_PORT / MRI_METRICS_FILE environment variables.
+
+import itertools
+import math
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from MemoryPlanner import available_memory, resident_memory
+
+PREFIX = "mri_"
+COUNTER = "counter"
+GAUGE = "gauge"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9464
+DEFAULT_INTERVAL = 5.0 # Seconds between two writes of a metrics file
+
+# Environment variables read by configure_from_environment
+PORT_VARIABLE = "MRI_METRICS_PORT"
+FILE_VARIABLE = "MRI_METRICS_FILE"
+INTERVAL_VARIABLE = "MRI_METRICS_INTERVAL"
+
+
+# Label set of a sample, in a fixed order
+def label_key(labels:dict):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key:tuple):
+    if not key:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+def format_value(value:float):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if float(value).is_integer() and abs(value) < 2**53 else repr(float(value))
+
+
+# Counter or gauge with one value per label set
+class Metric():
+    def __init__(self, name:str, kind:str, help:str):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value:float=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, value:float=1, **labels):
+        self.inc(-value, **labels)
+
+    def set(self, value:float, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def remove(self, **labels):
+        with self.lock:
+            self.values.pop(label_key(labels), None)
+
+    def samples(self):
+        with self.lock:
+            return list(self.values.items())
+
+
+# Metrics of the process, rendered in the Prometheus text format
+class MetricsRegistry():
+    def __init__(self, prefix:str=PREFIX):
+        self.prefix = prefix
+        self.enabled = False
+        self.metrics = OrderedDict()
+        self.collectors = [] # Callables yielding (name, kind, help, labels, value) when rendered
+        self.lock = threading.Lock()
+
+    def metric(self, name:str, kind:str, help:str):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(self.prefix + name, kind, help)
+            return metric
+
+    def counter(self, name:str, help:str=""):
+        return self.metric(name, COUNTER, help)
+
+    def gauge(self, name:str, help:str=""):
+        return self.metric(name, GAUGE, help)
+
+    # Add values read only when the metrics are rendered (memory, caches, queues)
+    def collector(self, collect):
+        with self.lock:
+            self.collectors.append(collect)
+        return collect
+
+    def remove_collector(self, collect):
+        with self.lock:
+            if collect in self.collectors:
+                self.collectors.remove(collect)
+
+    # Prometheus text exposition of every metric
+    def render(self):
+        with self.lock:
+            families = OrderedDict((metric.name, [metric.kind, metric.help, metric.samples()]) for metric in self.metrics.values())
+            collectors = list(self.collectors)
+
+        for collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception:
+                continue
+            for name, kind, help, labels, value in samples:
+                if value is None:
+                    continue
+                family = families.setdefault(self.prefix + name, [kind, help, []])
+                family[2].append((label_key(labels), value))
+
+        lines = []
+        for name, (kind, help, samples) in families.items():
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{format_labels(key)} {format_value(value)}" for key, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+# Default registry published by the simulators
+REGISTRY = MetricsRegistry()
+
+
+# Memory of the process
+def memory_samples():
+    yield "resident_memory_bytes", GAUGE, "Resident memory of the process", {}, resident_memory()
+    yield "available_memory_bytes", GAUGE, "Memory available to new allocations", {}, available_memory()
+
+REGISTRY.collector(memory_samples)
+
+
+# Publish the hits, misses & size of a SimulationCache or SnapshotStore (forgotten when it is deleted)
+def watch_cache(name:str, cache, registry:MetricsRegistry=REGISTRY):
+    if cache is None:
+        return None
+    reference = weakref.ref(cache)
+
+    def collect():
+        cache = reference()
+        if cache is None:
+            registry.remove_collector(collect)
+            return
+        labels = {"cache": name}
+        lookups = cache.hits + cache.misses
+        yield "cache_hits_total", COUNTER, "Cache lookups answered", labels, cache.hits
+        yield "cache_misses_total", COUNTER, "Cache lookups not answered", labels, cache.misses
+        yield "cache_hit_ratio", GAUGE, "Share of the cache lookups answered", labels, cache.hits / lookups if lookups else None
+        yield "cache_entries", GAUGE, "Entries held by the cache", labels, len(cache)
+        if hasattr(cache, "nbytes"):
+            yield "cache_bytes", GAUGE, "Memory held by the cache", labels, cache.nbytes
+
+    return registry.collector(collect)
+
+
+# Metrics of one simulation run, published after every TR
+class RunMetrics():
+    ids = itertools.count(1)
+
+    def __init__(self, engine:str, total:int, registry:MetricsRegistry=REGISTRY):
+        """
+        Counters are totals per engine, the gauges of a run (labelled with its id) are removed
+        when it finishes.
+        """
+        self.labels = {"engine": engine}
+        self.run = {"engine": engine, "run": str(next(RunMetrics.ids))}
+        self.lines = 0
+        self.voxel_updates = 0
+        self.seconds = {}
+
+        self.lines_total = registry.counter("lines_total", "K space lines completed")
+        self.voxel_updates_total = registry.counter("voxel_updates_total", "Voxels times operations applied")
+        self.operation_seconds = registry.counter("operation_seconds_total", "Time spent in every operation of the magnetization chain")
+        self.runs = registry.counter("runs_total", "Simulation runs finished")
+        self.active = registry.gauge("active_runs", "Simulation runs in progress")
+        self.run_lines = registry.gauge("run_lines", "Lines completed by a run")
+        self.run_total = registry.gauge("run_total_lines", "Lines acquired by a run")
+        self.lines_per_second = registry.gauge("run_lines_per_second", "Lines per second of a run (recent average)")
+        self.voxel_updates_per_second = registry.gauge("run_voxel_updates_per_second", "Voxel updates per second of a run (recent average)")
+        self.eta = registry.gauge("run_eta_seconds", "Estimated time left of a run")
+
+        self.active.inc(**self.labels)
+        self.run_total.set(total, **self.run)
+
+    # Publish the progress of the run
+    def update(self, lines:int, voxel_updates:int, operation_seconds:dict, stats:dict=None):
+        self.lines_total.inc(lines - self.lines, **self.labels)
+        self.voxel_updates_total.inc(voxel_updates - self.voxel_updates, **self.labels)
+        for name, seconds in operation_seconds.items():
+            self.operation_seconds.inc(seconds - self.seconds.get(name, 0), operation=name, **self.labels)
+        self.lines, self.voxel_updates, self.seconds = lines, voxel_updates, dict(operation_seconds)
+
+        self.run_lines.set(lines, **self.run)
+        if stats is not None:
+            self.lines_per_second.set(stats["lines_per_second"], **self.run)
+            self.voxel_updates_per_second.set(stats["voxel_updates_per_second"], **self.run)
+            if stats["eta"] is not None:
+                self.eta.set(stats["eta"], **self.run)
+
+    # Publish the end of the run and drop its gauges
+    def finish(self, lines:int, voxel_updates:int, operation_seconds:dict, outcome:str="completed"):
+        self.update(lines, voxel_updates, operation_seconds)
+        for gauge in (self.run_lines, self.run_total, self.lines_per_second, self.voxel_updates_per_second, self.eta):
+            gauge.remove(**self.run)
+        self.active.dec(**self.labels)
+        self.runs.inc(outcome=outcome, **self.labels)
+
+
+# Serve the metrics on http://host:port/metrics from a background thread
+class MetricsServer():
+    def __init__(self, registry:MetricsRegistry=REGISTRY, host:str=DEFAULT_HOST, port:int=DEFAULT_PORT):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                data = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Write the metrics to a file every 'interval' seconds from a background thread
+class MetricsFile():
+    def __init__(self, path:str, interval:float=DEFAULT_INTERVAL, registry:MetricsRegistry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.write()
+        self.thread.start()
+        return self
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    # Write then rename so readers never see a partial file
+    def write(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            file.write(self.registry.render())
+        os.replace(temporary, self.path)
+
+    # Stop and write the final values
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+
+# Enable the metrics and start their exporters
+def enable_metrics(port:int=None, path:str=None, interval:float=DEFAULT_INTERVAL, host:str=DEFAULT_HOST,
+                   registry:MetricsRegistry=REGISTRY):
+    """
+    Parameters:
+    port (int): Serve http://host:port/metrics, None for no server (0 picks a free port).
+    path (str): Write the metrics to this file every 'interval' seconds, None for no file.
+
+    Returns:
+    exporters (list): Started MetricsServer / MetricsFile, stop() them to shut down.
+    """
+    registry.enabled = True
+    exporters = []
+    if port is not None:
+        exporters.append(MetricsServer(registry, host, port).start())
+    if path is not None:
+        exporters.append(MetricsFile(path, interval, registry).start())
+    return exporters
+
+
+def disable_metrics(exporters:list=(), registry:MetricsRegistry=REGISTRY):
+    registry.enabled = False
+    for exporter in exporters:
+        exporter.stop()
+
+
+# Enable the metrics from MRI_METRICS_PORT / MRI_METRICS_FILE / MRI_METRICS_INTERVAL (nothing when unset)
+def configure_from_environment(registry:MetricsRegistry=REGISTRY):
+    port = os.environ.get(PORT_VARIABLE)
+    path = os.environ.get(FILE_VARIABLE)
+    if not port and not path:
+        return []
+    interval = float(os.environ.get(INTERVAL_VARIABLE) or DEFAULT_INTERVAL)
+    return enable_metrics(int(port) if port else None, path or None, interval, registry=registry)
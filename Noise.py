@@ -0,0 +1,98 @@
+# Purpose: Complex Gaussian noise added after the acquisition, calibrated to an SNR or to the readout bandwidth
+
+# Numpy library
+import numpy as np
+
+from MRISequence import MRISequence
+from Component import ReadoutComponent
+from Simulator import reconstruct
+
+# Voxels above this fraction of the brightest one make the signal of the SNR
+DEFAULT_THRESHOLD = 0.1
+
+# Noise standard deviation per sample for 1 Hz of receiver bandwidth
+DEFAULT_DENSITY = 1.0
+
+# Realizations reconstructed at once by monte_carlo
+DEFAULT_CHUNK = 64
+
+
+# Receiver bandwidth (Hz) of the readouts: N samples over the readout duration
+def readout_bandwidth(sequence:MRISequence, N:int):
+    durations = [component.duration for component in sequence.get_components() if type(component) == ReadoutComponent]
+    if not durations or not durations[0]:
+        raise ValueError("Sequence has no readout with a duration")
+    return N / (durations[0] / 1000)
+
+
+# Mean magnitude of the object in the image of a k space
+def signal_level(k_space:np.ndarray, threshold:float=DEFAULT_THRESHOLD):
+    image = reconstruct(k_space)
+    return float(image[image > threshold * image.max()].mean()) if image.max() > 0 else 0.0
+
+
+# Noise of every k space sample (per real & imaginary channel) for an image SNR
+def snr_sigma(k_space:np.ndarray, snr:float, threshold:float=DEFAULT_THRESHOLD):
+    """
+    The inverse FFT of N x N samples divides the noise by N, so the image noise is sigma / N
+    and the SNR is the mean object magnitude over it.
+    """
+    if snr <= 0:
+        raise ValueError("SNR must be positive")
+    samples = k_space.shape[-2] * k_space.shape[-1]
+    return np.sqrt(samples) * signal_level(k_space, threshold) / snr
+
+
+# Noise of every k space sample for the bandwidth of the readouts (longer readouts are less noisy)
+def bandwidth_sigma(sequence:MRISequence, N:int, density:float=DEFAULT_DENSITY):
+    return density * np.sqrt(readout_bandwidth(sequence, N))
+
+
+# K space with complex Gaussian noise, a batch of realizations when realizations is given
+def add_noise(k_space:np.ndarray, sigma:float, realizations:int=None, rng=None):
+    """
+    Parameters:
+    k_space (np.ndarray): Noiseless k space (NxN or CxNxN with coils, independent coils).
+    sigma (float): Standard deviation of the real & imaginary parts of every sample.
+    realizations (int): Number of noisy copies, stacked along a new first axis.
+    rng (np.random.Generator | int): Random generator or seed.
+
+    Returns:
+    noisy (np.ndarray): k_space.shape, or (realizations,) + k_space.shape.
+    """
+    rng = np.random.default_rng(rng)
+    shape = k_space.shape if realizations is None else (realizations,) + k_space.shape
+    noise = rng.standard_normal(shape + (2,)).view(complex)[..., 0]
+    noise *= sigma
+    noise += k_space
+    return noise
+
+
+# Magnitude images of a batch of k spaces (root sum of squares over the coil axis with coils)
+def batch_images(k_spaces:np.ndarray, coils:bool=False):
+    images = np.abs(np.fft.ifft2(k_spaces, axes=(-2, -1)))
+    if coils:
+        images = np.sqrt((images**2).sum(axis=-3))
+    return images
+
+
+# Mean, standard deviation & SNR of every voxel over noise realizations (the simulation is not re-run)
+def monte_carlo(k_space:np.ndarray, sigma:float, realizations:int, chunk:int=DEFAULT_CHUNK, rng=None):
+    """
+    Returns:
+    statistics (dict): {"mean", "std", "snr"} magnitude images (N, N).
+    """
+    rng = np.random.default_rng(rng)
+    coils = k_space.ndim == 3
+    total = np.zeros(k_space.shape[-2:])
+    total_squares = np.zeros(k_space.shape[-2:])
+    for start in range(0, realizations, chunk):
+        images = batch_images(add_noise(k_space, sigma, min(chunk, realizations - start), rng), coils)
+        total += images.sum(axis=0)
+        total_squares += (images**2).sum(axis=0)
+
+    mean = total / realizations
+    std = np.sqrt(np.maximum(total_squares / realizations - mean**2, 0) * realizations / max(realizations - 1, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr = np.where(std > 0, mean / std, np.inf)
+    return {"mean": mean, "std": std, "snr": snr}
@@ -8,6 +8,7 @@ T1 = 1
 T2 = 2
 T2_STAR = 3
 DB = 4
+B1 = 5
 
 MX = 0
 MY = 1
@@ -25,7 +26,14 @@ class Phantom():
         self.t2 = np.array([[0,0],[0,0]])                            # T2
         self.t2_star = np.array([[0,0],[0,0]])                           # T2 star
         self.PD = np.array([[0,0],[0,0]])                            # Protein Density
+        self.dB = np.array([[0,0],[0,0]])                            # Off resonance (Hz)
+        self.B1 = np.array([[1,1],[1,1]])                            # Transmit field scale (B1+)
+        self.version = 0 # Incremented when the maps or the magnetization change (call changed() after editing them in place)
         
+    # Maps or magnetization changed
+    def changed(self):
+        self.version += 1
+
     # Set Data
     def setImage(self, image:np.ndarray):
         # Make sure image is grayscale
@@ -45,6 +53,8 @@ class Phantom():
         self.t1 = np.zeros(image.shape)                      # T1
         self.t2 = np.zeros(image.shape)                      # T2
         self.t2_star = np.zeros(image.shape)                     # T2*
+        self.dB = np.zeros(image.shape)                          # Off resonance (Hz)
+        self.B1 = np.ones(image.shape)                           # Transmit field scale (B1+)
         
         self.set_random_data()
         
@@ -62,11 +72,22 @@ class Phantom():
         self.t1 = numpy_matrix[:,:,T1]                        # T1
         self.t2 = numpy_matrix[:,:,T2]                        # T2
         self.t2_star = numpy_matrix[:,:,T2_STAR]              # T2*
+        
+        # Off resonance (Hz), optional 5th channel
+        if numpy_matrix.shape[2] > DB:
+            self.dB = numpy_matrix[:,:,DB]
+        else:
+            self.dB = np.zeros((self.width, self.height))
+
+        # Transmit field scale (B1+), optional 6th channel
+        if numpy_matrix.shape[2] > B1:
+            self.B1 = numpy_matrix[:,:,B1]
+        else:
+            self.B1 = np.ones((self.width, self.height))
             
         self.M = np.zeros((self.width, self.height, 3))       # Magnetization vector
-        for i in range(self.width):
-            for j in range(self.height):
-                self.M[i][j] = (0, 0, self.PD[i][j])
+        self.M[:,:,MZ] = self.PD
+        self.changed()
 
     # Get Mz
     def getMz(self):
@@ -96,13 +117,15 @@ class Phantom():
         copy_phantom.t2 = np.copy(self.t2)
         copy_phantom.t2_star = np.copy(self.t2_star)
         copy_phantom.PD = np.copy(self.PD)
+        copy_phantom.dB = np.copy(self.dB)
+        copy_phantom.B1 = np.copy(self.B1)
         return copy_phantom
     
     # Reset Magnetization Vector
     def reset_M(self):
-        for i in range(self.width):
-            for j in range(self.height):
-                self.M[i][j] = (0, 0, self.PD[i][j])
+        self.M = np.zeros((self.width, self.height, 3))
+        self.M[:,:,MZ] = self.PD
+        self.changed()
                 
     # Set Random Data                      
     def set_random_data(self):
@@ -139,9 +162,59 @@ class Phantom():
                     self.t1[i][j] = 1500
                     self.t2[i][j] = 100
                     self.t2_star[i][j] = 35
+        self.changed()
                         
+    # Set off resonance map (Hz)
+    def set_delta_B(self, dB):
+        dB = np.asarray(dB, dtype=float)
+        if dB.shape != (self.width, self.height):
+            raise ValueError(f"Off resonance map must be {self.width}x{self.height}")
+        self.dB = dB
+        self.changed()
+
+    # Synthesize an off resonance map (Hz)
+    def generate_delta_B(self, max_hz:float=50, kind:str="linear"):
+        x, y = np.meshgrid(np.linspace(-1, 1, self.width), np.linspace(-1, 1, self.height), indexing='ij')
+        if kind == "linear":
+            # Linear shim error along x
+            dB = max_hz * x
+        elif kind == "quadratic":
+            # Susceptibility like bump at the center
+            dB = max_hz * (1 - (x**2 + y**2) / 2)
+        else:
+            raise ValueError("Kind must be either linear or quadratic")
+
+        self.dB = dB
+        self.changed()
+        return dB
+
+    # Set transmit field map (B1+, 1 is the nominal flip angle)
+    def set_B1(self, B1):
+        B1 = np.asarray(B1, dtype=float)
+        if B1.shape != (self.width, self.height):
+            raise ValueError(f"B1 map must be {self.width}x{self.height}")
+        self.B1 = B1
+        self.changed()
+
+    # Synthesize a transmit field map (B1+)
+    def generate_B1(self, max_deviation:float=0.2, kind:str="quadratic"):
+        x, y = np.meshgrid(np.linspace(-1, 1, self.width), np.linspace(-1, 1, self.height), indexing='ij')
+        if kind == "linear":
+            # Transmit gradient along x
+            B1 = 1 + max_deviation * x
+        elif kind == "quadratic":
+            # Central brightening of high field transmit coils
+            B1 = 1 + max_deviation * (1 - (x**2 + y**2))
+        else:
+            raise ValueError("Kind must be either linear or quadratic")
+
+        self.B1 = B1
+        self.changed()
+        return B1
+
     # Set T1, T2, DeltaB
     def set_information(self, t1, t2, t2_star):
         self.t1 = t1
         self.t2 = t2
-        self.t2_star = t2_star
\ No newline at end of file
+        self.t2_star = t2_star
+        self.changed()
\ No newline at end of file
@@ -6,13 +6,16 @@
 import numpy as np
 
 # Matplotlib
-import matplotlib.image as mpimg
 from Viewer import viewer
+from utils import read_image, read_numpy
 
 # Phantom for testing
 from Phantom import *
 from phantominator import shepp_logan
 
+# Hover record of a voxel
+VOXEL_RECORD = np.dtype([("M", float, 3), ("PD", float), ("t1", float), ("t2", float), ("t2_star", float), ("dB", float), ("B1", float)])
+
 
 class PhantomViewer(viewer):
     """Phantom Viewer Class
@@ -25,6 +28,8 @@ class PhantomViewer(viewer):
 
         # Variables
         self.phantom = Phantom()
+        self.records = None # Packed voxel records of the hover, built on first use
+        self.record_sources = () # Phantom version & maps the records were built from
         self.fig.canvas.mpl_connect("motion_notify_event", self.hover)
                         
     # Set Theme
@@ -38,29 +43,30 @@ class PhantomViewer(viewer):
         # Annotation
         self.annot = self.axes.annotate("", xy=(0,0), xytext=(20,20), textcoords="offset points",
                     bbox=dict(boxstyle="round", fc="w"), arrowprops=dict(arrowstyle="->",color="white"))
+        self.annot.get_bbox_patch().set_alpha(0.75)
         self.annot.set_visible(False)
+        self.annot.set_animated(True)
+        self.overlays = [self.annot]
 
     ###############################################
     """Image Functions"""
     ###############################################
 
-    # Set image
-    def setData(self, path:str, ext:str):
-        super().setData(path)
-
+    # Set image, resampled to size x size (native size if None)
+    def setData(self, path:str, ext:str, size:int=None):
         # Reading the image
         if ext == "npy":
-            array = np.load(path)
-            self.phantom.set_numpy(array)            
+            array = read_numpy(path, size)
+        else:
+            array = read_image(path, size)
+
+        super().setData(path)
+        if array.ndim == 3:
+            self.phantom.set_numpy(array)
         else:
-            array = mpimg.imread(path)
-            if array.ndim > 2:
-                array = array[:,:,0]
-            else:
-                array = array
             self.phantom.setImage(array)
         
-        self.drawData(self.phantom.PD, title="Protein Density")
+        self.drawData(self.phantom.PD, title="Protein Density", key=PD)
         return array
 
     # Set Shepp Logan
@@ -73,7 +79,7 @@ class PhantomViewer(viewer):
             image = image
 
         self.phantom.setImage(image)
-        self.drawData(self.phantom.PD, title="Protein Density")
+        self.drawData(self.phantom.PD, title="Protein Density", key=PD)
         return image
 
     # Set constant
@@ -82,14 +88,14 @@ class PhantomViewer(viewer):
         image = image * value
 
         self.phantom.setImage(image)
-        self.drawData(self.phantom.PD, title="Protein Density")
+        self.drawData(self.phantom.PD, title="Protein Density", key=PD)
         return image
 
     # Set specific array
     def setArray(self, array):
         array = np.array(array)
         self.phantom.setImage(array)
-        self.drawData(self.phantom.PD, title="Protein Density")
+        self.drawData(self.phantom.PD, title="Protein Density", key=PD)
     
     # Generate gradient
     def generate_gradient(self, N, color1=0, color2=255, direction="horizontal"):
@@ -114,7 +120,7 @@ class PhantomViewer(viewer):
             image = image
 
         self.phantom.setImage(image)
-        self.drawData(self.phantom.PD, title="Protein Density")
+        self.drawData(self.phantom.PD, title="Protein Density", key=PD)
         return image
         
     # Get phantom
@@ -124,13 +130,17 @@ class PhantomViewer(viewer):
     # Change attribute
     def changeAttribute(self, attribute):
         if attribute == PD:
-            self.drawData(self.phantom.PD, title="Protein Density")
+            self.drawData(self.phantom.PD, title="Protein Density", key=PD)
         elif attribute == T1:
-            self.drawData(self.phantom.t1, title="T1")
+            self.drawData(self.phantom.t1, title="T1", key=T1)
         elif attribute == T2:
-            self.drawData(self.phantom.t2, title="T2")
+            self.drawData(self.phantom.t2, title="T2", key=T2)
         elif attribute == T2_STAR:
-            self.drawData(self.phantom.t2_star, title="T2*")
+            self.drawData(self.phantom.t2_star, title="T2*", key=T2_STAR)
+        elif attribute == DB:
+            self.drawData(self.phantom.dB, title="Delta B (Hz)", key=DB)
+        elif attribute == B1:
+            self.drawData(self.phantom.B1, title="B1+ Scale", key=B1)
                     
     # Reset figure and variables
     def reset(self):
@@ -145,29 +155,29 @@ class PhantomViewer(viewer):
     """plt Functions"""
     ###############################################
 
-    # Update annotation
-    def update_annotation(self, event):
-        self.annot.xy = event.xdata, event.ydata
-        self.annot.get_bbox_patch().set_alpha(0.75)
-        
-    def hover(self, event):
-        if event.xdata != None or event.ydata != None:
-            self.annot.set_visible(True)
-            self.update_annotation(event)
-            
-            # X & Y
-            x = round(event.ydata)
-            y = round(event.xdata)
-            
-            MText = f"(x,y,z)=({round(self.phantom.M[x][y][0],2)}, {round(self.phantom.M[x][y][1],2)}, {round(self.phantom.M[x][y][2],2)})"
-            pdText = f"PD={round(self.phantom.PD[x][y],2)}"
-            t1Text = f"T1={round(self.phantom.t1[x][y],2)}"
-            t2Text = f"T2={round(self.phantom.t2[x][y],2)}"
-            t2sText = f"T2*= {round(self.phantom.t2_star[x][y],2)}"
-
-            text = f"{MText}\n{pdText}\n{t1Text}\n{t2Text}\n{t2sText}"
-            self.annot.set_text(text)
-        else:
-            self.annot.set_visible(False)
-
-        self.fig.canvas.draw_idle()
\ No newline at end of file
+    # Packed record of every voxel, rebuilt when the phantom changes (its version) or a map is replaced
+    def voxelRecords(self):
+        phantom = self.phantom
+        maps = (phantom.M, phantom.PD, phantom.t1, phantom.t2, phantom.t2_star, phantom.dB, phantom.B1)
+        sources = (phantom.version,) + maps
+        if self.records is None or len(sources) != len(self.record_sources) or sources[0] != self.record_sources[0] \
+                or any(source is not previous for source, previous in zip(sources[1:], self.record_sources[1:])):
+            records = np.zeros(np.shape(phantom.PD), dtype=VOXEL_RECORD)
+            for name, source in zip(VOXEL_RECORD.names, maps):
+                records[name] = source
+            self.records, self.record_sources = records, sources
+        return self.records
+
+    # Hover text of a voxel
+    def inspect(self, x:int, y:int):
+        record = self.voxelRecords()[x, y]
+        Mx, My, Mz = record["M"]
+        MText = f"(x,y,z)=({round(Mx,2)}, {round(My,2)}, {round(Mz,2)})"
+        pdText = f"PD={round(record['PD'],2)}"
+        t1Text = f"T1={round(record['t1'],2)}"
+        t2Text = f"T2={round(record['t2'],2)}"
+        t2sText = f"T2*= {round(record['t2_star'],2)}"
+        dBText = f"ΔB= {round(record['dB'],2)} Hz"
+        B1Text = f"B1+= {round(record['B1'],2)}"
+
+        return f"{MText}\n{pdText}\n{t1Text}\n{t2Text}\n{t2sText}\n{dBText}\n{B1Text}"
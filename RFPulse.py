@@ -0,0 +1,162 @@
+# Purpose: Shaped RF pulses simulated as time-stepped rotations composed into one effective rotation
+
+# Numpy library
+import numpy as np
+
+# Pulse shapes
+HARD_PULSE = "hard"
+SINC_PULSE = "sinc"
+GAUSSIAN_PULSE = "gaussian"
+
+# Shapes computed from their parameters (no file)
+PULSE_SHAPES = (HARD_PULSE, SINC_PULSE, GAUSSIAN_PULSE)
+
+DEFAULT_SAMPLES = 64
+DEFAULT_TBW = 4 # Time bandwidth product
+
+
+# Normalized pulse envelope
+def pulse_waveform(shape=HARD_PULSE, samples:int=DEFAULT_SAMPLES, tbw:float=DEFAULT_TBW):
+    """
+    Parameters:
+    shape (str | list): "hard", "sinc", "gaussian", a path to a .npy waveform or the samples themselves.
+    samples (int): Number of time steps.
+    tbw (float): Time bandwidth product of sinc & gaussian pulses.
+
+    Returns:
+    waveform (np.ndarray): Real envelope, maximum magnitude 1.
+    """
+    if is_pulse_file(shape):
+        waveform = np.load(shape)
+    elif not isinstance(shape, str):
+        waveform = np.asarray(shape, dtype=float)
+    else:
+        samples = samples or DEFAULT_SAMPLES
+        t = np.linspace(-0.5, 0.5, samples) # Time in pulse durations
+        if shape == HARD_PULSE:
+            waveform = np.ones(samples)
+        elif shape == SINC_PULSE:
+            # Hann windowed sinc with tbw zero crossings
+            waveform = np.sinc(tbw * t) * (0.5 + 0.5 * np.cos(2 * np.pi * t))
+        elif shape == GAUSSIAN_PULSE:
+            # Bandwidth of about tbw / duration
+            waveform = np.exp(-(np.pi * tbw * t)**2 / (4 * np.log(2)))
+        else:
+            raise ValueError("Shape must be either hard, sinc, gaussian, a .npy path or a list of samples")
+
+    waveform = np.asarray(waveform, dtype=float).ravel()
+    if waveform.size == 0 or not np.any(waveform):
+        raise ValueError("Pulse waveform is empty")
+    if not np.all(np.isfinite(waveform)):
+        raise ValueError("Pulse waveform has non finite samples")
+    waveform = waveform / np.abs(waveform).max()
+    check_area(waveform)
+    return waveform
+
+
+# Shape read from a .npy file
+def is_pulse_file(shape):
+    return isinstance(shape, str) and shape.endswith(".npy")
+
+
+# The flip angle is reached by scaling the area of the pulse, which must not vanish
+def check_area(waveform:np.ndarray):
+    if abs(np.sum(waveform)) <= 1e-9 * np.abs(waveform).sum():
+        raise ValueError("Pulse waveform has zero net area, it cannot be scaled to a flip angle")
+
+
+# Quaternion (Cayley-Klein parameters) of rotations about axes (N, 3) by angles (N,)
+def rotation_quaternions(axes:np.ndarray, angles:np.ndarray):
+    quaternions = np.empty(angles.shape + (4,))
+    quaternions[..., 0] = np.cos(angles / 2)
+    quaternions[..., 1:] = axes * np.sin(angles / 2)[..., None]
+    return quaternions
+
+
+# Product of quaternions p * q (rotation q then p)
+def compose_quaternions(p:np.ndarray, q:np.ndarray):
+    pw, px, py, pz = np.moveaxis(p, -1, 0)
+    qw, qx, qy, qz = np.moveaxis(q, -1, 0)
+    return np.stack([pw*qw - px*qx - py*qy - pz*qz,
+                     pw*qx + px*qw + py*qz - pz*qy,
+                     pw*qy - px*qz + py*qw + pz*qx,
+                     pw*qz + px*qy - py*qx + pz*qw], axis=-1)
+
+
+# Rotation matrices (..., 3, 3) of quaternions (..., 4)
+def quaternion_matrices(quaternions:np.ndarray):
+    w, x, y, z = np.moveaxis(quaternions, -1, 0)
+    return np.stack([np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w),     2*(x*z + y*w)], axis=-1),
+                     np.stack([2*(x*y + z*w),     1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=-1),
+                     np.stack([2*(x*z - y*w),     2*(y*z + x*w),     1 - 2*(x*x + y*y)], axis=-1)], axis=-2)
+
+
+# Effective rotation of a pulse for every off resonance frequency
+def pulse_rotations(flip_angle:float, waveform:np.ndarray, duration:float, frequencies:np.ndarray, scales:np.ndarray=None):
+    """
+    Compose the rotations of every time step of a pulse into one rotation per frequency.
+
+    The steps rotate about the effective field (B1 along x, off resonance along z) in the
+    same (clockwise) sense as the hard pulses & the precession of the simulator. The pulse is
+    scaled so that it flips by flip_angle on resonance.
+
+    Parameters:
+    flip_angle (float): Flip angle on resonance (degrees).
+    waveform (np.ndarray): Envelope of the pulse.
+    duration (float): Pulse duration (ms).
+    frequencies (np.ndarray): Off resonance frequencies (Hz).
+    scales (np.ndarray): Transmit field (B1+) scale of each frequency, 1 by default.
+
+    Returns:
+    rotations (np.ndarray): Rotation matrices (len(frequencies), 3, 3) applied as M' = R M.
+    """
+    frequencies = np.asarray(frequencies, dtype=float).ravel()
+    scales = np.ones(frequencies.size) if scales is None else np.asarray(scales, dtype=float).ravel()
+    dt = duration / 1000 / waveform.size # Seconds per step
+
+    # Rotation angle of each step (radians)
+    check_area(waveform)
+    b1 = np.radians(flip_angle) * waveform / waveform.sum()
+    off_resonance = 2 * np.pi * frequencies * dt
+
+    total = np.zeros((frequencies.size, 4))
+    total[:, 0] = 1
+    for amplitude in b1:
+        field = np.stack([amplitude * scales, np.zeros(frequencies.size), off_resonance], axis=-1)
+        angle = np.linalg.norm(field, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            axis = np.where(angle[:, None] > 0, field / angle[:, None], 0)
+        # Clockwise rotation
+        total = compose_quaternions(rotation_quaternions(axis, -angle), total)
+
+    return quaternion_matrices(total)
+
+
+# Transverse magnetization across the slice after a slice selective pulse
+def slice_profile(flip_angle:float, waveform:np.ndarray, duration:float, positions:np.ndarray,
+                  thickness:float=1, tbw:float=DEFAULT_TBW, refocus:bool=True):
+    """
+    Parameters:
+    flip_angle (float): Flip angle (degrees).
+    waveform (np.ndarray): Envelope of the pulse.
+    duration (float): Pulse duration (ms).
+    positions (np.ndarray): Positions along the slice select axis (in the unit of thickness).
+    thickness (float): Slice thickness, the pulse bandwidth tbw/duration maps onto it.
+    refocus (bool): Apply the slice select rephasing lobe (half the gradient area).
+
+    Returns:
+    Mxy (np.ndarray): Complex transverse magnetization of unit Mz at every position.
+    """
+    positions = np.asarray(positions, dtype=float)
+    bandwidth = tbw / (duration / 1000) # Hz
+    frequencies = positions.ravel() * bandwidth / thickness
+
+    rotations = pulse_rotations(flip_angle, waveform, duration, frequencies)
+    M = rotations[:, :, 2] # Rotation of (0, 0, 1)
+    Mxy = M[:, 0] + 1j * M[:, 1]
+
+    if refocus:
+        # Undo the phase accumulated during the second half of the pulse
+        Mxy = Mxy * np.exp(1j * np.pi * frequencies * duration / 1000)
+
+    return Mxy.reshape(positions.shape)
@@ -2,16 +2,17 @@
 
 # math & matrix computations library
 import numpy as np
-import math
 
-# MRI Sequence Diagram Library
-import mrsd
 from MRISequence import *
 from Component import *
+from Waveform import RF_OPERATION
 
 # Json library
 import json
 
+# Matplotlib
+from matplotlib.collections import LineCollection
+
 # Viewer
 from Viewer import viewer
 
@@ -23,6 +24,12 @@ GPE = "$G_{PE}$"
 GFE = "$G_{FE}$"
 SIGNAL = "Signal"
 
+## Rows of the diagram (title, waveform channel)
+ROWS = [(RF_PULSE, "rf"), (GSS, "gz"), (GPE, "gy"), (GFE, "gx"), (SIGNAL, "adc")]
+ROW_HEIGHT = 0.4 # Largest amplitude drawn in every row (rows are 1 apart)
+PE_LEVELS = 7 # Phase encoding table steps drawn
+MARGIN = 0.05 # Time margin around the components, fraction of their extent
+
 # Phantom for testing
 class SequenceViewer(viewer):
     """Phantom Viewer Class
@@ -46,9 +53,8 @@ class SequenceViewer(viewer):
         self.peAxis = "y"
         self.feAxis = "x"
         
-        # Initialize the figure
-        self.diagram = mrsd.Diagram(
-            self.axes, [RF_PULSE, GSS, GPE, GFE, SIGNAL])
+        # Compiled waveforms of the sequence (drawn as they are simulated)
+        self.waveform = None
                 
     # Set Theme
     def setTheme(self):
@@ -88,167 +94,80 @@ class SequenceViewer(viewer):
         # Intervals
         self.TR = params.get('TR')
         self.TE = params.get('TE')
-        self.sequence.set_TR(self.TR)
-        self.sequence.set_TE(self.TE)
-
-        ################# Add Intervals #################
-        self.add_intervals()
-        
-        ################# Add Components #################
-        components = params.get('component')
-        
-        ######## RF ########
-        RFs = components['RF']
-        for RF in RFs:
-            rf_pulse, gradient = self.add_RF(RF)
-        
-        ######## PE ########
-        PEs = components.get('PE')
-        # Multi PEs
-        multi_PEs = PEs.get('multi')
-        for multi_PE in multi_PEs:
-            self.add_multi_gradient(multi_PE, GPE)
-            
-        # Single PEs
-        single_PEs = PEs.get('single')
-        for single_PE in single_PEs:
-            self.add_gradient(single_PE, GPE)
 
-        ######## FE ########
-        # Single PEs
-        FEs = components.get('FE')
-        for FE in FEs:
-            self.add_gradient(FE, GFE)
+        # Time based sequence used by the simulator, its waveforms drawn below
+        self.sequence = load_sequence(params)
+        self.waveform = self.sequence.get_waveform()
 
-        ######## Spoiler ########
-        spoilers = components.get('spoiler')
-        for spoiler in spoilers:
-            self.add_spoiler(spoiler, GPE)
-            
-        ######## readout/Signal ########
-        readout = components.get('readout')
-        # Readout Parameters
-        trajectory = readout.get('trajectory')
-        self.sequence.set_trajectory(trajectory)
-        
-        signals = readout.get('signals') 
-        for signal in signals:
-            self.add_RO(signal)
+        self.add_waveforms()
+        self.add_annotations()
+        self.add_intervals()
 
-        # Sort & Add Relaxations
-        self.sequence.sort()
-        self.sequence.setup()
         self.draw()
      
     # Clear figure
     def clearData(self):
         super().clearData()
         self.sequence = MRISequence()
-        self.diagram = mrsd.Diagram(
-            self.axes, [RF_PULSE, GSS, GPE, GFE, SIGNAL])
+        self.waveform = None
 
     ###############################################
     """Sequence Functions"""
     ###############################################
 
-    # Add RF
-    def add_RF(self, RF):
-        # Get flip angle
-        flip_angle = RF.get('flipAngle')
-        flip_angle_rad = np.round(math.radians(flip_angle),2)
-        
-        # Get time and duration
-        time = self.read_time(RF)
-        duration = RF.get('duration')
-        
-        # Add RF
-        rf_pulse, gradient = self.diagram.selective_pulse(RF_PULSE, 
-                                                          GSS, 
-                                                          duration=duration, 
-                                                          pulse_amplitude=flip_angle_rad, 
-                                                          center=time, 
-                                                          gradient_amplitude=flip_angle_rad/2)
-        self.diagram.annotate(RF_PULSE, x=rf_pulse.end, y=0.2, text=rf"$\alpha$={flip_angle}")
-
-        # Add to sequence        
-        rf_comp = RFComponent(time, duration, flip_angle)
-        self.sequence.add_component(rf_comp)
-
-        return rf_pulse, gradient
-
-    # Add gradient
-    def add_gradient(self, gradient, loc):
-        time = self.read_time(gradient)
-        step = gradient.get('step')
-        sign = gradient.get('sign')
-        duration = gradient.get('duration')
-        balanced = gradient.get('balanced')
-        
-        self.diagram.gradient(loc, duration, step/2, duration, center=time)
-
-        # Add to time based sequence
-        if loc == GPE:
-            gradient_comp = GradientComponent(time, duration, "phase", sign, balanced)
-        elif loc == GFE:
-            gradient_comp = GradientComponent(time, duration, "frequency", sign, balanced)
-        
-        self.sequence.add_component(gradient_comp)
-
-    # Add multi gradient
-    def add_multi_gradient(self, gradient, loc):
-        time = self.read_time(gradient)
-        duration = gradient.get('duration')
-        sign = gradient.get('sign')
-        balanced = gradient.get('balanced')
-        
-        # Draw multi gradient and annotate        
-        self.diagram.multi_gradient(loc, amplitude=0.65, flat_top=self.TR/10, center = time)
-        if sign == True:
-            self.diagram.annotate(loc, time, 0.9, r"$\uparrow$")
-        else:
-            self.diagram.annotate(loc, time, 0.9, r"$\downarrow$")
-
-        # Add to sequence
-        gradient_comp = MultiGradientComponent(time, duration, sign, balanced)
-        self.sequence.add_component(gradient_comp)
-
-    # Add readout
-    def add_RO(self, signal):
-        time = self.read_time(signal)
-        duration = signal.get('duration')
-        adc, echo, readout = self.diagram.readout(SIGNAL, GFE, duration, ramp=0, center=self.TE+1/2*duration, gradient_amplitude=0.5)
-        
-        # Add to time based sequence
-        readout_comp = ReadoutComponent(time, duration)
-        self.sequence.add_component(readout_comp)
+    # Draw the channels of the waveform: one line collection for the channels and one for the phase encoding table
+    def add_waveforms(self):
+        waveform = self.waveform
+        curves, table = [], []
+        for row, (title, name) in enumerate(ROWS):
+            channel = getattr(waveform, name).astype(float)
+            baseline = -row
+            levels = [0]
+            if name == "gy" and np.any(waveform.pe_table):
+                levels = np.linspace(-1, 1, PE_LEVELS)
+            peak = max(np.abs(channel + level * waveform.pe_table).max() for level in levels)
+            scale = ROW_HEIGHT / peak if peak > 0 else 0
+
+            for level in levels:
+                x, y = waveform.steps(channel + level * waveform.pe_table)
+                (table if len(levels) > 1 else curves).append(np.column_stack([x, baseline + scale * y]))
+            self.axes.text(-MARGIN, baseline, title, transform=self.axes.get_yaxis_transform(), ha='right', va='center')
+
+        start, stop = self.time_range()
+        self.axes.add_collection(LineCollection([[(start, -row), (stop, -row)] for row in range(len(ROWS))], colors="#bbb", linewidths=0.8))
+        self.axes.add_collection(LineCollection(table, colors="#1f77b4", linewidths=1, alpha=0.6))
+        self.axes.add_collection(LineCollection(curves, colors="#000", linewidths=1.5))
+        self.axes.set_xlim(start, stop)
+        self.axes.set_ylim(-len(ROWS) - 0.2, 1)
+
+    # Flip angle of every RF pulse
+    def add_annotations(self):
+        for (name, value), (time, duration) in zip(self.waveform.operations, self.waveform.events):
+            if name == RF_OPERATION:
+                angle = value[0] if isinstance(value, tuple) else value
+                self.axes.annotate(rf"$\alpha$={angle}", (time + duration, ROW_HEIGHT), fontsize=10)
 
     # Add intervals
     def add_intervals(self):
-        if self.TE != 0:
-            self.diagram.interval(0, self.TE/4, -0.8, f"TE={self.TE}")
-        if self.TR != 0:
-            self.diagram.interval(0, self.TR/4, -1.2, f"TR={self.TR}")
-    
-    # Add Spoiler
-    def add_spoiler(self, spoiler, loc):
-        time = self.read_time(spoiler)
-        duration = spoiler.get('duration')
-        
-        # Draw spoiler         
-        self.diagram.gaussian_pulse(loc, amplitude=1, duration=duration, center=time)
- 
-        # Add to time based sequence
-        spoiler_comp = SpoilerComponent(time, duration)
-        self.sequence.add_component(spoiler_comp)
+        start, stop = self.time_range()
+        for row, (name, value) in enumerate([("TE", self.TE), ("TR", self.TR)]):
+            if value:
+                y = -len(ROWS) + 0.3 - 0.4 * row
+                end = min(value, stop)
+                self.axes.annotate("", (0, y), (end, y), arrowprops={'arrowstyle': '<->' if value <= stop else '<-'})
+                self.axes.text(end / 2, y + 0.05, f"{name}={value}", ha='center', va='bottom', fontsize=10)
+
+    # Time range drawn: the components and the echo, the long relaxation up to TR is cut
+    def time_range(self):
+        waveform = self.waveform
+        active = waveform.rf + np.abs(waveform.gx) + np.abs(waveform.gy) + np.abs(waveform.gz) + np.abs(waveform.pe_table) + waveform.adc
+        busy = np.flatnonzero(active)
+        stop = max(waveform.time[busy[-1] + 1] if busy.size else waveform.TR, self.TE or 0) or 1
+        return -MARGIN * stop, (1 + MARGIN) * stop
        
     # Read time
     def read_time(self, item):
-        time = str(item.get('time'))
-        time = eval(time,
-                    {}, 
-                    {"TE": self.TE, "TR": self.TR})
-        
-        return time
+        return read_time(item, self.TE, self.TR)
     
     # Get Sequence Based On time
     def get_sequence(self):
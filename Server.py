@@ -0,0 +1,687 @@
+# Purpose: Local simulation job server (asyncio, HTTP over TCP or a Unix socket)
+#
+# Endpoints:
+#   POST   /jobs                 submit {"phantom": {...}, "sequence": {...}} -> {"id": ...}
+#   GET    /jobs                 list jobs
+#   GET    /jobs/<id>            job status (?wait=1 blocks until the job ends)
+#   GET    /jobs/<id>/events     stream progress as newline-delimited json
+#   GET    /jobs/<id>/result     k space & image as .npz (?array=k_space|image for .npy)
+#   DELETE /jobs/<id>            cancel the job
+#
+# Results are released once fetched (every array of ?array fetches), finished jobs are
+# forgotten after --job-ttl seconds or when more than --max-finished of them are kept.
+#   GET    /metrics              Prometheus text metrics (with --metrics)
+#
+# Shaped RF pulses: "shape" is "hard", "sinc", "gaussian" or a list of samples (no .npy path)
+#
+# Phantom payloads:
+#   {"kind": "shepp_logan", "size": 32}
+#   {"kind": "constant", "size": 32, "value": 120}
+#   {"npy": "<base64 .npy>", "size": 64}  (NxN image or NxNx4..6 PD/T1/T2/T2*/dB/B1 maps, optional resampling)
+#
+# Engines ("engine" in the job payload):
+#   "bloch"     Bloch simulation (default)
+#   "analytic"  closed-form preview of spoiled SE/GE sequences
+#   "epg"       Extended Phase Graph simulation (exact spoiling & stimulated echoes)
+#
+# Receive coils ("coils" in the job payload, k spaces are then CxNxN):
+#   {"count": 8, "acceleration": 2, "acs": 16, "recon": "sense" | "grappa" | "rss"}
+#
+# Jobs that cannot fit in the memory budget are refused, large jobs run with chunked
+# encoding tables and wait until enough memory is released by the running ones.
+
+import argparse
+import asyncio
+import base64
+import io
+import itertools
+import json
+import os
+import socket
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlsplit, parse_qs
+
+# Numpy
+import numpy as np
+
+# Simulator core
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Component import RFComponent
+from RFPulse import PULSE_SHAPES
+from Simulator import Simulator, SnapshotStore, reconstruct
+from Cache import SimulationCache, DEFAULT_DISK_BYTES
+from Analytic import AnalyticEngine
+from Coils import coil_sensitivities, sampled_lines, sense_reconstruct, grappa_reconstruct
+from EPG import EPGEngine
+from utils import read_numpy
+from MemoryPlanner import default_budget, plan_simulation
+from Metrics import REGISTRY, CONTENT_TYPE, GAUGE, DEFAULT_INTERVAL, enable_metrics, watch_cache
+
+# Engines
+BLOCH_ENGINE = "bloch"
+ANALYTIC_ENGINE = "analytic"
+EPG_ENGINE = "epg"
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+# Retention of the finished jobs
+DEFAULT_MAX_FINISHED = 64
+DEFAULT_JOB_TTL = 3600 # Seconds
+
+HTTP_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 410: "Gone", 503: "Service Unavailable"}
+
+
+# Build a phantom from a job payload
+def phantom_from_payload(payload:dict):
+    phantom = Phantom()
+
+    if "npy" in payload:
+        array = read_numpy(io.BytesIO(base64.b64decode(payload["npy"])), payload.get("size"))
+        if array.ndim == 3:
+            phantom.set_numpy(array)
+        else:
+            phantom.setImage(array)
+        return phantom
+
+    kind = payload.get("kind", "shepp_logan")
+    size = int(payload.get("size", 32))
+    if kind == "shepp_logan":
+        from phantominator import shepp_logan
+        image = shepp_logan(size)
+    elif kind == "constant":
+        image = np.ones((size, size)) * payload.get("value", 120)
+    else:
+        raise ValueError(f"Unknown phantom kind: {kind}")
+
+    phantom.setImage(image)
+    return phantom
+
+
+# Receive coils, acquired lines & reconstruction of a job payload
+def coils_from_payload(payload:dict, N:int):
+    count = int(payload.get("count", 8))
+    acceleration = int(payload.get("acceleration", 1))
+    acs = int(payload.get("acs", 0))
+    recon = payload.get("recon", "sense" if acceleration > 1 else "rss")
+    if count < 1:
+        raise ValueError("At least one coil is needed")
+
+    sensitivities = coil_sensitivities(N, count)
+    lines = sampled_lines(N, acceleration, acs)
+    if recon == "sense":
+        if N % acceleration:
+            raise ValueError("The SENSE acceleration must divide the phantom size")
+        return sensitivities, lines, lambda k_space: sense_reconstruct(k_space, sensitivities, acceleration)
+    if recon == "grappa":
+        if acceleration < 2 or acs < acceleration + 1:
+            raise ValueError("GRAPPA needs an acceleration and at least acceleration + 1 calibration lines")
+        return sensitivities, lines, lambda k_space: grappa_reconstruct(k_space, acceleration, acs)
+    if recon == "rss":
+        return sensitivities, lines, reconstruct
+    raise ValueError(f"Unknown reconstruction: {recon}")
+
+
+# Refuse pulse shapes read from server side files, custom waveforms are sent as sample lists
+def check_pulse_shapes(sequence):
+    for component in sequence.get_components():
+        shape = getattr(component, "shape", None) if type(component) == RFComponent else None
+        if isinstance(shape, str) and shape not in PULSE_SHAPES:
+            raise ValueError(f"Pulse shape must be one of {', '.join(PULSE_SHAPES)} or a list of samples, got {shape!r}")
+
+    # Compile the pulses now so invalid waveforms are refused with the request
+    sequence.get_waveform()
+
+
+# Simulation job
+class Job():
+    def __init__(self, id:str, phantom:Phantom, sequence, snapshots:SnapshotStore=None, engine:str=BLOCH_ENGINE):
+        self.id = id
+        self.engine = engine
+        self.state = QUEUED
+        self.progress = 0
+        self.memory = 0 # Estimated peak memory (bytes)
+        self.stats = None # Lines/s, voxel updates/s & ETA
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.ended = None
+        self.k_space = None
+        self.image = None
+        self.reconstruct = reconstruct # k space -> image
+        if engine == ANALYTIC_ENGINE:
+            self.simulator = AnalyticEngine(phantom, sequence)
+            if not self.simulator.supports():
+                raise ValueError("The analytic engine only supports spin echo and gradient echo sequences spoiled (or decayed) before the next excitation")
+        elif engine == EPG_ENGINE:
+            self.simulator = EPGEngine(phantom, sequence)
+            if not self.simulator.supports():
+                raise ValueError("Sequence has no readout")
+        elif engine == BLOCH_ENGINE:
+            self.simulator = Simulator(phantom, sequence, snapshots)
+        else:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.changed = asyncio.Event()
+
+    # Wake up everyone waiting on the job
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def set_progress(self, progress:int):
+        self.progress = progress
+        self.notify()
+
+    def set_stats(self, stats:dict):
+        self.stats = stats
+
+    def set_state(self, state:str, error=None):
+        self.state = state
+        self.error = error
+        if state == RUNNING:
+            self.started = time.time()
+        elif state in FINAL_STATES:
+            self.ended = time.time()
+        self.notify()
+
+    def is_final(self):
+        return self.state in FINAL_STATES
+
+    def status(self):
+        return {"id": self.id,
+                "state": self.state,
+                "engine": self.engine,
+                "progress": self.progress,
+                "stats": self.stats,
+                "memory": self.memory,
+                "error": self.error,
+                "size": self.simulator.phantom.width,
+                "submitted": self.submitted,
+                "started": self.started,
+                "ended": self.ended}
+
+    # Wait until the job changes
+    async def wait_change(self):
+        await self.changed.wait()
+
+    # Wait until the job ends
+    async def wait(self):
+        while not self.is_final():
+            await self.wait_change()
+
+
+# Job server
+class JobServer():
+    def __init__(self, workers:int=1, max_queue:int=64, cache:SimulationCache=None, snapshots:SnapshotStore=None, memory_budget:int=None,
+                 max_finished:int=DEFAULT_MAX_FINISHED, job_ttl:float=DEFAULT_JOB_TTL):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.max_finished = max_finished # Finished jobs kept, None for no limit
+        self.job_ttl = job_ttl # Seconds a finished job is kept, None for no limit
+        self.cache = cache
+        self.snapshots = snapshots
+        self.memory_budget = memory_budget # Bytes for the jobs & the snapshots, None for no limit
+        self.reserved = 0 # Memory of the running jobs
+        self.memory = None
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.queue = None
+        self.executor = None
+        self.server = None
+        self.answered = set() # Connections whose response head is written
+        watch_cache("results", cache)
+        watch_cache("snapshots", snapshots)
+
+        # The registry only holds a weak reference, the collector goes away with the server
+        reference = weakref.ref(self)
+        def collect():
+            server = reference()
+            if server is None:
+                REGISTRY.remove_collector(collect)
+                return
+            yield from server.metric_samples()
+        self.collector = REGISTRY.collector(collect)
+
+    # Start the workers and listen on TCP (host, port) or a Unix socket (path)
+    async def start(self, host:str="127.0.0.1", port:int=8765, path:str=None):
+        self.queue = asyncio.Queue(self.max_queue)
+        self.memory = asyncio.Condition()
+        self.executor = ThreadPoolExecutor(self.workers)
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)
+            self.server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host=host, port=port)
+        return self.server
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        for job in self.jobs.values():
+            job.simulator.pause()
+        for task in self.tasks:
+            task.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+        REGISTRY.remove_collector(self.collector)
+
+    ###############################################
+    """Jobs"""
+    ###############################################
+
+    # Queue a new job
+    def submit(self, payload:dict):
+        self.forget_finished()
+        phantom = phantom_from_payload(payload.get("phantom", {}))
+        sequence = load_sequence(payload["sequence"])
+        check_pulse_shapes(sequence)
+
+        engine = payload.get("engine", BLOCH_ENGINE)
+        job = Job(str(next(self.ids)), phantom, sequence, self.snapshots, engine)
+
+        # Every coil is read from the same magnetization
+        batch = 1
+        if payload.get("coils"):
+            if engine == ANALYTIC_ENGINE:
+                raise ValueError("The analytic engine has no receive coils")
+            job.simulator.coils, job.simulator.lines, job.reconstruct = coils_from_payload(payload["coils"], phantom.width)
+            batch = len(job.simulator.coils)
+
+        # Refuse jobs that cannot fit next to the snapshots, chunk the large ones
+        plan = plan_simulation(phantom, sequence, self.job_budget(), batch=batch)
+        if not plan.fits:
+            raise ValueError(plan.message())
+        job.memory = plan.peak
+        job.simulator.chunk_rows = plan.chunk_rows
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        return job
+
+    # Drop a job and its result
+    def forget(self, job:Job):
+        self.jobs.pop(job.id, None)
+
+    # Forget the finished jobs older than job_ttl, then the oldest ones above max_finished
+    def forget_finished(self):
+        finished = sorted((job for job in self.jobs.values() if job.is_final()), key=lambda job: job.ended)
+        if self.job_ttl is not None:
+            expired = time.time() - self.job_ttl
+            while finished and finished[0].ended < expired:
+                self.forget(finished.pop(0))
+        if self.max_finished is not None:
+            for job in finished[:max(len(finished) - self.max_finished, 0)]:
+                self.forget(job)
+
+    # Memory left for the jobs (bytes), None for no limit
+    def job_budget(self):
+        if self.memory_budget is None:
+            return None
+        snapshot_bytes = 0 if self.snapshots is None else self.snapshots.max_bytes
+        return max(self.memory_budget - snapshot_bytes, 0)
+
+    # Jobs per state, queue & memory reservations (read when the metrics are rendered)
+    def metric_samples(self):
+        states = dict.fromkeys((QUEUED, RUNNING) + FINAL_STATES, 0)
+        for job in list(self.jobs.values()):
+            states[job.state] += 1
+        for state, count in states.items():
+            yield "jobs", GAUGE, "Jobs of the server per state", {"state": state}, count
+        yield "job_queue_length", GAUGE, "Jobs waiting for a worker", {}, None if self.queue is None else self.queue.qsize()
+        yield "job_reserved_memory_bytes", GAUGE, "Estimated peak memory of the running jobs", {}, self.reserved
+        yield "job_memory_budget_bytes", GAUGE, "Memory budget of the jobs & snapshots", {}, self.memory_budget
+
+    # Cancel a job (queued jobs are skipped, running jobs are paused)
+    def cancel(self, job:Job):
+        if job.is_final():
+            return
+        job.simulator.pause()
+        if job.state == QUEUED:
+            job.set_state(CANCELLED)
+
+    # Worker coroutine, one per pool slot
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.state != QUEUED:
+                    continue
+
+                # Reuse the result of an identical job
+                key = None
+                if self.cache is not None and job.engine == BLOCH_ENGINE and job.simulator.coils is None:
+                    key = self.cache.key(job.simulator.phantom, job.simulator.sequence)
+                    result = self.cache.get(key)
+                    if result is not None:
+                        job.k_space = result["k_space"]
+                        job.image = result["image"]
+                        job.progress = 100
+                        job.set_state(DONE)
+                        continue
+
+                # Wait until the job fits next to the running ones
+                budget = self.job_budget()
+                async with self.memory:
+                    await self.memory.wait_for(lambda: budget is None or self.reserved == 0 or self.reserved + job.memory <= budget)
+                    self.reserved += job.memory
+                try:
+                    if job.state != QUEUED:
+                        continue
+
+                    job.set_state(RUNNING)
+                    progress = lambda value: loop.call_soon_threadsafe(job.set_progress, value)
+                    stats = lambda value: loop.call_soon_threadsafe(job.set_stats, value)
+                    try:
+                        run = lambda: job.simulator.run(progress=progress, stats=stats)
+                        k_space = await loop.run_in_executor(self.executor, run)
+                    except Exception as e:
+                        job.set_state(CANCELLED if not job.simulator.isRunning() else FAILED, str(e) or type(e).__name__)
+                        continue
+
+                    if not job.simulator.isRunning():
+                        job.set_state(CANCELLED)
+                        continue
+
+                    job.k_space = k_space
+                    job.image = job.reconstruct(k_space)
+                    if key is not None:
+                        self.cache.put(key, job.k_space, job.image, job.simulator.phantom.M)
+                    job.set_state(DONE)
+                finally:
+                    async with self.memory:
+                        self.reserved -= job.memory
+                        self.memory.notify_all()
+            finally:
+                self.queue.task_done()
+
+    ###############################################
+    """HTTP"""
+    ###############################################
+
+    # Handle one HTTP connection
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, value = line.decode("latin-1").split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+            body = b""
+            if "content-length" in headers:
+                body = await reader.readexactly(int(headers["content-length"]))
+
+            url = urlsplit(target)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split("/") if part]
+            await self.route(writer, method, parts, query, body)
+        except Exception as e:
+            if writer in self.answered:
+                # A response is under way, a status line would corrupt it: drop the connection
+                writer.transport.abort()
+            else:
+                self.respond_json(writer, 400, {"error": str(e)})
+        finally:
+            self.answered.discard(writer)
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def route(self, writer, method, parts, query, body):
+        if parts == ["metrics"]:
+            if not REGISTRY.enabled:
+                return self.respond_json(writer, 404, {"error": "Metrics are disabled (start the server with --metrics)"})
+            if method != "GET":
+                return self.respond_json(writer, 405, {"error": "Method not allowed"})
+            return self.respond_bytes(writer, 200, CONTENT_TYPE, REGISTRY.render().encode())
+
+        if parts == ["jobs"]:
+            if method == "POST":
+                try:
+                    job = self.submit(json.loads(body))
+                except asyncio.QueueFull:
+                    return self.respond_json(writer, 503, {"error": "Job queue is full"})
+                return self.respond_json(writer, 201, job.status())
+            if method == "GET":
+                self.forget_finished()
+                return self.respond_json(writer, 200, [job.status() for job in self.jobs.values()])
+            return self.respond_json(writer, 405, {"error": "Method not allowed"})
+
+        if len(parts) < 2 or parts[0] != "jobs" or parts[1] not in self.jobs:
+            return self.respond_json(writer, 404, {"error": "Job not found"})
+
+        job = self.jobs[parts[1]]
+        action = parts[2] if len(parts) > 2 else None
+
+        if action is None and method == "DELETE":
+            self.cancel(job)
+            return self.respond_json(writer, 200, job.status())
+
+        if method != "GET":
+            return self.respond_json(writer, 405, {"error": "Method not allowed"})
+
+        if action is None:
+            if query.get("wait") in ("1", "true"):
+                await job.wait()
+            return self.respond_json(writer, 200, job.status())
+
+        if action == "events":
+            return await self.stream_events(writer, job)
+
+        if action == "result":
+            if job.state != DONE:
+                return self.respond_json(writer, 409, {"error": f"Job is {job.state}"})
+            return self.respond_result(writer, job, query.get("array"))
+
+        return self.respond_json(writer, 404, {"error": "Unknown action"})
+
+    # Write response head
+    def respond_head(self, writer, code:int, content_type:str, length:int=None):
+        head = f"HTTP/1.1 {code} {HTTP_REASONS.get(code, '')}\r\n"
+        head += f"Content-Type: {content_type}\r\n"
+        if length is None:
+            head += "Transfer-Encoding: chunked\r\n"
+        else:
+            head += f"Content-Length: {length}\r\n"
+        head += "Connection: close\r\n\r\n"
+        writer.write(head.encode("latin-1"))
+        self.answered.add(writer)
+
+    def respond_bytes(self, writer, code:int, content_type:str, data:bytes):
+        self.respond_head(writer, code, content_type, len(data))
+        writer.write(data)
+
+    def respond_json(self, writer, code:int, data):
+        self.respond_bytes(writer, code, "application/json", json.dumps(data).encode())
+
+    # Send the result and release what was sent, the job is forgotten once nothing is left
+    def respond_result(self, writer, job:Job, array:str=None):
+        if array not in (None, "k_space", "image"):
+            return self.respond_json(writer, 400, {"error": f"Unknown array: {array}"})
+        names = ("k_space", "image") if array is None else (array,)
+        if any(getattr(job, name) is None for name in names):
+            return self.respond_json(writer, 410, {"error": "Result already fetched"})
+
+        buffer = io.BytesIO()
+        if array is None:
+            np.savez(buffer, k_space=job.k_space, image=job.image)
+        else:
+            np.save(buffer, getattr(job, array))
+        self.respond_bytes(writer, 200, "application/octet-stream", buffer.getvalue())
+
+        for name in names:
+            setattr(job, name, None)
+        if job.k_space is None and job.image is None:
+            self.forget(job)
+
+    # Stream status changes as chunked newline-delimited json until the job ends
+    async def stream_events(self, writer, job:Job):
+        self.respond_head(writer, 200, "application/x-ndjson")
+        while True:
+            changed = job.changed
+            line = (json.dumps(job.status()) + "\n").encode()
+            writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            await writer.drain()
+            if job.is_final():
+                break
+            await changed.wait()
+        writer.write(b"0\r\n\r\n")
+
+
+###############################################
+"""Client"""
+###############################################
+
+# HTTP connection over a Unix socket
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path:str, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+# Blocking client for scripts & notebooks
+class SimulationClient():
+    def __init__(self, host:str="127.0.0.1", port:int=8765, path:str=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+
+    def connection(self):
+        if self.path is not None:
+            return UnixHTTPConnection(self.path, timeout=self.timeout)
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method:str, url:str, data=None):
+        connection = self.connection()
+        body = None if data is None else json.dumps(data).encode()
+        connection.request(method, url, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        content = response.read()
+        connection.close()
+        if response.status >= 400:
+            raise RuntimeError(json.loads(content).get("error", response.reason))
+        return content
+
+    # Submit a job, phantom is a payload dict or a numpy array
+    def submit(self, sequence:dict, phantom=None, engine:str=BLOCH_ENGINE, coils:dict=None):
+        if isinstance(phantom, np.ndarray):
+            buffer = io.BytesIO()
+            np.save(buffer, phantom)
+            phantom = {"npy": base64.b64encode(buffer.getvalue()).decode()}
+        payload = {"sequence": sequence, "phantom": phantom or {}, "engine": engine}
+        if coils:
+            payload["coils"] = coils
+        return json.loads(self.request("POST", "/jobs", payload))["id"]
+
+    def status(self, id:str):
+        return json.loads(self.request("GET", f"/jobs/{id}"))
+
+    # Status of every job kept by the server
+    def list(self):
+        return json.loads(self.request("GET", "/jobs"))
+
+    # Block until the job ends
+    def wait(self, id:str):
+        return json.loads(self.request("GET", f"/jobs/{id}?wait=1"))
+
+    def cancel(self, id:str):
+        return json.loads(self.request("DELETE", f"/jobs/{id}"))
+
+    # Iterate over status updates until the job ends
+    def events(self, id:str):
+        connection = self.connection()
+        connection.request("GET", f"/jobs/{id}/events")
+        response = connection.getresponse()
+        for line in response:
+            yield json.loads(line)
+        connection.close()
+
+    # Get the result {"k_space": ..., "image": ...}
+    def result(self, id:str):
+        with np.load(io.BytesIO(self.request("GET", f"/jobs/{id}/result"))) as data:
+            return {key: data[key] for key in data.files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local MRI simulation job server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of concurrent simulations")
+    parser.add_argument("--max-queue", type=int, default=64, help="Maximum number of queued jobs")
+    parser.add_argument("--max-finished", type=int, default=DEFAULT_MAX_FINISHED, help="Finished jobs kept until their result is fetched (oldest forgotten first)")
+    parser.add_argument("--job-ttl", type=float, default=DEFAULT_JOB_TTL, help="Seconds a finished job is kept (0 for no limit)")
+    parser.add_argument("--cache-size", type=int, default=16, help="Number of results kept in memory (0 disables the cache)")
+    parser.add_argument("--cache-dir", default=None, help="Also keep results on disk in this directory")
+    parser.add_argument("--cache-disk-mb", type=int, default=DEFAULT_DISK_BYTES // 1024**2, help="Size of the disk cache, least recently used results are deleted first (0 for no limit)")
+    parser.add_argument("--snapshot-mb", type=int, default=256, help="Memory for magnetization snapshots reused by similar jobs (0 disables)")
+    parser.add_argument("--memory-mb", type=int, default=None, help="Memory budget of the jobs & snapshots (default: 80%% of the available memory)")
+    parser.add_argument("--metrics", action="store_true", help="Serve throughput, memory & cache metrics on GET /metrics")
+    parser.add_argument("--metrics-file", default=None, help="Also write the metrics to this file periodically")
+    parser.add_argument("--metrics-interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between two writes of the metrics file")
+    args = parser.parse_args()
+
+    exporters = []
+    if args.metrics or args.metrics_file:
+        exporters = enable_metrics(path=args.metrics_file, interval=args.metrics_interval)
+
+    cache = None
+    if args.cache_size > 0:
+        cache = SimulationCache(args.cache_size, args.cache_dir, args.cache_disk_mb * 1024**2 or None)
+
+    snapshots = None
+    if args.snapshot_mb > 0:
+        snapshots = SnapshotStore(args.snapshot_mb * 1024**2)
+
+    async def serve():
+        memory_budget = default_budget() if args.memory_mb is None else args.memory_mb * 1024**2
+        server = JobServer(args.workers, args.max_queue, cache, snapshots, memory_budget, args.max_finished, args.job_ttl or None)
+        await server.start(args.host, args.port, args.unix)
+        print(f"Serving on {args.unix or f'{args.host}:{args.port}'} with {server.workers} worker(s)")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for exporter in exporters:
+            exporter.stop()
+
+
+if __name__ == '__main__':
+    main()
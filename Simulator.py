@@ -0,0 +1,823 @@
+# Purpose: Headless simulation core shared by the GUI worker and the job server
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Numpy library
+import numpy as np
+
+# Phantom & sequence
+from Phantom import Phantom
+from MRISequence import *
+from RFPulse import pulse_waveform, pulse_rotations
+from MemoryPlanner import plan_simulation
+from Metrics import REGISTRY, RunMetrics
+from Waveform import (X_AXIS, Y_AXIS, Z_AXIS, RF_OPERATION, RELAXATION_OPERATION, SPOILER_OPERATION, READOUT_OPERATION,
+                      MULTI_GRADIENT_OPERATION, GRADIENT_OPERATION)
+
+# Bump when the simulation results change (invalidates cached results)
+ENGINE_VERSION = "3"
+
+# Share of the snapshot store the readout states of one run may fill
+SNAPSHOT_SHARE = 0.5
+
+
+# Hash of the phantom maps & magnetization (start of the magnetization chain)
+def phantom_digest(phantom:Phantom):
+    digest = hashlib.sha256()
+    for name in ("PD", "t1", "t2", "t2_star", "dB", "B1", "M"):
+        array = np.ascontiguousarray(getattr(phantom, name))
+        digest.update(f"{name}{array.shape}{array.dtype}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Magnetization snapshots of previous runs
+class SnapshotStore():
+    def __init__(self, max_bytes:int=256*1024**2):
+        """
+        Parameters:
+        max_bytes (int): Memory budget, least recently used entries are dropped first.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return item
+
+    def put(self, key, array:np.ndarray):
+        if array.nbytes > self.max_bytes:
+            return
+        # Shared between runs, never modified
+        array.flags.writeable = False
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return
+            self.items[key] = array
+            self.nbytes += array.nbytes
+            while self.nbytes > self.max_bytes:
+                _, dropped = self.items.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+
+# Raised at a checkpoint of a paused simulation
+class SimulationCancelled(Exception):
+    pass
+
+
+# Throughput & remaining time of a run, averaged over the last lines
+class ProgressMeter():
+    def __init__(self, total:int, window:int=16):
+        self.total = total
+        self.start = time.monotonic()
+        self.samples = deque([(self.start, 0, 0)], maxlen=window + 1)
+
+    # Statistics after 'lines' lines & 'voxel_updates' voxel updates
+    def update(self, lines:int, voxel_updates:int):
+        now = time.monotonic()
+        self.samples.append((now, lines, voxel_updates))
+        then, previous_lines, previous_updates = self.samples[0]
+        interval = max(now - then, 1e-9)
+
+        lines_per_second = (lines - previous_lines) / interval
+        return {"lines": lines,
+                "total": self.total,
+                "elapsed": now - self.start,
+                "lines_per_second": lines_per_second,
+                "voxel_updates_per_second": (voxel_updates - previous_updates) / interval,
+                "eta": (self.total - lines) / lines_per_second if lines_per_second > 0 else None}
+
+
+# Convergence of the intermediate (zero filled) images of a run
+class ConvergenceMonitor():
+    def __init__(self, tolerance:float=0.01, interval:int=None, patience:int=2, minimum:float=0.25):
+        """
+        The change between two checks is the share of the image energy the lines read since
+        the previous check added (||image - previous||² / ||image||²): the relative norm of the
+        change only decays like the k space amplitude, so objects with sharp edges stayed above
+        any useful tolerance until the last line. The run can only stop while the acquired lines
+        form one band without gaps: the zero filled image of interleaved or random orders is
+        aliased, and it does not change while the lines without signal are filled.
+
+        Parameters:
+        tolerance (float): Share of the image energy added between two checks considered converged.
+        interval (int): Lines between checks, N/16 by default.
+        patience (int): Consecutive converged checks before stopping.
+        minimum (float): Fraction of the N lines acquired before stopping.
+        """
+        self.tolerance = tolerance
+        self.interval = interval
+        self.patience = patience
+        self.minimum = minimum
+        self.changes = [] # Share of the image energy added at every check
+        self._image = None
+        self._streak = 0
+        self._lines = 0
+        self._first = None
+        self._last = None
+
+    # Check the k space after the phase encoding line 'line' was read, True once converged
+    def update(self, k_space:np.ndarray, line:int):
+        N = k_space.shape[-1]
+        self._lines += 1
+        self._first = line if self._first is None else min(self._first, line)
+        self._last = line if self._last is None else max(self._last, line)
+
+        interval = self.interval or max(N // 16, 1)
+        if self._lines % interval:
+            return False
+
+        image = reconstruct(k_space)
+        if self._image is not None:
+            energy = np.sum(image**2)
+            change = np.sum((image - self._image)**2) / energy if energy > 0 else np.inf
+            self.changes.append(float(change))
+            self._streak = self._streak + 1 if change < self.tolerance else 0
+        self._image = image
+
+        contiguous = self._last - self._first + 1 == self._lines
+        return self._streak >= self.patience and self.minimum * N <= self._lines < N and contiguous
+
+
+# Simulator (no Qt dependency)
+class Simulator():
+    # Constructor
+    def __init__(self, phantom:Phantom, sequence:MRISequence, snapshots:SnapshotStore=None, chunk_rows:int=None, coils:np.ndarray=None, lines=None):
+        self._isRunning = True
+        self.phantom = phantom
+        self.sequence = sequence
+        self.snapshots = snapshots
+        self.chunk_rows = chunk_rows # Frequency encoding rows computed at once, None caches whole tables
+        self.coils = coils # Receive sensitivities (C, N, N), None for one uniform coil
+        self.lines = lines # Phase encoding lines acquired (in order), the sequence order when None
+        self.converged = False # Stopped early by a ConvergenceMonitor
+        self.k_space = np.zeros((0, 0), dtype=complex)
+        self._precessions = {}
+        self._off_resonance = bool(np.any(phantom.dB))
+        self._uniform_B1 = bool(np.all(phantom.B1 == 1))
+        self._pulses = {}
+        self._fe_tables = {}
+        self._pe_vectors = {}
+        self.voxel_updates = 0 # Voxels times operations applied
+        self.operation_seconds = {} # Time spent in every operation of the chain (& the readouts)
+
+    # Simulate the sequence on the phantom and fill the k space
+    def run(self, progress=None, line_update=None, k_space:np.ndarray=None, stats=None, monitor:ConvergenceMonitor=None):
+        """
+        Simulate the sequence on the phantom.
+
+        Parameters:
+        progress (callable): Called with the progress percentage after each TR.
+        stats (callable): Called after each TR with the ProgressMeter statistics.
+        line_update (callable): Called with the phase encoding index of each completed line,
+            the line is read in place from the k space.
+        k_space (np.ndarray): Preallocated complex buffer to fill, allocated if None.
+        monitor (ConvergenceMonitor): Stops the run once the intermediate image converges
+            (converged is set, the remaining lines stay zero).
+
+        Returns:
+        k_space (np.ndarray): NxN complex k space, CxNxN with receive coils (lines not
+            acquired are zero).
+        """
+        # Get the phantom size
+        N = self.phantom.width
+        shape = (N, N) if self.coils is None else (len(self.coils), N, N)
+
+        # Generate k space
+        if k_space is None:
+            k_space = np.zeros(shape, dtype=complex) # Initialize an NxN complex array with zeros
+        elif k_space.shape != shape:
+            raise ValueError(f"K space buffer must be {'x'.join(map(str, shape))}")
+        self.k_space = k_space
+        self.converged = False
+
+        lines = self.iterate(progress, stats)
+        try:
+            for pe_gradient, line in lines:
+                self.k_space[..., pe_gradient] = line
+
+                # Notify the completed line
+                if line_update is not None:
+                    line_update(pe_gradient)
+
+                # Stop once more lines no longer change the image
+                if monitor is not None and monitor.update(self.k_space, pe_gradient):
+                    self.converged = True
+                    lines.close()
+                    break
+        except SimulationCancelled:
+            # Paused, the lines read so far are kept
+            pass
+
+        return self.k_space
+
+    # Simulate the sequence and yield the k space lines as they are read
+    def iterate(self, progress=None, stats=None):
+        """
+        Simulate the sequence on the phantom, yielding (pe_index, k_line) after each readout.
+
+        The magnetization only changes through RF pulses, relaxations and spoilers, so the run
+        is a chain of those operations (consecutive relaxations merged) with the readouts
+        tapping it. Gradients only move the k space position (kx, ky), integrated from their
+        moments in units of one k space step, and every readout encodes the transverse
+        magnetization at the sampled positions. Every state is identified by a hash of the chain
+        so far. With a snapshot store two kinds of states are kept, the ones a later run can share:
+        - every operation boundary of the first TR: an edit of the chain (an RF angle, a timing)
+          changes every TR after it, so only the unchanged prefix of the first TR is shared;
+        - the states read out, every stride-th readout so that they fill at most SNAPSHOT_SHARE
+          of the store: edits that leave the chain unchanged (gradients, phase encoding order,
+          acquired lines, coils) only encode again, from the nearest kept state.
+
+        Closing the generator early stops the simulation, the phantom keeps the magnetization
+        reached so far. pause() stops it at the next checkpoint (every operation and readout
+        sample), the phantom keeps the last complete state; a simulator paused before its run
+        reads no line.
+
+        Parameters:
+        progress (callable): Called with the progress percentage after each TR.
+        stats (callable): Called after each TR with the ProgressMeter statistics.
+
+        Yields:
+        (int, np.ndarray): Phase encoding index and the N complex samples of its line,
+            C x N samples with receive coils.
+        """
+        # Get operations of one TR (compiled once with the waveforms of the sequence)
+        operations = self.sequence.get_waveform().operations
+
+        # Get the phantom size
+        N = self.phantom.width
+
+        ############ Simulate the sequence ############
+
+        # Magnetization chain: last known state, its hash and the operations applied since
+        self._state = self.phantom.M
+        self._hash = phantom_digest(self.phantom)
+        self._pending = []
+        relaxation = 0 # Relaxation time not applied yet
+
+        # Off resonance phase tables, one per interval duration
+        self._precessions = {}
+        self._off_resonance = bool(np.any(self.phantom.dB))
+
+        # Effective rotations of the shaped pulses, one per pulse
+        self._uniform_B1 = bool(np.all(self.phantom.B1 == 1))
+        self._pulses = {}
+
+        # Encoding phase ramps, one per k space position
+        self._fe_tables = {}
+        self._pe_vectors = {}
+
+        # Phase encoding lines in acquisition order & the k space position of their readouts
+        lines = self.acquisition_lines()
+        positions = k_trajectory(operations, lines, N)
+
+        # Snapshots kept: every boundary of the first TR, then every stride-th readout state
+        self._prefix = True
+        self._readouts = 0
+        self._stride = self.snapshot_stride(len(lines))
+
+        progress_counter = 0
+        pe_gradient = 0 # Phase encoding gradient (lines acquired so far)
+        self.voxel_updates = 0
+        self.operation_seconds = {}
+        meter = ProgressMeter(len(lines))
+        metrics = RunMetrics(type(self).__name__, len(lines)) if REGISTRY.enabled else None
+        outcome = "completed"
+
+        try:
+            # Loop over the phase encoding gradient
+            while pe_gradient < len(lines) and self._isRunning:
+                # Loop over the operations of the TR
+                for name, value in operations:
+                    if name == RELAXATION_OPERATION:
+                        # Merge with the previous relaxations
+                        relaxation = round(relaxation + value, 9)
+
+                    elif name in (MULTI_GRADIENT_OPERATION, GRADIENT_OPERATION):
+                        # Gradients only move the k space position (see k_trajectory)
+                        continue
+
+                    elif name == READOUT_OPERATION:
+                        if pe_gradient < len(lines):
+                            # Read the signal of the whole line
+                            kx_start, ky = positions[pe_gradient]
+                            yield lines[pe_gradient], self.read_line(kx_start, ky, relaxation, value[0])
+
+                            # Increment the phase encoding gradient
+                            pe_gradient += 1
+
+                    else:
+                        if relaxation > 0:
+                            self.advance(RELAXATION_OPERATION, relaxation)
+                            relaxation = 0
+                        self.advance(name, value)
+
+                self._prefix = False
+                progress_counter += 1
+                if stats is not None or metrics is not None:
+                    statistics = meter.update(pe_gradient, self.voxel_updates)
+                    if stats is not None:
+                        stats(statistics)
+                    if metrics is not None:
+                        metrics.update(pe_gradient, self.voxel_updates, self.operation_seconds, statistics)
+                if progress is not None:
+                    progress(round((progress_counter/len(lines))*100))
+        except SimulationCancelled:
+            # Stopped inside an operation, drop the operations not applied yet
+            self._pending = []
+            relaxation = 0
+            outcome = "cancelled"
+        except GeneratorExit:
+            outcome = "stopped"
+            raise
+        except Exception:
+            outcome = "failed"
+            raise
+        finally:
+            self._prefix = False
+            try:
+                # Final magnetization
+                if relaxation > 0:
+                    self.advance(RELAXATION_OPERATION, relaxation)
+                self.phantom.M = np.copy(self.final_state())
+            except BaseException:
+                outcome = "failed"
+                raise
+            finally:
+                # Release the gauges of the run whatever happened
+                if metrics is not None:
+                    if outcome == "completed" and not self._isRunning:
+                        outcome = "cancelled"
+                    metrics.finish(pe_gradient, self.voxel_updates, self.operation_seconds, outcome)
+
+    # Magnetization at the end of a run, the last complete state once paused (never raises SimulationCancelled)
+    def final_state(self):
+        if self._isRunning:
+            try:
+                return self.materialize()
+            except SimulationCancelled:
+                pass
+
+        # Paused, possibly while the last operations were applied: drop them
+        self._pending = []
+        return self.materialize()
+
+    # Phase encoding lines acquired, in order (the order of the sequence by default)
+    def acquisition_lines(self):
+        N = self.phantom.width
+        if self.lines is None:
+            return self.sequence.get_pe_order(N)
+
+        lines = [int(line) for line in self.lines]
+        if not lines or min(lines) < 0 or max(lines) >= N:
+            raise ValueError(f"Acquired lines must be within 0..{N - 1}")
+        return lines
+
+    # Readouts between two kept readout states, None to keep none
+    def snapshot_stride(self, readouts:int):
+        if self.snapshots is None:
+            return None
+        state_bytes = self.phantom.width * self.phantom.height * 3 * np.dtype(float).itemsize
+        budget = SNAPSHOT_SHARE * self.snapshots.max_bytes
+        if state_bytes > budget:
+            return None
+        return max(1, int(np.ceil((readouts + 1) * state_bytes / budget)))
+
+    # Add an operation to the magnetization chain (applied lazily)
+    def advance(self, name:str, value):
+        self._hash = hashlib.sha256(f"{self._hash}|{name}={value!r}".encode()).hexdigest()
+
+        snapshot = None if self.snapshots is None else self.snapshots.get(self._hash)
+        if snapshot is not None:
+            # Already simulated
+            self._state = snapshot
+            self._pending = []
+        else:
+            self._pending.append((name, value))
+            if self.snapshots is not None and self._prefix:
+                # Boundary of the first TR, shared by the runs edited after it
+                self.materialize(keep=True)
+
+    # Apply the pending operations and return the current magnetization (kept in the snapshot store if keep)
+    def materialize(self, keep:bool=False):
+        if self._pending:
+            M = self._state
+            for name, value in self._pending:
+                self.checkpoint()
+                self.voxel_updates += M.shape[0] * M.shape[1]
+                start = time.perf_counter()
+                if name == RF_OPERATION:
+                    # Apply the RF pulse
+                    if isinstance(value, tuple):
+                        M = self.shaped_rotation(M, value)
+                    elif self._uniform_B1:
+                        M = self.rotation(M, value, X_AXIS)
+                    else:
+                        # Per voxel flip angles
+                        M = self.rotation(M, value * self.phantom.B1, X_AXIS)
+                elif name == RELAXATION_OPERATION:
+                    M = self.relaxation(M, value, self.phantom.t1, self.phantom.t2_star, self.phantom.PD)
+                    M = self.precession(M, value)
+                elif name == SPOILER_OPERATION:
+                    M = self.spoiler(M)
+                self.timed(name, start)
+
+            self._state = M
+            self._pending = []
+            if keep and self.snapshots is not None:
+                self.snapshots.put(self._hash, M)
+
+        return self._state
+
+    # Read a k space line from (kx_start, ky) 'relaxation' ms after the current state
+    def read_line(self, kx_start:float, ky:float, relaxation:float, duration:float):
+        keep = self._stride is not None and self._readouts % self._stride == 0
+        self._readouts += 1
+        M = self.materialize(keep)
+        self.checkpoint()
+        start = time.perf_counter()
+        if relaxation > 0:
+            M = self.relaxation(M, relaxation, self.phantom.t1, self.phantom.t2_star, self.phantom.PD)
+            M = self.precession(M, relaxation)
+        line = self.readout(kx_start, ky, M, duration)
+        self.timed(READOUT_OPERATION, start)
+        return line
+
+    # Add the time since 'start' (perf_counter) to the total of an operation
+    def timed(self, name:str, start:float):
+        self.operation_seconds[name] = self.operation_seconds.get(name, 0) + time.perf_counter() - start
+
+    # Pause the simulation
+    def pause(self):
+        self._isRunning = False
+
+    # Stop point inside long operations
+    def checkpoint(self):
+        if not self._isRunning:
+            raise SimulationCancelled()
+
+    # Is the simulation running
+    def isRunning(self):
+        return self._isRunning
+
+    # Rotation matrix of a flip angle around an axis
+    def rotation_matrix(self, flip_angle_deg:float, axis:str=X_AXIS):
+        # Convert flip angle from degrees to radians
+        flip_angle_rad = np.radians(flip_angle_deg)
+
+        # Compute the sine and cosine of the flip angle
+        sin_theta = np.sin(flip_angle_rad)
+        cos_theta = np.cos(flip_angle_rad)
+
+        if axis == X_AXIS:
+            # Construct the rotation matrix around x-axis
+            rotation_matrix = np.array([[1,             0,                  0],
+                                        [0,             cos_theta,   sin_theta],
+                                        [0,             -sin_theta,  cos_theta]])
+
+        elif axis == Y_AXIS:
+            rotation_matrix = np.array([[cos_theta,     0,      -sin_theta],
+                                        [0,             1,               0],
+                                        [sin_theta,     0,       cos_theta]])
+
+        elif axis == Z_AXIS:
+            rotation_matrix = np.array([[cos_theta,     sin_theta,     0],
+                                        [-sin_theta,    cos_theta,     0],
+                                        [0,             0,             1]])
+
+        else:
+            raise ValueError("Axis must be either x, y or z")
+
+        return rotation_matrix
+
+    # Apply an RF pulse to magnetization vectors (..., 3), flip_angle_deg is a scalar or one angle per vector
+    def rotation(self, magnetization_vector:np.ndarray, flip_angle_deg, axis:str=X_AXIS):
+        if np.ndim(flip_angle_deg) == 0:
+            rotation_matrix = self.rotation_matrix(flip_angle_deg, axis)
+
+            # Apply rotation to the magnetization vectors
+            return np.matmul(magnetization_vector, rotation_matrix.T)
+
+        # Closed form rotation of the two components around the axis
+        if axis == X_AXIS:
+            i, j = 1, 2
+        elif axis == Y_AXIS:
+            i, j = 2, 0
+        elif axis == Z_AXIS:
+            i, j = 0, 1
+        else:
+            raise ValueError("Axis must be either x, y or z")
+
+        flip_angle_rad = np.radians(flip_angle_deg)
+        sin_theta = np.sin(flip_angle_rad)
+        cos_theta = np.cos(flip_angle_rad)
+
+        rotated = np.array(magnetization_vector, dtype=float)
+        rotated[..., i] = cos_theta * magnetization_vector[..., i] + sin_theta * magnetization_vector[..., j]
+        rotated[..., j] = -sin_theta * magnetization_vector[..., i] + cos_theta * magnetization_vector[..., j]
+        return rotated
+
+    # Effective rotations of a shaped pulse, one per distinct (off resonance, B1+) pair of the phantom
+    def pulse_rotations(self, pulse:tuple):
+        rotations = self._pulses.get(pulse)
+        if rotations is None:
+            angle, shape, samples, tbw, duration = pulse
+            waveform = pulse_waveform(shape if isinstance(shape, str) else list(shape), samples, tbw)
+
+            # Time step the pulse once per distinct frequency (mHz resolution) & transmit scale
+            fields = np.stack([np.round(self.phantom.dB, 3), np.round(self.phantom.B1, 4)], axis=-1).reshape(-1, 2)
+            fields, index = np.unique(fields, axis=0, return_inverse=True)
+            rotations = pulse_rotations(angle, waveform, duration or 0, fields[:, 0], fields[:, 1])
+            rotations = (rotations, index.reshape(self.phantom.dB.shape))
+            self._pulses[pulse] = rotations
+        return rotations
+
+    # Apply a shaped RF pulse to magnetization vectors (..., 3)
+    def shaped_rotation(self, magnetization_vector:np.ndarray, pulse:tuple):
+        rotations, index = self.pulse_rotations(pulse)
+        if len(rotations) == 1:
+            return np.matmul(magnetization_vector, rotations[0].T)
+
+        # Look up the rotation of every voxel
+        return np.einsum('...ij,...j->...i', rotations[index], magnetization_vector)
+
+    # Simulate T1 and T2 relaxation of magnetization
+    def relaxation(self, magnetization_vector, t:float, t1, t2, PD):
+        """
+        Simulate T1 and T2 relaxation of magnetization.
+
+        Parameters:
+        magnetization_vector (np.ndarray): Magnetization vectors (..., 3).
+        t (float): Time elapsed since excitation.
+        t1, t2, PD (np.ndarray): Relaxation times and proton density.
+
+        Returns:
+        magnetization_vector (np.ndarray): Relaxed magnetization vectors.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            E1 = np.exp(-t/t1)
+            E2 = np.exp(-t/t2)
+        M0 = PD
+
+        relaxed = np.empty(magnetization_vector.shape)
+        relaxed[..., 0] = E2 * magnetization_vector[..., 0]
+        relaxed[..., 1] = E2 * magnetization_vector[..., 1]
+        relaxed[..., 2] = E1 * magnetization_vector[..., 2] + M0*(1-E1)
+
+        return relaxed
+
+    # TODO: Apply a spoiler gradient
+    def spoiler(self, magnetization_vector):
+        magnetization_vector = np.array(magnetization_vector, dtype=float)
+        magnetization_vector[..., 0] = 0
+        magnetization_vector[..., 1] = 0
+        return magnetization_vector
+
+    # Off resonance phase accrual exp(-i 2pi dB t) over t ms, cached per duration
+    def precession_table(self, t:float):
+        table = self._precessions.get(t)
+        if table is None:
+            table = np.exp(-2j * np.pi * self.phantom.dB * (t / 1000))
+            self._precessions[t] = table
+        return table
+
+    # Precession around Z caused by the off resonance during t ms
+    def precession(self, magnetization_vector, t:float):
+        if not self._off_resonance:
+            return magnetization_vector
+
+        Mxy = (magnetization_vector[..., 0] + 1j * magnetization_vector[..., 1]) * self.precession_table(t)
+        precessed = np.array(magnetization_vector, dtype=float)
+        precessed[..., 0] = Mxy.real
+        precessed[..., 1] = Mxy.imag
+        return precessed
+
+    # Frequency encoding phases exp(-2pi i (kx_start + sample) x / N), cached per start position
+    def fe_table(self, kx_start:float):
+        table = self._fe_tables.get(kx_start)
+        if table is None:
+            N = self.phantom.width
+            table = np.exp(-2j * np.pi * np.outer(kx_start + np.arange(N), np.arange(N)) / N)
+            self._fe_tables[kx_start] = table
+        return table
+
+    # Rows [start, stop) of the frequency encoding table, computed without caching when chunked
+    def fe_rows(self, kx_start:float, start:int, stop:int):
+        if self.chunk_rows is None:
+            return self.fe_table(kx_start)[start:stop]
+
+        N = self.phantom.width
+        return np.exp(-2j * np.pi * np.outer(kx_start + np.arange(start, stop), np.arange(N)) / N)
+
+    # Phase encoding phases exp(-2pi i ky y / N), cached per position
+    def pe_vector(self, ky:float):
+        vector = self._pe_vectors.get(ky)
+        if vector is None:
+            vector = np.exp(-2j * np.pi * ky * np.arange(self.phantom.width) / self.phantom.width)
+            self._pe_vectors[ky] = vector
+        return vector
+
+    # Read a whole k space line of magnetization M, sampling kx_start, kx_start + 1, ... at ky
+    def readout(self, kx_start:float, ky:float, M, duration:float=0):
+        """
+        Returns:
+        line (np.ndarray): N complex samples, C x N with receive coils (the magnetization is
+            weighted by every sensitivity map in one broadcast).
+        """
+        N = self.phantom.width
+        Mxy = M[:,:,0] + 1j * M[:,:,1]
+        # Phase encoding: separable phase along y
+        encoded = Mxy * self.pe_vector(ky)
+        if self.coils is not None:
+            encoded = self.coils * encoded
+        voxels = encoded.size
+
+        if not self._off_resonance or not duration:
+            # Frequency encoding: phase along x for every sample
+            self.voxel_updates += voxels
+            profile = encoded.sum(axis=-1)
+            if self.chunk_rows is None:
+                return profile @ self.fe_table(kx_start).T
+
+            line = np.empty(profile.shape, dtype=complex)
+            for start in range(0, N, self.chunk_rows):
+                stop = min(start + self.chunk_rows, N)
+                line[..., start:stop] = profile @ self.fe_rows(kx_start, start, stop).T
+            return line
+
+        # Off resonance keeps precessing between the N samples of the readout
+        step = self.precession_table(duration / N)
+        line = np.empty(encoded.shape[:-1], dtype=complex)
+        for fe_gradient in range(N):
+            self.checkpoint()
+            self.voxel_updates += voxels
+            line[..., fe_gradient] = encoded.sum(axis=-1) @ self.fe_rows(kx_start, fe_gradient, fe_gradient + 1)[0]
+            encoded *= step
+        return line
+
+
+# K space position (kx_start, ky) of the readout of every acquired line, integrated from the gradient moments
+def k_trajectory(operations:list, lines:list, N:int):
+    """
+    Gradient moments are in units of one k space step: the phase encoding table moves ky by
+    scale * (line - N/2) for the line of its readout, constant gradients by scale * N/2 and
+    every readout by N along kx. An excitation restarts from the k space center, a 180° pulse
+    mirrors the position and balanced gradients are rewound after the readout.
+
+    Parameters:
+    operations (list): Compiled (name, value) operations of one TR.
+    lines (list): Phase encoding lines in acquisition order.
+    N (int): Phantom size.
+
+    Returns:
+    positions (list): (kx_start, ky) of every line in acquisition order, the readout samples
+        kx_start, kx_start + 1, ... kx_start + N - 1.
+    """
+    if not any(name == READOUT_OPERATION for name, _ in operations):
+        raise ValueError("Sequence has no readout")
+
+    positions = []
+    while len(positions) < len(lines):
+        # K space position and the moments rewound after the readout
+        kx, ky = 0, 0
+        rewind_x, rewind_y = 0, 0
+        first_line = len(positions)
+
+        for name, value in operations:
+            if name == MULTI_GRADIENT_OPERATION:
+                # Phase encoding table, scaled by the line of its readout
+                scale, balanced, readout = value
+                moment = scale * (lines[min(first_line + readout, len(lines) - 1)] - N/2)
+                ky += moment
+                if balanced:
+                    rewind_y += moment
+
+            elif name == GRADIENT_OPERATION:
+                # Constant moment in half k space extents
+                axis, scale, balanced = value
+                moment = scale * N/2
+                if axis == X_AXIS:
+                    kx += moment
+                    rewind_x += moment if balanced else 0
+                else:
+                    ky += moment
+                    rewind_y += moment if balanced else 0
+
+            elif name == READOUT_OPERATION:
+                _, prephased = value
+                # Without a frequency encoding prephaser the readout starts at -N/2
+                kx_start = kx if prephased else kx - N/2
+                if len(positions) < len(lines):
+                    positions.append((kx_start, ky))
+
+                # Readout gradient moment and the balanced rewinders
+                kx = kx_start + N - rewind_x
+                ky = ky - rewind_y
+                rewind_x, rewind_y = 0, 0
+
+            elif name == RF_OPERATION:
+                angle = value[0] if isinstance(value, tuple) else value
+                if abs(angle) % 360 == 180:
+                    # Refocusing pulse mirrors the k space position
+                    kx, ky = -kx, -ky
+                else:
+                    # Excitation starts from the k space center
+                    kx, ky = 0, 0
+    return positions
+
+
+# Encode transverse magnetization into k space at the readout positions of the acquired lines (same phases as the readout)
+def encode(Mxy:np.ndarray, lines:list, positions:list):
+    """
+    Parameters:
+    Mxy (np.ndarray): NxN transverse magnetization.
+    lines (list): Phase encoding lines in acquisition order.
+    positions (list): (kx_start, ky) of every line, see k_trajectory.
+
+    Returns:
+    k_space (np.ndarray): NxN complex k space (lines not acquired are zero).
+    """
+    N = Mxy.shape[0]
+    k_space = np.zeros((N, N), dtype=complex)
+    pixels = np.arange(N)
+    for kx_start in {kx_start for kx_start, _ in positions}:
+        # Lines sharing a frequency encoding table
+        index = [i for i, (start, _) in enumerate(positions) if start == kx_start]
+        ky = np.array([positions[i][1] for i in index])
+        # k[fe, pe] = sum over x, y of Mxy[x, y] * exp(-2pi i ((kx_start + fe) x + ky[pe] y) / N)
+        fe_table = np.exp(-2j * np.pi * np.outer(kx_start + pixels, pixels) / N)
+        pe_table = np.exp(-2j * np.pi * np.outer(pixels, ky) / N)
+        k_space[:, [lines[i] for i in index]] = fe_table @ Mxy @ pe_table
+    return k_space
+
+
+# Reconstruct the image of a k space (root sum of squares of CxNxN coil k spaces)
+def reconstruct(k_space:np.ndarray):
+    if k_space.ndim == 3:
+        return np.sqrt((np.abs(np.fft.ifft2(k_space, axes=(-2, -1)))**2).sum(axis=0))
+    return np.abs(np.fft.ifft2(k_space))
+
+
+# Simulator sized for the memory budget, refusing runs that cannot fit (MemoryError)
+def planned_simulator(phantom:Phantom, sequence:MRISequence, snapshots:SnapshotStore=None, memory_budget:int=None,
+                      coils:np.ndarray=None, lines=None):
+    # Chunk the runs that only fit degraded (without the shared snapshots)
+    snapshot_bytes = 0 if snapshots is None else snapshots.max_bytes
+    plan = plan_simulation(phantom, sequence, memory_budget, snapshot_bytes=snapshot_bytes, batch=1 if coils is None else len(coils))
+    if not plan.fits:
+        raise MemoryError(plan.message())
+    if snapshots is not None and plan.snapshot_bytes < snapshot_bytes:
+        snapshots = None
+    return Simulator(phantom, sequence, snapshots, plan.chunk_rows, coils, lines)
+
+
+# Simulate a sequence on a phantom, yielding (pe_index, k_line) as each readout completes (same options as simulate, no cache)
+def simulate_iter(phantom:Phantom, sequence:MRISequence, progress=None, snapshots:SnapshotStore=None, stats=None, memory_budget:int=None,
+                  coils:np.ndarray=None, lines=None):
+    return planned_simulator(phantom, sequence, snapshots, memory_budget, coils, lines).iterate(progress, stats)
+
+
+# Simulate a sequence on a phantom (blocking), reusing cached results when a cache is given
+def simulate(phantom:Phantom, sequence:MRISequence, progress=None, cache=None, snapshots:SnapshotStore=None, stats=None, memory_budget:int=None,
+             coils:np.ndarray=None, lines=None):
+    # Cached results are single coil, fully sampled runs
+    if coils is not None or lines is not None:
+        cache = None
+
+    if cache is not None:
+        key = cache.key(phantom, sequence)
+        result = cache.get(key)
+        if result is not None:
+            phantom.M = np.copy(result["M"])
+            return result["k_space"], result["image"]
+
+    simulator = planned_simulator(phantom, sequence, snapshots, memory_budget, coils, lines)
+    k_space = simulator.run(progress=progress, stats=stats)
+    image = reconstruct(k_space)
+
+    if cache is not None and simulator.isRunning() and not simulator.converged:
+        cache.put(key, k_space, image, phantom.M)
+
+    return k_space, image
@@ -3,8 +3,13 @@
 # pylint: disable=C0103, W0105, C0301, W0613, E1136
 
 # math & matrix computations library
+import math
+from collections import OrderedDict
 import numpy as np
-from utils import scale_image
+from utils import scale_image, half_resize
+
+# PyQt5
+from PyQt5 import QtCore, QtGui
 
 # Matplotlib
 import matplotlib.pyplot as plt
@@ -12,6 +17,54 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 
 COLOR_MAP = plt.cm.Greys_r
+DEFAULT_REFRESH_RATE = 60 # Hz, when the screen does not report one
+PYRAMID_CACHE = 8 # Pyramids of named maps kept per viewer
+ZOOM_STEP = 1.25 # Scale of one mouse wheel step
+
+
+# Color limits of an image
+def image_limits(image):
+    if not image.size:
+        return 0, 0
+    return np.nanmin(image), np.nanmax(image)
+
+# Downsampled copies of an image, level k is 2^k times smaller (levels built on first use)
+class ImagePyramid():
+    def __init__(self, image):
+        self.levels = [np.asarray(image)]
+        self.shape = self.levels[0].shape[:2]
+        self.vmin, self.vmax = image_limits(self.levels[0])
+
+    # New base image of the same shape (or the base edited in place), the coarser levels are rebuilt when drawn
+    # regions: slices of the base changed in place, the limits are only widened to their values (None rescans the image)
+    def update(self, image, regions=None):
+        image = np.asarray(image)
+        in_place = image is self.levels[0]
+        self.levels = [image]
+        if regions is None or not in_place:
+            self.vmin, self.vmax = image_limits(image)
+            return
+        for region in regions:
+            changed = image[region]
+            if changed.size:
+                vmin, vmax = image_limits(changed)
+                self.vmin, self.vmax = min(self.vmin, vmin), max(self.vmax, vmax)
+
+    # Number of levels down to a single pixel
+    def depth(self):
+        return max(math.ceil(math.log2(max(max(self.shape), 1))), 0) + 1
+
+    def level(self, index:int):
+        index = min(index, self.depth() - 1)
+        while len(self.levels) <= index:
+            self.levels.append(half_resize(self.levels[-1]))
+        return self.levels[index]
+
+    # Coarsest level still showing 'visible' image pixels with at least one level pixel per screen pixel
+    def levelFor(self, visible:float, pixels:float):
+        if pixels <= 0 or visible <= pixels:
+            return 0
+        return min(int(math.log2(visible / pixels)), self.depth() - 1)
 
 class viewer(FigureCanvasQTAgg):
     """Viewer Class
@@ -29,9 +82,32 @@ class viewer(FigureCanvasQTAgg):
         self.title = title
         self.xlabel = "Width"
         self.ylabel = "Height"
+        self.image_artist = None # Persistent image, updated in place
+        self.overlays = [] # Animated artists (e.g. the hover annotation), only drawn when blitting
+        self.annot = None # Hover annotation, created by the viewers that inspect voxels
+        self.background = None # Figure without the overlays, saved after every full draw
+        self.pyramid = None # Pyramid of the image shown, only the visible part of one level is drawn
+        self.pyramid_key = None # Key of the pyramid shown, unnamed pyramids are updated in place by the next image
+        self.pyramids = OrderedDict() # Pyramids of named maps (e.g. the phantom maps)
         self.setTheme()
         
         super(viewer, self).__init__(self.fig)
+
+        # Zoom with the mouse wheel, full resolution is only drawn once zoomed in
+        self.mpl_connect("scroll_event", self.zoom)
+        self.mpl_connect("draw_event", self.saveBackground)
+
+        # Hover inspection is coalesced like the live updates
+        self.hover_position = None
+        self.hover_timer = QtCore.QTimer(self)
+        self.hover_timer.setSingleShot(True)
+        self.hover_timer.timeout.connect(self.flushHover)
+
+        # Live updates are coalesced and drawn at most once per screen refresh
+        self.pending = None
+        self.update_timer = QtCore.QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.timeout.connect(self.flushData)
                 
     # Set Grid
     def setGrid(self, status):
@@ -75,32 +151,222 @@ class viewer(FigureCanvasQTAgg):
         # If image is RGB transform it to gray.
         self.clearData()
                         
-    # Draw image with matplotlib
-    def drawData(self, image, cmap=COLOR_MAP, title=None, origin=None):
+    # Draw image with matplotlib (key names a map whose pyramid is kept, e.g. "T1")
+    def drawData(self, image, cmap=COLOR_MAP, title=None, origin=None, key=None):
         if title is None and origin is None:
-            self.drawData2(image, cmap)
+            self.drawData2(image, cmap, key)
         else:
             if title is None:
                 title = "Blank"
             if origin is None:
                 origin = 'upper'
-            self.drawData1(image, cmap, title, origin)
+            self.drawData1(image, cmap, title, origin, key)
     
     # Draw image with matplotlib
-    def drawData1(self, image, cmap=COLOR_MAP, title="Blank", origin='upper'):
-        # Clear figure
-        self.clearData()
-                 
+    def drawData1(self, image, cmap=COLOR_MAP, title="Blank", origin='upper', key=None):
         # Draw image
         self.axes.set_title(title, fontsize = 16)
-        self.axes.imshow(image, cmap=cmap, origin=origin)
+        self.setImage(image, cmap, origin, key)
         self.draw()
 
-    # Draw image with matplotlib without title
-    def drawData2(self, image, cmap=COLOR_MAP):
-        # Draw image
-        self.axes.imshow(image, cmap=cmap)
-        self.draw()
+    # Draw image with matplotlib without title (regions: parts of the image shown edited in place)
+    def drawData2(self, image, cmap=COLOR_MAP, key=None, regions=None):
+        if self.setImage(image, cmap, key=key, regions=regions):
+            self.blitImage()
+        else:
+            self.draw()
+
+    # Pyramid of an image, kept under its key while the same array is drawn again
+    def getPyramid(self, image, key=None, regions=None):
+        # Live images reuse the unnamed pyramid shown
+        if key is None and self.pyramid is not None and self.pyramid_key is None and self.pyramid.levels[0].shape == image.shape:
+            self.pyramid.update(image, regions)
+            return self.pyramid
+
+        pyramid = None if key is None else self.pyramids.get(key)
+        if pyramid is None or pyramid.levels[0] is not image:
+            pyramid = ImagePyramid(image)
+            if key is not None:
+                self.pyramids[key] = pyramid
+                while len(self.pyramids) > PYRAMID_CACHE:
+                    self.pyramids.popitem(last=False)
+        if key is not None:
+            self.pyramids.move_to_end(key)
+        return pyramid
+
+    # Update the persistent image, returns False when a new image artist was created or the view changed
+    def setImage(self, image, cmap=COLOR_MAP, origin=None, key=None, regions=None):
+        image = np.asarray(image)
+        shown = self.pyramid
+        pyramid = self.getPyramid(image, key, regions)
+        artist = self.image_artist
+        same_view = shown is not None and shown.shape == pyramid.shape
+        self.pyramid, self.pyramid_key = pyramid, key
+
+        if artist is not None and origin in (None, artist.origin):
+            artist.set_cmap(cmap)
+            artist.set_clim(pyramid.vmin, pyramid.vmax)
+            if not same_view:
+                self.resetView()
+            self.setLevel()
+            return same_view
+
+        # First image or another origin
+        if artist is not None:
+            artist.remove()
+        self.image_artist = self.axes.imshow(pyramid.level(0)[:1, :1], cmap=cmap, origin=origin or 'upper',
+                                             vmin=pyramid.vmin, vmax=pyramid.vmax)
+        self.axes.set_autoscale_on(False)
+        self.resetView()
+        self.setLevel()
+        return False
+
+    # Show the whole image
+    def resetView(self):
+        height, width = self.pyramid.shape
+        self.axes.set_xlim(-0.5, width - 0.5)
+        if self.image_artist is not None and self.image_artist.origin == 'lower':
+            self.axes.set_ylim(-0.5, height - 0.5)
+        else:
+            self.axes.set_ylim(height - 0.5, -0.5)
+
+    # Draw the visible part of the pyramid level matching the zoom & the widget size
+    def setLevel(self):
+        if self.image_artist is None or self.pyramid is None:
+            return
+        height, width = self.pyramid.shape
+        x0, x1 = sorted(self.axes.get_xlim())
+        y0, y1 = sorted(self.axes.get_ylim())
+        columns = (max(int(math.floor(x0 + 0.5)), 0), min(int(math.ceil(x1 + 0.5)), width))
+        rows = (max(int(math.floor(y0 + 0.5)), 0), min(int(math.ceil(y1 + 0.5)), height))
+
+        bbox = self.axes.bbox
+        index = min(self.pyramid.levelFor(columns[1] - columns[0], bbox.width),
+                    self.pyramid.levelFor(rows[1] - rows[0], bbox.height))
+        level = self.pyramid.level(index)
+        scale = 2**index
+
+        # Level pixels covering the visible image pixels
+        c0, c1 = columns[0] // scale, max(-(-columns[1] // scale), columns[0] // scale + 1)
+        r0, r1 = rows[0] // scale, max(-(-rows[1] // scale), rows[0] // scale + 1)
+        self.image_artist.set_data(level[r0:r1, c0:c1])
+
+        left, right = c0 * scale - 0.5, min(c1 * scale, width) - 0.5
+        top, bottom = r0 * scale - 0.5, min(r1 * scale, height) - 0.5
+        if self.image_artist.origin == 'lower':
+            self.image_artist.set_extent((left, right, top, bottom))
+        else:
+            self.image_artist.set_extent((left, right, bottom, top))
+
+    # Zoom around the cursor with the mouse wheel (zooming out stops at the whole image)
+    def zoom(self, event):
+        if self.pyramid is None or event.inaxes != self.axes or event.xdata is None:
+            return
+        factor = ZOOM_STEP ** (-event.step)
+        height, width = self.pyramid.shape
+        x0, x1 = self.axes.get_xlim()
+        y0, y1 = self.axes.get_ylim()
+        if factor >= 1 and abs(x1 - x0) * factor >= width and abs(y1 - y0) * factor >= height:
+            self.resetView()
+        else:
+            self.axes.set_xlim(event.xdata + (x0 - event.xdata) * factor, event.xdata + (x1 - event.xdata) * factor)
+            self.axes.set_ylim(event.ydata + (y0 - event.ydata) * factor, event.ydata + (y1 - event.ydata) * factor)
+        self.setLevel()
+        self.draw_idle()
+
+    # Pick the level of the new widget size
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.setLevel()
+
+    # Redraw only the image (and overlays) of the axes
+    def blitImage(self):
+        if self.background is None:
+            self.draw()
+            return
+        self.restore_region(self.background)
+        if self.image_artist is not None:
+            self.axes.draw_artist(self.image_artist)
+            # The overlays alone can be redrawn above the new image
+            self.background = self.copy_from_bbox(self.fig.bbox)
+        self.blitOverlays()
+
+    # Draw the visible overlays above the background & show the canvas
+    def blitOverlays(self, restore:bool=False):
+        if restore:
+            if self.background is None:
+                self.draw()
+                return
+            self.restore_region(self.background)
+        for artist in self.overlays:
+            if artist.get_visible():
+                self.axes.draw_artist(artist)
+        self.blit(self.fig.bbox)
+
+    # Save the background after a full draw (without the animated overlays) and draw the overlays
+    def saveBackground(self, event):
+        self.background = self.copy_from_bbox(self.fig.bbox)
+        self.blitOverlays()
+
+    # Queue the cursor position, inspected at most once per screen refresh
+    def hover(self, event):
+        inside = event.inaxes == self.axes and event.xdata is not None and event.ydata is not None
+        self.hover_position = (event.xdata, event.ydata) if inside else None
+        if not self.hover_timer.isActive():
+            self.hover_timer.start(self.refreshInterval())
+
+    # Annotate the voxel under the last cursor position (subclasses define self.annot & inspect)
+    def flushHover(self):
+        if self.annot is None:
+            return
+        position = self.hover_position
+        text = None
+        if position is not None and self.pyramid is not None:
+            # Rows along y, columns along x
+            x, y = round(position[1]), round(position[0])
+            height, width = self.pyramid.shape
+            if 0 <= x < height and 0 <= y < width:
+                text = self.inspect(x, y)
+
+        if text is None and not self.annot.get_visible():
+            return
+        self.annot.set_visible(text is not None)
+        if text is not None:
+            self.annot.xy = position
+            self.annot.set_text(text)
+        self.blitOverlays(restore=True)
+
+    # Text of the voxel (x, y) shown on hover, None for no annotation
+    def inspect(self, x:int, y:int):
+        return None
+
+    # Queue an image from a live source (thread safe through queued signals), drawn at the screen refresh rate
+    # region: slice of data changed in place since the last update (None when unknown)
+    def updateData(self, data, transform=None, cmap=COLOR_MAP, region=None):
+        regions = None
+        if region is not None and transform is None:
+            pending = self.pending
+            if pending is None:
+                regions = [region]
+            elif pending[0] is data and pending[3] is not None:
+                regions = pending[3] + [region]
+        self.pending = (data, transform, cmap, regions)
+        if not self.update_timer.isActive():
+            self.update_timer.start(self.refreshInterval())
+
+    # Draw the last queued image
+    def flushData(self):
+        if self.pending is None:
+            return
+        data, transform, cmap, regions = self.pending
+        self.pending = None
+        self.drawData2(data if transform is None else transform(data), cmap, regions=regions)
+
+    # Milliseconds between two screen refreshes
+    def refreshInterval(self):
+        screen = QtGui.QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen is not None else 0
+        return round(1000 / (rate if rate > 0 else DEFAULT_REFRESH_RATE))
 
     # Save Image
     def saveData(self,path):
@@ -109,6 +375,10 @@ class viewer(FigureCanvasQTAgg):
     # Clear figure
     def clearData(self):
         self.axes.clear()
+        self.image_artist = None
+        self.pyramid = None
+        self.pyramid_key = None
+        self.pyramids.clear()
         self.setTheme()
         self.draw()
                     
@@ -0,0 +1,182 @@
+# Purpose: Compiled sequence waveforms, the operations read by the engines and the sampled channels drawn by the diagram
+
+# Numpy library
+import numpy as np
+
+from Component import *
+from RFPulse import HARD_PULSE, DEFAULT_SAMPLES, DEFAULT_TBW, pulse_waveform, is_pulse_file
+
+X_AXIS = 'x'
+Y_AXIS = 'y'
+Z_AXIS = 'z'
+
+# Operations of the magnetization chain
+RF_OPERATION = "RF"
+RELAXATION_OPERATION = "Relaxation"
+SPOILER_OPERATION = "Spoiler"
+READOUT_OPERATION = "Readout"
+
+# Operations of the k space position
+MULTI_GRADIENT_OPERATION = "MultiGradient"
+GRADIENT_OPERATION = "Gradient"
+
+# Drawn gradient moments (half k space extents) of the parts the engines do not encode
+SLICE_SELECT_MOMENT = 1 # Slice selection of every RF pulse (the phantom is one slice)
+SPOILER_MOMENT = 4 # Spoilers dephase the transverse magnetization completely
+
+
+# Sampled waveforms of one TR
+class Waveform():
+    """
+    The operations are the ones the engines apply, in order, and the channels are sampled from
+    the same components on a shared time grid: every channel holds its value from time[i] to
+    time[i + 1], so a diagram of the channels shows exactly what is simulated.
+
+    Units: RF in degrees/ms (the area of a pulse is its flip angle) with its phase in degrees,
+    gradients in half k space extents/ms (the area of a lobe is its moment), gx along the
+    frequency encoding, gy along the phase encoding and gz along the slice selection.
+    """
+    def __init__(self, TR:float, operations:list, events:list, time:np.ndarray):
+        self.TR = TR
+        self.operations = operations # (name, value) of one TR, read by the engines
+        self.events = events # (start, duration) ms of every operation
+        self.time = time # Shared grid (T,) ms, ends at TR
+        self.rf = np.zeros(len(time))
+        self.rf_phase = np.zeros(len(time))
+        self.gx = np.zeros(len(time))
+        self.gy = np.zeros(len(time))
+        self.gz = np.zeros(len(time))
+        self.pe_table = np.zeros(len(time)) # gy per unit of (line - N/2) / (N/2)
+        self.adc = np.zeros(len(time), dtype=bool)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __repr__(self):
+        return f"Waveform TR={self.TR}ms operations={len(self.operations)} samples={len(self)}"
+
+    # Grid intervals [start, stop) covered by an event
+    def interval(self, start:float, duration:float):
+        return np.searchsorted(self.time, [start, start + duration])
+
+    # Step curve vertices (x, y) of a channel
+    def steps(self, channel:np.ndarray):
+        return np.repeat(self.time, 2)[1:-1], np.repeat(channel[:-1], 2)
+
+    # Channel values at times t (ms)
+    def sample(self, channel:np.ndarray, t):
+        index = np.clip(np.searchsorted(self.time, t, side='right') - 1, 0, len(self.time) - 1)
+        return channel[index]
+
+
+# RF operation value: the angle of a hard pulse, the whole pulse description of a shaped one
+def pulse_value(component:RFComponent):
+    shape = getattr(component, "shape", HARD_PULSE)
+    if shape is None or shape == HARD_PULSE:
+        return component.angle
+
+    if is_pulse_file(shape):
+        # The samples of the file, so the operations (and what is keyed on them) follow its edits
+        shape = tuple(np.load(shape).ravel().tolist())
+    shape = shape if isinstance(shape, str) else tuple(shape)
+    return (component.angle, shape, component.samples or DEFAULT_SAMPLES, component.tbw or DEFAULT_TBW, component.duration)
+
+
+# Signed gradient moment scale of a component
+def gradient_moment(component):
+    step = 1 if component.step is None else component.step
+    return -step if component.sign is False else step
+
+
+# Operations of one TR
+def compile_operations(components:list):
+    operations = []
+    prephased = False # Frequency encoding gradient since the last readout
+    for component in components:
+        # Check component type
+        if type(component) == RFComponent:
+            operations.append((RF_OPERATION, pulse_value(component)))
+        elif type(component) == RelaxationComponent:
+            operations.append((RELAXATION_OPERATION, component.duration))
+        elif type(component) == SpoilerComponent:
+            operations.append((SPOILER_OPERATION, None))
+        elif type(component) == MultiGradientComponent:
+            operations.append((MULTI_GRADIENT_OPERATION, (gradient_moment(component), bool(component.balanced), None)))
+        elif type(component) == GradientComponent:
+            axis = X_AXIS if component.encoding == "frequency" else Y_AXIS
+            prephased = prephased or axis == X_AXIS
+            operations.append((GRADIENT_OPERATION, (axis, gradient_moment(component), bool(component.balanced))))
+        elif type(component) == ReadoutComponent:
+            operations.append((READOUT_OPERATION, (component.duration, prephased)))
+            prephased = False
+
+    # Phase encoding tables belong to the next readout (the last one for rewinders)
+    readouts = [i for i, (name, _) in enumerate(operations) if name == READOUT_OPERATION]
+    for i, (name, value) in enumerate(operations):
+        if name == MULTI_GRADIENT_OPERATION:
+            following = [n for n, index in enumerate(readouts) if index > i]
+            readout = following[0] if following else len(readouts) - 1
+            operations[i] = (name, value[:2] + (max(readout, 0),))
+
+    return operations
+
+
+# Compile the components of a sequence into its operations & sampled waveforms
+def compile_waveform(components:list, TR:float):
+    """
+    Parameters:
+    components (list): Components of one TR, sorted with their relaxations (MRISequence.setup).
+    TR (float): Repetition time (ms), end of the grid.
+
+    Returns:
+    waveform (Waveform)
+    """
+    drawn = [component for component in components if type(component) != RelaxationComponent]
+    events = [(component.time, component.duration or 0) for component in components]
+    TR = TR or 0
+
+    envelopes = {id(component): rf_envelope(component) for component in drawn if type(component) == RFComponent}
+
+    # Grid: every start & end, and the samples of the shaped pulses
+    breakpoints = [np.array([0.0, max([TR] + [start + duration for start, duration in events])])]
+    for component in drawn:
+        samples = len(envelopes.get(id(component), [None]))
+        breakpoints.append(component.time + np.linspace(0, component.duration or 0, samples + 1))
+    waveform = Waveform(TR, compile_operations(components), events, np.unique(np.concatenate(breakpoints)))
+
+    for component in drawn:
+        duration = component.duration or 0
+        if duration <= 0:
+            continue
+        start, stop = waveform.interval(component.time, duration)
+        if type(component) == RFComponent:
+            # Envelope sample of every grid interval of the pulse, scaled to the flip angle
+            envelope = envelopes[id(component)]
+            middle = (waveform.time[start:stop] + waveform.time[start + 1:stop + 1]) / 2
+            index = np.minimum(((middle - component.time) / duration * len(envelope)).astype(int), len(envelope) - 1)
+            amplitude = component.angle * envelope[index] / (envelope.mean() * duration)
+            waveform.rf[start:stop] += np.abs(amplitude)
+            waveform.rf_phase[start:stop] = np.where(amplitude < 0, 180, 0)
+            waveform.gz[start:stop] += SLICE_SELECT_MOMENT / duration
+        elif type(component) == SpoilerComponent:
+            waveform.gz[start:stop] += SPOILER_MOMENT / duration
+        elif type(component) == MultiGradientComponent:
+            waveform.pe_table[start:stop] += gradient_moment(component) / duration
+        elif type(component) == GradientComponent:
+            channel = waveform.gx if component.encoding == "frequency" else waveform.gy
+            channel[start:stop] += gradient_moment(component) / duration
+        elif type(component) == ReadoutComponent:
+            # The readout gradient crosses the whole k space extent
+            waveform.adc[start:stop] = True
+            waveform.gx[start:stop] += 2 / duration
+
+    return waveform
+
+
+# Envelope samples of an RF pulse (one sample for a hard pulse)
+def rf_envelope(component:RFComponent):
+    value = pulse_value(component)
+    if isinstance(value, tuple):
+        _, shape, samples, tbw, _ = value
+        return pulse_waveform(shape if isinstance(shape, str) else list(shape), samples, tbw)
+    return np.ones(1)
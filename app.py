@@ -11,14 +11,26 @@ from PhantomViewer import PhantomViewer
 from SequenceViewer import SequenceViewer
 from ImageViewer import ImageViewer
 from Phantom import Phantom
+from Cache import SimulationCache, DEFAULT_CACHE_DIRECTORY
+from Simulator import SnapshotStore, ConvergenceMonitor
+from MRISequence import PE_ORDERS
+from Analytic import AnalyticEngine
+from Noise import add_noise, snr_sigma
+from MemoryPlanner import plan_simulation
+from Metrics import watch_cache
 
 # Numpy
 import numpy as np
 import math
+import os
+import time
 
 import warnings
 warnings.filterwarnings("ignore")
 
+# Seconds between the intermediate images of a run
+PREVIEW_INTERVAL = 0.5
+
 # Main Window
 class MainWindow(QtWidgets.QMainWindow):
     
@@ -29,6 +41,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setWindowIcon(QtGui.QIcon("assets/icon.ico"))
         self.running = False
         self.k_space = np.array([])
+        self.cache = SimulationCache(directory=DEFAULT_CACHE_DIRECTORY)
+        self.snapshots = SnapshotStore() # Shared states for incremental re-runs
+        watch_cache("results", self.cache)
+        watch_cache("snapshots", self.snapshots)
         
         # Initialize the UI
         self.UI_init()
@@ -68,7 +84,7 @@ class MainWindow(QtWidgets.QMainWindow):
         selector_layout = QtWidgets.QHBoxLayout()
         ##### Selector
         self.mode_selector = QtWidgets.QComboBox()
-        self.mode_selector.addItems(["Protein Density", "T1", "T2", "T2*", "Delta B"])
+        self.mode_selector.addItems(["Protein Density", "T1", "T2", "T2*", "Delta B", "B1+"])
         selector_layout.addWidget(self.mode_selector,4)
         ##### Reset Button
         self.reset_M_Btn = QtWidgets.QPushButton("Reset Magnetization")
@@ -89,6 +105,17 @@ class MainWindow(QtWidgets.QMainWindow):
         ###### Constant Button
         self.const_button = QtWidgets.QPushButton("Constant")
         self.phantom_buttons_layout.addWidget(self.const_button)
+        ###### Matrix Size
+        self.matrix_size = QtWidgets.QSpinBox()
+        self.matrix_size.setRange(2, 1024)
+        self.matrix_size.setValue(32)
+        self.matrix_size.setPrefix("N = ")
+        self.matrix_size.setToolTip("Matrix size of new phantoms (and of opened ones when resampled)")
+        self.phantom_buttons_layout.addWidget(self.matrix_size)
+        ###### Resample Opened Phantoms
+        self.resample_opened = QtWidgets.QCheckBox("Resample")
+        self.resample_opened.setToolTip("Resample opened phantoms to the matrix size instead of keeping their own size")
+        self.phantom_buttons_layout.addWidget(self.resample_opened)
         lower_layout.addLayout(self.phantom_buttons_layout, 1)
         
         ##### Phantom Viewer
@@ -128,6 +155,31 @@ class MainWindow(QtWidgets.QMainWindow):
                                       color: #dadada;
                                       font-weight: bold;""")
         control_layout.addWidget(self.run_button,2)
+        ##### Preview Button
+        self.preview_button = QtWidgets.QPushButton("Preview")
+        self.preview_button.setToolTip("Closed-form result of spoiled spin echo & gradient echo sequences")
+        control_layout.addWidget(self.preview_button,1)
+        #### Acquisition Options Layout
+        options_layout = QtWidgets.QHBoxLayout()
+        sequence_layout.addLayout(options_layout)
+        ##### Noise SNR
+        self.noise_snr = QtWidgets.QDoubleSpinBox()
+        self.noise_snr.setRange(0, 1000)
+        self.noise_snr.setValue(0)
+        self.noise_snr.setPrefix("SNR ")
+        self.noise_snr.setSpecialValueText("No noise")
+        self.noise_snr.setToolTip("Complex Gaussian noise added to the acquired k space before the reconstruction")
+        options_layout.addWidget(self.noise_snr,1)
+        ##### PE Order
+        self.pe_order = QtWidgets.QComboBox()
+        for ordering in PE_ORDERS:
+            self.pe_order.addItem(ordering.replace("_", " ").capitalize(), ordering)
+        self.pe_order.setToolTip("Order of the phase encoding lines")
+        options_layout.addWidget(self.pe_order,1)
+        ##### Stop Early
+        self.stop_early = QtWidgets.QCheckBox("Stop when converged")
+        self.stop_early.setToolTip("Stop the run once new lines no longer change the image")
+        options_layout.addWidget(self.stop_early,1)
 
         ###############################
         
@@ -204,10 +256,13 @@ class MainWindow(QtWidgets.QMainWindow):
         # Run Button
         self.run_button.clicked.connect(self.run_button_event)
         
+        # Preview Button
+        self.preview_button.clicked.connect(self.preview_button_event)
+        
         # Phantom Buttons
-        self.shepp_logan_button.clicked.connect(lambda: self.phantom_viewer.setSheppLogan(32))
-        self.gradient_button.clicked.connect(lambda: self.phantom_viewer.setGradient(32))
-        self.const_button.clicked.connect(lambda: self.phantom_viewer.setConstant(32,120))
+        self.shepp_logan_button.clicked.connect(lambda: self.phantom_viewer.setSheppLogan(self.matrix_size.value()))
+        self.gradient_button.clicked.connect(lambda: self.phantom_viewer.setGradient(self.matrix_size.value()))
+        self.const_button.clicked.connect(lambda: self.phantom_viewer.setConstant(self.matrix_size.value(),120))
         
         # Reset Mag. Button
         self.reset_M_Btn.clicked.connect(self.phantom_viewer.resetM)
@@ -238,12 +293,14 @@ class MainWindow(QtWidgets.QMainWindow):
             filenames = file_dialog.selectedFiles()
             if len(filenames) > 0:
                 filename = filenames[0]
-                ext = filename.split('.')[1]
-                # try:
-                self.phantom_viewer.setData(filename, ext)
-                # except Exception as e:
-                #     print(e)
-                #     QtWidgets.QMessageBox.critical(self, "Error", "Unable to open the phantom file.")
+                ext = os.path.splitext(filename)[1][1:].lower()
+                # Native size unless resampling is asked for
+                size = self.matrix_size.value() if self.resample_opened.isChecked() else None
+                try:
+                    self.phantom_viewer.setData(filename, ext, size)
+                except (OSError, ValueError) as e:
+                    print(e)
+                    QtWidgets.QMessageBox.critical(self, "Error", f"Unable to open the phantom file.\n{e}")
 
     # Open Sequence
     def open_sequence(self):
@@ -256,6 +313,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 filename = filenames[0]
                 try:
                     self.sequence_viewer.setData(filename)
+                    self.pe_order.setCurrentIndex(PE_ORDERS.index(self.sequence_viewer.get_sequence().get_ordering()))
                 except Exception as e:
                     print(e)
                     QtWidgets.QMessageBox.critical(self, "Error", "Unable to open the sequence file.")                    
@@ -285,6 +343,19 @@ class MainWindow(QtWidgets.QMainWindow):
             
         self.running = not self.running
 
+    # Preview Button (analytic engine)
+    def preview_button_event(self):
+        sequence = self.sequence_viewer.get_sequence()
+        phantom = self.phantom_viewer.getPhantom()
+        engine = AnalyticEngine(phantom, sequence)
+        if not engine.supports():
+            QtWidgets.QMessageBox.information(self, "Preview", "Preview is only available for spin echo and gradient echo sequences with hard pulses, no flip angle train and the transverse magnetization spoiled (or decayed) before the next excitation. Run the Bloch simulation instead.")
+            return
+        
+        self.k_space = engine.run()
+        self.k_space_viewer.drawData2(np.abs(self.k_space))
+        self.draw_output(self.k_space)
+
     # Run the sequence
     def run_sequence(self, sequence):
         # Settings before running
@@ -294,10 +365,44 @@ class MainWindow(QtWidgets.QMainWindow):
         # Get phantom to simulate
         phantom = self.phantom_viewer.getPhantom() # Phantom object [M, T1, T2, PD]
         N = phantom.width
+        self.progress_bar.setFormat("%p%")
+        sequence.set_ordering(self.pe_order.currentData())
+
+        # Every run starts from the relaxed magnetization, so identical runs share their cached result
+        phantom.reset_M()
+
+        # Reuse the result of an identical run
+        key = self.cache.key(phantom, sequence)
+        result = self.cache.get(key)
+        if result is not None:
+            phantom.M = np.copy(result["M"])
+            self.k_space = result["k_space"]
+            self.k_space_viewer.drawData2(np.abs(self.k_space))
+            self.progress_bar.setValue(100)
+            QtCore.QTimer.singleShot(0, self.output_update)
+            return
+
+        # Check the memory before allocating
+        plan = plan_simulation(phantom, sequence, snapshot_bytes=self.snapshots.max_bytes, display=True)
+        if not plan.fits:
+            QtWidgets.QMessageBox.critical(self, "Memory", plan.message())
+            QtCore.QTimer.singleShot(0, self.reset_run_button)
+            return
+        snapshots = self.snapshots
+        if plan.degraded:
+            QtWidgets.QMessageBox.warning(self, "Memory", plan.message())
+            if plan.snapshot_bytes < self.snapshots.max_bytes:
+                snapshots = None
+
+        # Shared k space, filled in place by the worker
+        self.k_space = np.zeros((N, N), dtype=complex)
+        self.k_space_magnitude = np.zeros((N, N))
 
         # Initialize the thread and worker
         self.thread = QtCore.QThread()
-        self.worker = SequenceWorker(phantom, sequence, self.k_space_viewer)
+        monitor = ConvergenceMonitor() if self.stop_early.isChecked() else None
+        self.worker = SequenceWorker(phantom, sequence, self.k_space, self.cache, key, snapshots, plan.chunk_rows, monitor)
+        self.last_preview = time.monotonic()
 
         # Final resets
         # Move worker to the thread
@@ -308,8 +413,9 @@ class MainWindow(QtWidgets.QMainWindow):
         self.worker.finished.connect(self.thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
         self.thread.finished.connect(self.thread.deleteLater)
-        self.worker.k_space_update.connect(self.k_space_update)
+        self.worker.k_space_line.connect(self.k_space_update)
         self.worker.progress.connect(self.updateSimulatorProgress)
+        self.worker.stats.connect(self.updateSimulatorStats)
         
         # Start the thread
         self.thread.start()
@@ -327,25 +433,38 @@ class MainWindow(QtWidgets.QMainWindow):
     # Update the progress bar    
     def updateSimulatorProgress(self, progress):
         self.progress_bar.setValue(progress)
+
+    # Show the throughput & remaining time on the progress bar
+    def updateSimulatorStats(self, stats):
+        eta = stats["eta"]
+        eta_text = "--:--" if eta is None else f"{int(eta // 60):02d}:{int(eta % 60):02d}"
+        self.progress_bar.setFormat(f"%p%  {stats['lines_per_second']:.1f} lines/s  ETA {eta_text}")
+        self.progress_bar.setToolTip(f"{stats['voxel_updates_per_second']:.3g} voxel updates/s")
         
-    @QtCore.pyqtSlot(np.ndarray)
-    def k_space_update(self, k_space):
-        self.k_space = k_space
+    # A line of the shared k space is complete
+    @QtCore.pyqtSlot(int)
+    def k_space_update(self, line):
+        self.k_space_magnitude[:, line] = np.abs(self.k_space[:, line])
+        self.k_space_viewer.updateData(self.k_space_magnitude, region=np.s_[:, line])
+
+        # Intermediate image of the lines acquired so far
+        if time.monotonic() - self.last_preview >= PREVIEW_INTERVAL:
+            self.draw_output(self.k_space)
+            self.last_preview = time.monotonic()
 
     @QtCore.pyqtSlot()    
     def output_update(self):
         ### Make inverse fourier transform
         print(self.k_space)
-        if self.k_space:
-            result_image = np.fft.ifft2(self.k_space)
-            if self.choose_output_1.isChecked():
-                self.output_viewer_1.drawData(np.abs(result_image), title="Output 1")
-            elif self.choose_output_2.isChecked():
-                self.output_viewer_2.drawData(np.abs(result_image), title="Output 2")
+        if self.k_space.size:
+            self.draw_output(self.k_space)
         else:
             QtWidgets.QMessageBox.critical(self, "Error", "Please, upload the phantom.")
 
-        
+        self.reset_run_button()
+
+    # Back to the idle state
+    def reset_run_button(self):
         self.run_button.setIcon(QtGui.QIcon("./assets/play.ico"))
         self.run_button.setText("Run")
         
@@ -353,6 +472,21 @@ class MainWindow(QtWidgets.QMainWindow):
         self.choose_output_2.setEnabled(True)
         self.running = False
     
+    # Draw the reconstructed image in the chosen output
+    def draw_output(self, k_space):
+        # Noise of the acquisition, the simulated k space stays noiseless
+        snr = self.noise_snr.value()
+        suffix = ""
+        if snr > 0 and np.any(k_space):
+            k_space = add_noise(k_space, snr_sigma(k_space, snr))
+            suffix = f" (SNR {snr:g})"
+
+        result_image = np.fft.ifft2(k_space)
+        if self.choose_output_1.isChecked():
+            self.output_viewer_1.drawData(np.abs(result_image), title="Output 1" + suffix)
+        elif self.choose_output_2.isChecked():
+            self.output_viewer_2.drawData(np.abs(result_image), title="Output 2" + suffix)
+
     # Close the application
     def closeEvent(self, QCloseEvent):
         super().closeEvent(QCloseEvent)
@@ -379,4 +513,4 @@ class MainWindow(QtWidgets.QMainWindow):
         
     def test2(self, N=16):
         image = self.phantom_viewer.setSheppLogan(N)
-        self.test(image)
\ No newline at end of file
+        self.test(image)
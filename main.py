@@ -2,6 +2,7 @@ import sys
 from PyQt5.QtWidgets import QApplication 
 from app import MainWindow
 from qdarktheme import load_stylesheet
+from Metrics import configure_from_environment
 # Ignore warnings
 import warnings
 warnings.filterwarnings("ignore")
@@ -10,6 +11,9 @@ warnings.filterwarnings("ignore")
 def main():
     """Main function for the application."""
 
+    # Publish simulation metrics when MRI_METRICS_PORT or MRI_METRICS_FILE is set
+    exporters = configure_from_environment()
+
     # Create the application
     app = QApplication(sys.argv)
     app.setStyleSheet(load_stylesheet())
@@ -19,7 +23,10 @@ def main():
     window.show()
 
     # Start the event loop
-    sys.exit(app.exec_())
+    code = app.exec_()
+    for exporter in exporters:
+        exporter.stop()
+    sys.exit(code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,21 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEQUENCES = os.path.join(ROOT, "Resources", "Sequences")
+
+
+# Json parameters of a bundled sequence
+def sequence_params(name:str):
+    with open(os.path.join(SEQUENCES, f"{name}.json")) as file:
+        return json.load(file)
+
+
+@pytest.fixture
+def params():
+    return sequence_params
@@ -0,0 +1,121 @@
+import copy
+
+import numpy as np
+import pytest
+from phantominator import shepp_logan
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator, reconstruct
+from Analytic import AnalyticEngine, GRADIENT_ECHO, SPIN_ECHO, analyze, classify
+
+
+def phantom(N:int=16, B1:bool=False, image=None):
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)) if image is None else image)
+    if B1:
+        phantom.B1 = np.random.default_rng(1).uniform(0.8, 1.2, (N, N))
+    return phantom
+
+
+# Bundled sequence with a spoiler after the readout
+def spoiled(params, name:str):
+    sequence = copy.deepcopy(params(name))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    return sequence
+
+
+# Both engines on copies of the same phantom, the Bloch one after a first run (dummy scans) when warm
+def k_spaces(sequence, phantom, warm:bool=False):
+    analytic = AnalyticEngine(phantom.copy(), sequence)
+    assert analytic.supports()
+    phantom = phantom.copy()
+    if warm:
+        Simulator(phantom, sequence).run()
+    return analytic.run(), Simulator(phantom, sequence).run()
+
+
+# The Bloch run starts from the relaxed phantom: every line after the first TR is at steady state
+@pytest.mark.parametrize("name", ["GE_T1", "GE_PD", "GE_T2", "SE"])
+def test_steady_state_matches_bloch(params, name):
+    sequence = load_sequence(spoiled(params, name))
+    analytic, bloch = k_spaces(sequence, phantom())
+
+    first = sequence.get_pe_order(16)[0]
+    steady = np.arange(16) != first
+    np.testing.assert_allclose(analytic[:, steady], bloch[:, steady], rtol=1e-9, atol=1e-9 * np.abs(bloch).max())
+
+
+# Flip angles below 90° approach the steady state over several TRs
+def test_gradient_echo_flip_angle_map(params):
+    analytic, bloch = k_spaces(load_sequence(spoiled(params, "GE_T1")), phantom(B1=True), warm=True)
+    np.testing.assert_allclose(analytic, bloch, rtol=1e-6, atol=1e-6 * np.abs(bloch).max())
+
+
+# Whole images once the Bloch run starts at steady state
+@pytest.mark.parametrize("name", ["GE_T1", "GE_PD", "GE_T2", "SE"])
+def test_image_at_steady_state(params, name):
+    analytic, bloch = k_spaces(load_sequence(spoiled(params, name)), phantom(image=shepp_logan(32) * 255), warm=True)
+    np.testing.assert_allclose(reconstruct(analytic), reconstruct(bloch), rtol=1e-6, atol=1e-6 * reconstruct(bloch).max())
+
+
+# From the relaxed phantom only the first line differs, little when TR is long compared to T1
+@pytest.mark.parametrize("name, tolerance", [("GE_T1", 0.02), ("GE_PD", 0.005), ("GE_T2", 0.005)])
+def test_image_tolerance(params, name, tolerance):
+    analytic, bloch = k_spaces(load_sequence(spoiled(params, name)), phantom(image=shepp_logan(32) * 255))
+    difference = np.abs(reconstruct(analytic) - reconstruct(bloch))
+    assert difference.mean() < tolerance * reconstruct(bloch).mean()
+
+
+# The intervals are the relaxations of the chain: pulses & readouts take no time in the Bloch engine
+def test_timing(params):
+    sequence = load_sequence(params("SE"))
+    assert (sequence.get_TR(), sequence.get_TE()) == (250, 90)
+    contrast, timing = analyze(sequence)
+    assert contrast == SPIN_ECHO
+    assert timing == {"TR": 230, "TE": 70, "tau": 35, "residual": 160}
+    assert analyze(load_sequence(spoiled(params, "SE")))[1]["residual"] == 0
+
+
+# Lines encoded where the gradient moments lead, not on a fixed grid
+def test_encoding_follows_the_moments(params):
+    sequence = spoiled(params, "GE_T1")
+    default, _ = k_spaces(load_sequence(sequence), phantom())
+    sequence["component"]["PE"]["multi"][0].update(step=2, sign=False)
+    analytic, bloch = k_spaces(load_sequence(sequence), phantom())
+
+    first = load_sequence(sequence).get_pe_order(16)[0]
+    steady = np.arange(16) != first
+    np.testing.assert_allclose(analytic[:, steady], bloch[:, steady], rtol=1e-9, atol=1e-9 * np.abs(bloch).max())
+    assert not np.allclose(analytic, default)
+
+
+# Without spoiler the closed forms hold once the transverse magnetization decays before the next excitation
+@pytest.mark.parametrize("name", ["GE_T1", "GE_PD", "GE_T2", "SE"])
+def test_unspoiled_sequences(params, name):
+    sequence = load_sequence(params(name))
+    assert classify(sequence) is not None
+    # Echoes of the earlier TRs with long T2*
+    assert not AnalyticEngine(phantom(), sequence).supports()
+
+    decayed = phantom()
+    decayed.t2_star = np.full((16, 16), 15.0)
+    analytic, bloch = k_spaces(sequence, decayed)
+    first = sequence.get_pe_order(16)[0]
+    steady = np.arange(16) != first
+    np.testing.assert_allclose(analytic[:, steady], bloch[:, steady], rtol=1e-3, atol=1e-3 * np.abs(bloch).max())
+
+
+def test_spoiling_before_the_echo_needs_bloch(params):
+    sequence = spoiled(params, "GE_T1")
+    sequence["component"]["spoiler"] = [{"time": 12, "duration": 2}]
+    assert classify(load_sequence(sequence)) is None
+
+
+@pytest.mark.parametrize("name", ["MRF", "SE_sinc", "Bssf"])
+def test_unsupported_sequences(params, name):
+    assert classify(load_sequence(params(name))) is None
+
+
+def test_spin_echo_needs_uniform_B1(params):
+    assert not AnalyticEngine(phantom(B1=True), load_sequence(params("SE"))).supports()
@@ -0,0 +1,58 @@
+import copy
+
+import numpy as np
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator
+from Analytic import analyze
+from Waveform import X_AXIS
+
+
+N = 16
+
+
+def phantom(B1:np.ndarray):
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    phantom.B1 = B1
+    return phantom
+
+
+# Every voxel rotated by its own flip angle, as a scalar rotation of that voxel alone would
+def test_per_voxel_rotation(params):
+    B1 = np.random.default_rng(1).uniform(0.5, 1.5, (N, N))
+    simulator = Simulator(phantom(B1), load_sequence(params("GE_T1")))
+    M = np.random.default_rng(2).normal(size=(N, N, 3))
+
+    rotated = simulator.rotation(M, 90 * B1, X_AXIS)
+    for x, y in [(0, 0), (3, 7), (15, 2)]:
+        np.testing.assert_allclose(rotated[x, y], simulator.rotation(M[x, y], 90 * B1[x, y], X_AXIS))
+    np.testing.assert_allclose(np.linalg.norm(rotated, axis=-1), np.linalg.norm(M, axis=-1))
+
+
+# Spoiled gradient echo: the longitudinal steady state of every voxel follows its scaled flip angle
+def test_steady_state_follows_the_flip_angle_map(params):
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    sequence = load_sequence(sequence)
+    B1 = np.random.default_rng(1).uniform(0.5, 1.5, (N, N))
+    scaled = phantom(B1)
+    for _ in range(2): # Flip angles far from 90° approach the steady state over more TRs
+        Simulator(scaled, sequence).run()
+
+    E1 = np.exp(-analyze(sequence)[1]["TR"] / scaled.t1)
+    alpha = np.radians(90 * B1)
+    np.testing.assert_allclose(scaled.M[..., 2], scaled.PD * (1 - E1) / (1 - np.cos(alpha) * E1), rtol=1e-6)
+    np.testing.assert_allclose(scaled.M[..., :2], 0)
+
+
+# A uniform map of ones is the nominal flip angle, twice the field inverts instead of exciting
+def test_uniform_maps(params):
+    sequence = load_sequence(params("GE_T1"))
+    nominal = phantom(np.ones((N, N)))
+    ones = phantom(np.full((N, N), 1 + 1e-12)) # Takes the per voxel path
+    np.testing.assert_allclose(Simulator(ones, sequence).run(), Simulator(nominal, sequence).run(), atol=1e-6)
+
+    inverted = phantom(np.full((N, N), 2.0))
+    np.testing.assert_allclose(Simulator(inverted, sequence).run(), 0, atol=1e-9)
@@ -0,0 +1,124 @@
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator
+from Cache import SimulationCache, simulation_key
+
+
+def result(value:float, size:int=16):
+    array = np.full((size, size), value, dtype=complex)
+    return array, np.abs(array), np.zeros((size, size, 3))
+
+
+def files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".npz"))
+
+
+def test_memory_lru():
+    cache = SimulationCache(max_items=2)
+    cache.put("a", *result(1))
+    cache.put("b", *result(2))
+    cache.get("a")
+    cache.put("c", *result(3))
+
+    assert list(cache.items) == ["a", "c"]
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_hit_after_memory_eviction(tmp_path):
+    cache = SimulationCache(max_items=1, directory=str(tmp_path))
+    cache.put("a", *result(1))
+    cache.put("b", *result(2))
+
+    hit = cache.get("a")
+    assert hit is not None and hit["k_space"][0, 0] == 1
+    assert list(cache.items) == ["a"]
+
+
+# The disk cache keeps the most recently used results within its budget
+def test_disk_budget(tmp_path):
+    entry = result(0)
+    cache = SimulationCache(max_items=1, directory=str(tmp_path))
+    cache.put("a", *entry)
+    size = os.path.getsize(cache.path("a"))
+    cache.max_disk_bytes = 2 * size
+
+    cache.put("b", *entry)
+    os.utime(cache.path("a"), (1, 1))
+    os.utime(cache.path("b"), (2, 2))
+    cache.get("a") # Refreshes a (b is now the oldest)
+    cache.put("c", *entry)
+
+    assert files(tmp_path) == ["a.npz", "c.npz"]
+
+
+def test_unlimited_disk(tmp_path):
+    cache = SimulationCache(max_items=1, directory=str(tmp_path), max_disk_bytes=None)
+    for key in "abcd":
+        cache.put(key, *result(1))
+    assert len(files(tmp_path)) == 4
+
+
+def test_clear(tmp_path):
+    cache = SimulationCache(directory=str(tmp_path))
+    cache.put("a", *result(1))
+    cache.clear(disk=True)
+    assert len(cache) == 0 and files(tmp_path) == []
+
+
+def test_results_are_not_shared_writable(tmp_path):
+    cache = SimulationCache(max_items=1, directory=str(tmp_path))
+    k_space, image, M = result(1)
+    cache.put("a", k_space, image, M)
+    k_space[0, 0] = 5 # The caller keeps its own buffer
+    assert cache.get("a")["k_space"][0, 0] == 1
+
+    cache.put("b", *result(2))
+    for hit in (cache.get("b"), cache.get("a")): # Memory & disk hits
+        with pytest.raises(ValueError):
+            hit["k_space"][0, 0] = 3
+
+
+def test_concurrent_puts_of_one_key(tmp_path):
+    cache = SimulationCache(directory=str(tmp_path))
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: cache.put("a", *result(1, 64)), range(32)))
+    assert os.listdir(tmp_path) == ["a.npz"]
+    assert cache.get("a")["k_space"][0, 0] == 1
+
+
+# Identical runs share their key once the magnetization is reset, as the GUI does before every run
+def test_rerun_key(params):
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (8, 8)))
+    sequence = load_sequence(params("GE_T1"))
+    key = simulation_key(phantom, sequence)
+    Simulator(phantom, sequence).run()
+    assert simulation_key(phantom, sequence) != key
+    phantom.reset_M()
+    assert simulation_key(phantom, sequence) == key
+
+
+# The key follows the samples of a pulse file, not its path
+def test_pulse_file_key(params, tmp_path):
+    path = str(tmp_path / "pulse.npy")
+    np.save(path, np.hanning(32))
+    sequence_params = copy.deepcopy(params("SE"))
+    sequence_params["component"]["RF"][0]["shape"] = path
+    sequence = load_sequence(sequence_params)
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (8, 8)))
+
+    key = simulation_key(phantom, sequence)
+    waveform = sequence.get_waveform()
+    np.save(path, np.hanning(32)**2)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert simulation_key(phantom, sequence) != key
+    assert sequence.get_waveform() is not waveform
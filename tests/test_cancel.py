@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator
+from EPG import EPGEngine
+
+
+def phantom(N:int=8):
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    return phantom
+
+
+# Pause between two TRs, while operations of the chain are still pending
+@pytest.mark.parametrize("engine", [Simulator, EPGEngine])
+def test_pause_between_trs(params, engine):
+    simulator = engine(phantom(), load_sequence(params("SE")))
+    start = np.copy(simulator.phantom.M)
+    stats = lambda _: simulator.pause()
+
+    k_space = simulator.run(stats=stats)
+
+    assert not simulator.isRunning()
+    assert np.count_nonzero(np.abs(k_space).sum(axis=0)) == 1
+    assert np.all(np.isfinite(simulator.phantom.M))
+    assert not np.array_equal(simulator.phantom.M, start)
+
+
+# Cancel before the run starts (a queued job)
+def test_pause_before_run(params):
+    simulator = EPGEngine(phantom(), load_sequence(params("SE")))
+    start = np.copy(simulator.phantom.M)
+    simulator.pause()
+
+    k_space = simulator.run()
+
+    assert not k_space.any()
+    assert np.array_equal(simulator.phantom.M, start)
+
+
+# Pause while a line is read
+def test_pause_during_readout(params):
+    simulator = Simulator(phantom(), load_sequence(params("SE")))
+    lines = simulator.iterate()
+    next(lines)
+    simulator.pause()
+    assert list(lines) == []
+    assert np.all(np.isfinite(simulator.phantom.M))
+
+
+# The GUI worker always reports the end of its run
+def test_worker_finishes_when_cancelled(params, monkeypatch):
+    pytest.importorskip("PyQt5")
+    from Simulator import SimulationCancelled
+    from Worker import SequenceWorker
+
+    worker = SequenceWorker(phantom(), load_sequence(params("SE")), np.zeros((8, 8), dtype=complex))
+    finished = []
+    worker.finished.connect(lambda: finished.append(True))
+
+    def cancelled(**kwargs):
+        raise SimulationCancelled()
+    monkeypatch.setattr(worker.simulator, "run", cancelled)
+
+    worker.run()
+    assert finished == [True]
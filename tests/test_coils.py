@@ -0,0 +1,84 @@
+import copy
+
+import numpy as np
+import pytest
+from phantominator import shepp_logan
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator, reconstruct
+from Coils import coil_sensitivities, sampling_mask, acquire, sense_reconstruct, grappa_reconstruct, combine, coil_images
+
+
+N = 32
+COILS = 8
+
+
+# Complex object and the fully sampled k space of every coil, centered as the simulator reads it
+def acquisition(N:int=N):
+    rng = np.random.default_rng(0)
+    image = shepp_logan(N) * np.exp(1j * rng.uniform(-0.3, 0.3, (N, N)))
+    sensitivities = coil_sensitivities(N, COILS)
+    return image, sensitivities, np.fft.fftshift(np.fft.fft2(sensitivities * image, axes=(-2, -1)), axes=(-2, -1))
+
+
+def test_sensitivities_peak_at_one():
+    sensitivities = coil_sensitivities(N, COILS)
+    np.testing.assert_allclose(np.sqrt((np.abs(sensitivities)**2).sum(axis=0)).max(), 1)
+
+
+def test_sampling_mask():
+    mask = sampling_mask(N, 4, 8)
+    assert mask[::4].all()
+    assert mask[12:20].all()
+    assert mask.sum() == N // 4 + 6
+
+
+@pytest.mark.parametrize("acceleration", [2, 4])
+def test_sense_is_exact(acceleration):
+    image, sensitivities, k_spaces = acquisition()
+    np.testing.assert_allclose(sense_reconstruct(k_spaces, sensitivities, acceleration), np.abs(image), atol=1e-9)
+
+
+def test_sense_needs_a_divisor():
+    image, sensitivities, k_spaces = acquisition()
+    with pytest.raises(ValueError):
+        sense_reconstruct(k_spaces, sensitivities, 3)
+
+
+def test_fully_sampled_combination():
+    image, sensitivities, k_spaces = acquisition()
+    np.testing.assert_allclose(combine(coil_images(k_spaces), sensitivities), np.abs(image), atol=1e-9)
+
+
+@pytest.mark.parametrize("acceleration, tolerance", [(2, 0.05), (3, 0.1)])
+def test_grappa_unfolds(acceleration, tolerance):
+    image, sensitivities, k_spaces = acquisition()
+    truth = combine(coil_images(k_spaces))
+    undersampled = k_spaces * sampling_mask(N, acceleration, 12)
+
+    error = np.linalg.norm(grappa_reconstruct(undersampled, acceleration, 12) - truth) / np.linalg.norm(truth)
+    aliased = np.linalg.norm(combine(coil_images(undersampled)) - truth) / np.linalg.norm(truth)
+    assert error < tolerance
+    assert error < aliased / 4
+
+
+def test_grappa_needs_calibration_lines():
+    image, sensitivities, k_spaces = acquisition()
+    with pytest.raises(ValueError):
+        grappa_reconstruct(k_spaces * sampling_mask(N, 4, 4), 4, 4)
+
+
+# Simulated undersampled acquisition unfolded by SENSE = single coil image (steady state, every line sees the same magnetization)
+def test_simulated_sense(params):
+    # Spoiled, every TR after the first one is at steady state whatever the lines acquired
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (16, 16)))
+    Simulator(phantom, load_sequence(sequence)).run()
+    sensitivities = coil_sensitivities(16, COILS)
+
+    k_spaces = acquire(phantom.copy(), load_sequence(sequence), sensitivities, 2)
+    single = reconstruct(Simulator(phantom.copy(), load_sequence(sequence)).run())
+    np.testing.assert_allclose(sense_reconstruct(k_spaces, sensitivities, 2), single, atol=1e-9 * single.max())
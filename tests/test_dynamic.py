@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Dynamic import enhancement_frames, motion_frames, translation_field, iterate_frames
+
+
+N = 16
+
+
+def phantom():
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    return phantom
+
+
+def enhancement():
+    base = phantom()
+    mask = np.zeros((N, N), dtype=bool)
+    mask[4:8, 5:9] = True
+    return enhancement_frames(base, mask, [base.t1.max(), 300, 200, 200], [50, 40, 30, 30])
+
+
+def motion():
+    return motion_frames(phantom(), translation_field(N, [(0, 0), (1, 0), (1, 0), (0, 1)]))
+
+
+# Frames built twice: simulating them replaces their magnetization
+@pytest.mark.parametrize("frames", [enhancement, motion])
+def test_incremental_frames_match_full_frames(frames, params):
+    incremental = list(iterate_frames(frames(), load_sequence(params("GE_T1"))))
+    full = list(iterate_frames(frames(), load_sequence(params("GE_T1")), incremental=False))
+    for (k_incremental, _), (k_full, _) in zip(incremental, full):
+        np.testing.assert_allclose(k_incremental, k_full, atol=1e-9 * np.abs(k_full).max())
+
+
+def test_only_changed_voxels_are_simulated(params):
+    counts = [count for _, count in iterate_frames(enhancement(), load_sequence(params("GE_T1")))]
+    # Full first frame, the 16 enhancing voxels simulated with their old & new maps, nothing for an unchanged frame
+    assert counts == [N * N, 32, 32, 0]
+
+
+def test_final_magnetization(params):
+    dynamic, reference = enhancement(), enhancement()
+    list(iterate_frames(dynamic, load_sequence(params("GE_T1"))))
+    list(iterate_frames(reference, load_sequence(params("GE_T1")), incremental=False))
+    for frame, expected in zip(dynamic.frames, reference.frames):
+        np.testing.assert_allclose(frame.M, expected.M, atol=1e-9 * np.abs(expected.M).max())
@@ -0,0 +1,46 @@
+import copy
+
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator
+from EPG import EPGEngine
+
+
+def phantom(N:int=16):
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    return phantom
+
+
+# Both engines on copies of the same phantom: k spaces and final magnetizations
+def run(sequence:dict, max_states):
+    bloch, epg = phantom(), phantom()
+    k_bloch = Simulator(bloch, load_sequence(sequence)).run()
+    k_epg = EPGEngine(epg, load_sequence(sequence), max_states, t2_map="t2_star").run()
+    return k_bloch, k_epg, bloch.M, epg.M
+
+
+# With a single state the spoilers dephase the transverse magnetization out of the graph,
+# the ideal spoiling of the Bloch simulator
+@pytest.mark.parametrize("name", ["GE_T1", "GE_PD", "GE_T2", "SE", "SE_sinc"])
+def test_single_state_matches_bloch(name, params):
+    k_bloch, k_epg, M_bloch, M_epg = run(params(name), 1)
+    np.testing.assert_allclose(k_epg, k_bloch, atol=1e-9 * np.abs(k_bloch).max())
+    np.testing.assert_allclose(M_epg, M_bloch, atol=1e-9 * np.abs(M_bloch).max())
+
+
+# Without spoilers no higher order state is populated
+def test_balanced_sequence_matches_bloch(params):
+    k_bloch, k_epg, M_bloch, M_epg = run(params("Bssf"), 64)
+    np.testing.assert_allclose(k_epg, k_bloch, atol=1e-9 * np.abs(k_bloch).max())
+
+
+# Gradient spoiling keeps the stimulated echoes the ideal spoiler removes
+def test_stimulated_echoes(params):
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    k_bloch, k_epg, _, _ = run(sequence, 64)
+    assert np.abs(k_epg - k_bloch).max() > 1e-3 * np.abs(k_bloch).max()
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import Fingerprinting
+from Fingerprinting import build_dictionary, simulate_evolutions, simulate_phantom, match
+from MRISequence import load_sequence
+from Phantom import Phantom
+
+
+T1_VALUES = np.geomspace(100, 3000, 30)
+T2_VALUES = np.geomspace(10, 1000, 30)
+
+
+def mrf_train(params):
+    return load_sequence(params("MRF")).get_train()
+
+
+def test_no_shared_simulator():
+    assert not hasattr(Fingerprinting, "physics")
+
+
+def test_concurrent_dictionaries(params):
+    train = mrf_train(params)
+    reference = build_dictionary(train, T1_VALUES, T2_VALUES, chunk=64)
+    with ThreadPoolExecutor(4) as executor:
+        dictionaries = list(executor.map(lambda _: build_dictionary(train, T1_VALUES, T2_VALUES, chunk=64), range(4)))
+    for dictionary in dictionaries:
+        np.testing.assert_array_equal(dictionary.atoms, reference.atoms)
+        np.testing.assert_array_equal(dictionary.norms, reference.norms)
+
+
+# Signals simulated for entries of the grid are matched to those entries, at any amplitude
+def test_matching_recovers_grid_entries(params):
+    train = mrf_train(params)
+    dictionary = build_dictionary(train, T1_VALUES, T2_VALUES)
+    entries = np.random.default_rng(0).choice(len(dictionary), 16, replace=False)
+    PD = np.random.default_rng(1).uniform(0.5, 2, 16)
+
+    evolutions = simulate_evolutions(train, dictionary.t1[entries], dictionary.t2[entries], PD)
+    images = np.moveaxis(evolutions.reshape(4, 4, -1), -1, 0)
+    maps = match(dictionary, images)
+    np.testing.assert_array_equal(maps["T1"].ravel(), dictionary.t1[entries])
+    np.testing.assert_array_equal(maps["T2"].ravel(), dictionary.t2[entries])
+    np.testing.assert_allclose(maps["PD"].ravel(), PD, rtol=1e-3)
+    assert np.all(maps["correlation"] > 0.999)
+
+
+def test_empty_voxels_are_not_matched(params):
+    dictionary = build_dictionary(mrf_train(params), T1_VALUES, T2_VALUES)
+    images = np.zeros((dictionary.basis.shape[0], 2, 2), dtype=complex)
+    assert np.all(np.isnan(match(dictionary, images)["T1"]))
+
+
+# Bloch evolution of one voxel written out: rotation about x, relaxation, then off resonance precession
+def voxel_evolution(train, t1, t2, PD, B1=1.0, dB=0.0):
+    def pulse(M, angle):
+        theta = np.radians(angle * B1)
+        rotation = np.array([[1, 0, 0], [0, np.cos(theta), np.sin(theta)], [0, -np.sin(theta), np.cos(theta)]])
+        return rotation @ M
+
+    def relax(M, t):
+        Mxy = (M[0] + 1j * M[1]) * np.exp(-t / t2) * np.exp(-2j * np.pi * dB * t / 1000)
+        return np.array([Mxy.real, Mxy.imag, PD + (M[2] - PD) * np.exp(-t / t1)])
+
+    M = np.array([0, 0, PD], dtype=float)
+    if train["inversion"]:
+        M = relax(pulse(M, 180), train["TI"])
+    signal = []
+    for angle, TR in zip(train["flip_angles"], train["TR"]):
+        M = relax(pulse(M, angle), train["TE"])
+        signal.append(M[0] + 1j * M[1])
+        M = relax(M, TR - train["TE"])
+        if train["spoiled"]:
+            M[:2] = 0
+    return np.array(signal)
+
+
+def maps_phantom(t1, t2, PD, B1=None, dB=None):
+    shape = np.shape(t1)
+    array = np.stack([PD, t1, t2, t2, np.zeros(shape) if dB is None else dB, np.ones(shape) if B1 is None else B1], axis=-1)
+    phantom = Phantom()
+    phantom.set_numpy(array)
+    phantom.reset_M()
+    return phantom
+
+
+# The phantom goes through the Bloch simulator with its transmit & off resonance maps
+def test_phantom_simulation(params):
+    train = mrf_train(params)
+    train = dict(train, flip_angles=train["flip_angles"][:60], TR=train["TR"][:60])
+    rng = np.random.default_rng(2)
+    t1, t2 = rng.uniform(300, 2000, (3, 3)), rng.uniform(20, 200, (3, 3))
+    PD, B1, dB = rng.uniform(0.5, 1.5, (3, 3)), rng.uniform(0.8, 1.2, (3, 3)), rng.uniform(-30, 30, (3, 3))
+
+    images = simulate_phantom(maps_phantom(t1, t2, PD, B1, dB), train)
+    for x, y in np.ndindex(3, 3):
+        expected = voxel_evolution(train, t1[x, y], t2[x, y], PD[x, y], B1[x, y], dB[x, y])
+        np.testing.assert_allclose(images[:, x, y], expected, rtol=1e-9, atol=1e-12)
+
+
+# Tissues between the entries of the grid, with noise, match their neighbours on the grid
+def test_matching_off_grid_tissues(params):
+    train = mrf_train(params)
+    dictionary = build_dictionary(train, T1_VALUES, T2_VALUES)
+    rng = np.random.default_rng(3)
+    t1 = rng.uniform(300, 2500, (6, 6))
+    t2 = rng.uniform(20, 250, (6, 6))
+    PD = rng.uniform(0.5, 2, (6, 6))
+
+    images = simulate_phantom(maps_phantom(t1, t2, PD), train)
+    images = images + rng.normal(0, 1e-3 * np.abs(images).max(), images.shape)
+    maps = match(dictionary, images)
+
+    # Within two steps of the grid (the entries are compared in the compressed basis)
+    step_t1, step_t2 = T1_VALUES[1] / T1_VALUES[0], T2_VALUES[1] / T2_VALUES[0]
+    assert np.all(np.abs(np.log(maps["T1"] / t1)) <= 2 * np.log(step_t1))
+    assert np.all(np.abs(np.log(maps["T2"] / t2)) <= 2 * np.log(step_t2))
+    np.testing.assert_allclose(maps["PD"], PD, rtol=0.1)
+    assert np.all(maps["correlation"] > 0.99)
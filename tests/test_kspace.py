@@ -0,0 +1,71 @@
+import copy
+
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator, k_trajectory
+from Waveform import (X_AXIS, Y_AXIS, RF_OPERATION, READOUT_OPERATION, MULTI_GRADIENT_OPERATION,
+                      GRADIENT_OPERATION)
+
+
+N = 16
+
+
+# Positions of the bundled sequence read with another phase encoding table
+def positions(params, **multi):
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["PE"]["multi"][0].update(multi)
+    sequence = load_sequence(sequence)
+    lines = sequence.get_pe_order(N)
+    return lines, k_trajectory(sequence.get_waveform().operations, lines, N)
+
+
+@pytest.mark.parametrize("multi, scale", [({}, 1), ({"sign": False}, -1), ({"step": 2}, 2), ({"step": 0.5, "sign": False}, -0.5)])
+def test_lines_follow_the_moment(params, multi, scale):
+    lines, trajectory = positions(params, **multi)
+    assert trajectory == [(-N/2, scale * (line - N/2)) for line in lines]
+
+
+# Only one voxel with signal: the phase of every line is the phase encoding of its row
+def test_simulated_lines_are_phase_encoded(params):
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    image = np.zeros((N, N))
+    image[5, 11] = 255
+    phantom = Phantom()
+    phantom.setImage(image)
+    sequence = load_sequence(sequence)
+    Simulator(phantom, sequence).run() # Steady state from the first line on
+    k_space = Simulator(phantom, sequence).run()
+
+    x, y = np.arange(N) - N/2, np.arange(N) - N/2
+    expected = np.exp(-2j * np.pi * (np.outer(x, np.full(N, 5)) + np.outer(np.full(N, 11), y)) / N)
+    ratio = k_space / expected
+    np.testing.assert_allclose(ratio, ratio[0, 0], rtol=1e-9)
+
+
+# A refocusing pulse mirrors the position reached, its readout starts there when prephased
+def test_refocusing_mirrors_k():
+    operations = [(RF_OPERATION, 90), (MULTI_GRADIENT_OPERATION, (1, False, 0)), (GRADIENT_OPERATION, (X_AXIS, 1, False)),
+                  (RF_OPERATION, 180), (READOUT_OPERATION, (20, True))]
+    assert k_trajectory(operations, [3], N) == [(-N/2, -(3 - N/2))]
+    # Shaped pulses too, whatever the sign
+    operations[3] = (RF_OPERATION, (-180, "sinc", 64, 4, 2))
+    assert k_trajectory(operations, [3], N) == [(-N/2, -(3 - N/2))]
+
+
+# Any other pulse excites again from the k space center
+@pytest.mark.parametrize("angle", [90, 30, 120, 360])
+def test_excitation_resets_k(angle):
+    operations = [(MULTI_GRADIENT_OPERATION, (1, False, 0)), (GRADIENT_OPERATION, (Y_AXIS, 0.5, False)),
+                  (RF_OPERATION, angle), (READOUT_OPERATION, (20, False))]
+    assert k_trajectory(operations, [3], N) == [(-N/2, 0)]
+
+
+# Balanced moments are rewound after the readout, the next readout of the TR starts from there
+def test_balanced_moments_are_rewound():
+    operations = [(RF_OPERATION, 90), (MULTI_GRADIENT_OPERATION, (1, True, 0)), (READOUT_OPERATION, (20, False)),
+                  (MULTI_GRADIENT_OPERATION, (1, False, 1)), (READOUT_OPERATION, (20, True))]
+    assert k_trajectory(operations, [3, 12], N) == [(-N/2, 3 - N/2), (N/2, 12 - N/2)]
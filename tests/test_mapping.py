@@ -0,0 +1,64 @@
+import numpy as np
+from phantominator import shepp_logan
+
+from Phantom import Phantom
+from Mapping import fit_t1, fit_t2, fit_t1_vfa, signal_mask, simulate_series, compare_to_phantom
+
+
+N = 8
+
+
+# Relaxation times & amplitudes of every voxel
+def truth():
+    rng = np.random.default_rng(0)
+    return rng.uniform(200, 2000, (N, N)), rng.uniform(10, 200, (N, N)), rng.uniform(0.5, 1.5, (N, N))
+
+
+def test_t2_fit_is_exact():
+    _, t2, S0 = truth()
+    TE = np.array([5, 15, 30, 60, 120])
+    images = S0 * np.exp(-TE[:, None, None] / t2)
+    maps = fit_t2(images, TE, np.ones((N, N), dtype=bool))
+    np.testing.assert_allclose(maps["T2"], t2, rtol=1e-6)
+    np.testing.assert_allclose(maps["S0"], S0, rtol=1e-6)
+
+
+def test_t1_fit_is_exact():
+    t1, _, PD = truth()
+    TR = np.array([100, 300, 800, 1500, 3000, 6000])
+    images = PD * (1 - np.exp(-TR[:, None, None] / t1))
+    maps = fit_t1(images, TR, np.ones((N, N), dtype=bool))
+    np.testing.assert_allclose(maps["T1"], t1, rtol=1e-6)
+    np.testing.assert_allclose(maps["PD"], PD, rtol=1e-6)
+
+
+def test_vfa_fit_is_exact():
+    t1, _, PD = truth()
+    TR, angles = 15, np.array([3, 8, 15, 25])
+    E1 = np.exp(-TR / t1)
+    alpha = np.radians(angles)[:, None, None]
+    images = PD * np.sin(alpha) * (1 - E1) / (1 - E1 * np.cos(alpha))
+    maps = fit_t1_vfa(images, angles, TR, np.ones((N, N), dtype=bool))
+    np.testing.assert_allclose(maps["T1"], t1, rtol=1e-6)
+    np.testing.assert_allclose(maps["PD"], PD, rtol=1e-6)
+
+
+def test_dark_voxels_are_not_fitted():
+    images = np.ones((3, N, N))
+    images[:, 0, 0] = 0
+    mask = signal_mask(images)
+    assert not mask[0, 0] and mask.sum() == N * N - 1
+    assert np.isnan(fit_t2(images * [[[1]], [[0.5]], [[0.25]]], [10, 20, 30])["T2"][0, 0])
+
+
+# Echo time series of the Bloch simulator: the fitted decay is the T2* of the phantom (exact
+# away from the edges blurred by the first, fully relaxed, line)
+def test_simulated_t2_star_series(params):
+    phantom = Phantom()
+    phantom.setImage(shepp_logan(16))
+    TE = [20, 30, 45, 70]
+    images = simulate_series(phantom, params("GE_T1"), "TE", TE)
+    errors = compare_to_phantom(fit_t2(images, TE), phantom, t2_map="t2_star")["T2"]
+    assert errors["voxels"] > 50
+    assert errors["median_relative_error"] < 1e-6
+    assert errors["correlation"] > 0.98
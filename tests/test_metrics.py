@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator
+from Metrics import REGISTRY, MetricsRegistry, format_labels, label_key, watch_cache
+
+
+@pytest.fixture
+def metrics():
+    REGISTRY.enabled = True
+    yield REGISTRY
+    REGISTRY.enabled = False
+
+
+def phantom(N:int=8):
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    return phantom
+
+
+# Samples {"name{labels}": value} of a rendered registry
+def parse(text:str):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def run_gauges(registry):
+    return [line for line in registry.render().splitlines() if line.startswith("mri_run_")]
+
+
+def test_text_format():
+    registry = MetricsRegistry()
+    registry.counter("lines_total", "Lines").inc(3, engine="Simulator")
+    registry.gauge("ratio", "Ratio").set(0.25, name='a"b\\c')
+    registry.gauge("empty", "Never set")
+
+    lines = registry.render().splitlines()
+    assert lines == ["# HELP mri_lines_total Lines",
+                     "# TYPE mri_lines_total counter",
+                     'mri_lines_total{engine="Simulator"} 3',
+                     "# HELP mri_ratio Ratio",
+                     "# TYPE mri_ratio gauge",
+                     'mri_ratio{name="a\\"b\\\\c"} 0.25']
+
+
+def test_labels_are_sorted():
+    assert format_labels(label_key({"b": 1, "a": "x"})) == '{a="x",b="1"}'
+
+
+def test_cache_watch():
+    class Cache(list):
+        hits, misses = 3, 1
+
+    registry = MetricsRegistry()
+    cache = Cache([1, 2])
+    watch_cache("results", cache, registry)
+    samples = parse(registry.render())
+    assert samples['mri_cache_hit_ratio{cache="results"}'] == 0.75
+    assert samples['mri_cache_entries{cache="results"}'] == 2
+
+    del cache
+    assert registry.render() == "\n"
+
+
+def test_completed_run(metrics, params):
+    before = parse(metrics.render())
+    Simulator(phantom(), load_sequence(params("SE"))).run()
+    after = parse(metrics.render())
+
+    key = 'mri_lines_total{engine="Simulator"}'
+    assert after[key] - before.get(key, 0) == 8
+    assert after['mri_active_runs{engine="Simulator"}'] == 0
+    assert run_gauges(metrics) == []
+
+
+# Cancelled & failed runs release their gauges
+def test_interrupted_runs(metrics, params, monkeypatch):
+    simulator = Simulator(phantom(), load_sequence(params("SE")))
+    simulator.run(stats=lambda _: simulator.pause())
+
+    simulator = Simulator(phantom(), load_sequence(params("SE")))
+    def failing():
+        raise MemoryError()
+    monkeypatch.setattr(simulator, "final_state", failing)
+    with pytest.raises(MemoryError):
+        simulator.run()
+
+    samples = parse(metrics.render())
+    assert samples['mri_active_runs{engine="Simulator"}'] == 0
+    assert samples['mri_runs_total{engine="Simulator",outcome="cancelled"}'] >= 1
+    assert samples['mri_runs_total{engine="Simulator",outcome="failed"}'] >= 1
+    assert run_gauges(metrics) == []
@@ -0,0 +1,76 @@
+import copy
+
+import numpy as np
+import pytest
+from phantominator import shepp_logan
+
+from MRISequence import load_sequence
+from Noise import add_noise, bandwidth_sigma, monte_carlo, readout_bandwidth, signal_level, snr_sigma
+
+
+N = 32
+
+
+def k_space():
+    return np.fft.fft2(shepp_logan(N) * 100)
+
+
+# Complex noise of standard deviation sigma on both channels, independent & zero mean
+def test_noise_statistics():
+    noise = add_noise(np.zeros((N, N)), 3.0, realizations=200, rng=0)
+    assert noise.shape == (200, N, N)
+    assert abs(noise.real.std() - 3) < 0.03 and abs(noise.imag.std() - 3) < 0.03
+    assert abs(noise.real.mean()) < 0.03 and abs(noise.imag.mean()) < 0.03
+    assert abs(np.corrcoef(noise.real.ravel(), noise.imag.ravel())[0, 1]) < 0.01
+
+    # Added to the signal, the same generator draws the same noise
+    signal = k_space()
+    np.testing.assert_allclose(add_noise(signal, 3.0, rng=1) - signal, add_noise(np.zeros((N, N)), 3.0, rng=1))
+
+
+# The image noise (per channel) is the object level over the SNR
+@pytest.mark.parametrize("snr", [5, 20, 80])
+def test_snr_calibration(snr):
+    signal = k_space()
+    sigma = snr_sigma(signal, snr)
+    noise = np.fft.ifft2(add_noise(np.zeros((N, N)), sigma, realizations=50, rng=0), axes=(-2, -1))
+    level = signal_level(signal)
+    assert abs(noise.real.std() - level / snr) < 0.02 * level / snr
+    assert abs(noise.imag.std() - level / snr) < 0.02 * level / snr
+
+
+# Bright voxels of the magnitude images reach the requested SNR, pure noise is Rayleigh distributed
+def test_monte_carlo():
+    signal = k_space()
+    statistics = monte_carlo(signal, snr_sigma(signal, 50), 400, chunk=64, rng=0)
+    image = np.abs(np.fft.ifft2(signal))
+    bright = image > 0.9 * image.max()
+    measured = statistics["mean"][bright] / statistics["std"][bright]
+    expected = image[bright] / (signal_level(signal) / 50)
+    assert np.median(np.abs(measured / expected - 1)) < 0.1
+
+    sigma = 2.0
+    noise = monte_carlo(np.zeros((N, N)), sigma, 400, rng=0)
+    assert abs(noise["mean"].mean() - sigma / N * np.sqrt(np.pi / 2)) < 0.01 * sigma / N
+
+
+# Receiver bandwidth of N samples over the readout, noise growing with its square root
+def test_bandwidth_calibration(params):
+    sequence = copy.deepcopy(params("GE_T1"))
+    duration = sequence["component"]["readout"]["signals"][0]["duration"]
+    assert readout_bandwidth(load_sequence(sequence), N) == N / (duration / 1000)
+    assert bandwidth_sigma(load_sequence(sequence), N, density=2) == pytest.approx(2 * np.sqrt(N / (duration / 1000)))
+
+    # Twice as long, half the bandwidth
+    short = bandwidth_sigma(load_sequence(sequence), N)
+    sequence["component"]["readout"]["signals"][0]["duration"] = 2 * duration
+    assert bandwidth_sigma(load_sequence(sequence), N) == pytest.approx(short / np.sqrt(2))
+
+
+def test_invalid_calibrations(params):
+    with pytest.raises(ValueError):
+        snr_sigma(k_space(), 0)
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["readout"]["signals"][0]["duration"] = 0
+    with pytest.raises(ValueError):
+        readout_bandwidth(load_sequence(sequence), N)
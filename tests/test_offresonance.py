@@ -0,0 +1,63 @@
+import copy
+
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator
+from Analytic import analyze
+from Waveform import READOUT_OPERATION
+
+
+N = 16
+FREQUENCY = 25 # Hz
+
+
+# One voxel with signal, off resonant by 'frequency'
+def voxel(frequency:float):
+    image = np.zeros((N, N))
+    image[5, 11] = 255
+    phantom = Phantom()
+    phantom.setImage(image)
+    phantom.dB = np.full((N, N), float(frequency))
+    return phantom
+
+
+def spoiled(params, name:str):
+    sequence = copy.deepcopy(params(name))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    return load_sequence(sequence)
+
+
+# 25 Hz for 10 ms: a quarter turn clockwise, the magnitude is kept
+@pytest.mark.parametrize("t, turns", [(10, 0.25), (20, 0.5), (40, 1), (3, 0.075)])
+def test_phase_after_duration(params, t, turns):
+    simulator = Simulator(voxel(FREQUENCY), load_sequence(params("GE_T1")))
+    M = np.zeros((N, N, 3))
+    M[..., 1] = 1
+    precessed = simulator.precession(M, t)
+    Mxy = precessed[..., 0] + 1j * precessed[..., 1]
+    np.testing.assert_allclose(Mxy, 1j * np.exp(-2j * np.pi * turns))
+    np.testing.assert_allclose(precessed[..., 2], 0)
+
+
+# Gradient echo: the phase accrued from the excitation to every readout sample
+def test_gradient_echo_phase(params):
+    sequence = spoiled(params, "GE_T1")
+    on, off = voxel(FREQUENCY), voxel(0)
+    k_on, k_off = Simulator(on, sequence).run(), Simulator(off, sequence).run()
+
+    TE = analyze(sequence)[1]["TE"]
+    duration = next(value[0] for name, value in sequence.get_waveform().operations if name == READOUT_OPERATION)
+    t = TE + np.arange(N) * duration / N
+    expected = np.exp(-2j * np.pi * FREQUENCY * t / 1000)
+    np.testing.assert_allclose(k_on / k_off, np.repeat(expected[:, None], N, axis=1), rtol=1e-9)
+
+
+# Spin echo: the refocusing pulse cancels the phase at the echo, the samples after it keep precessing
+def test_spin_echo_refocuses(params):
+    sequence = spoiled(params, "SE")
+    k_on, k_off = Simulator(voxel(FREQUENCY), sequence).run(), Simulator(voxel(0), sequence).run()
+    np.testing.assert_allclose(k_on[0], k_off[0], rtol=1e-9)
+    assert not np.allclose(k_on[1:], k_off[1:])
@@ -0,0 +1,81 @@
+import copy
+
+import numpy as np
+import pytest
+from phantominator import shepp_logan
+
+from Phantom import Phantom
+from MRISequence import PE_ORDERS, load_sequence, order_lines
+from Simulator import Simulator, ConvergenceMonitor, reconstruct
+
+
+N = 64
+
+
+# Shepp-Logan at the steady state of the spoiled gradient echo (every line has the same weighting)
+def phantom(sequence):
+    phantom = Phantom()
+    phantom.setImage(shepp_logan(N) * 255)
+    Simulator(phantom, sequence).run()
+    return phantom
+
+
+def spoiled(params):
+    sequence = copy.deepcopy(params("GE_T1"))
+    sequence["component"]["spoiler"] = [{"time": "TE + 30", "duration": 5}]
+    return load_sequence(sequence)
+
+
+@pytest.mark.parametrize("ordering", PE_ORDERS)
+def test_orders_permute_the_lines(ordering):
+    lines = order_lines(range(N), N, ordering, seed=3)
+    assert sorted(lines) == list(range(N))
+    if ordering != "sequential":
+        assert lines != list(range(N))
+
+
+def test_order_definitions():
+    assert order_lines(range(8), 8, "centric") == [4, 3, 5, 2, 6, 1, 7, 0]
+    assert order_lines(range(8), 8, "reverse_centric") == [0, 7, 1, 6, 2, 5, 3, 4]
+    assert order_lines(range(8), 8, "interleaved") == [0, 2, 4, 6, 1, 3, 5, 7]
+    assert order_lines(range(8), 8, "random", seed=1) == order_lines(range(8), 8, "random", seed=1)
+    assert order_lines(range(8), 8, "random", seed=1) != order_lines(range(8), 8, "random", seed=2)
+
+
+# The simulator reads the lines in the order of the sequence, the k space does not depend on it at steady state
+@pytest.mark.parametrize("ordering", PE_ORDERS)
+def test_simulated_order(params, ordering):
+    sequence = spoiled(params)
+    sequential = Simulator(phantom(sequence), sequence).run()
+    sequence.set_ordering(ordering, seed=3)
+    read = []
+    k_space = Simulator(phantom(sequence), sequence).run(line_update=read.append)
+    assert read == sequence.get_pe_order(N)
+    np.testing.assert_allclose(k_space, sequential, rtol=1e-9, atol=1e-9 * np.abs(sequential).max())
+
+
+# Centric runs stop once the outer lines barely add energy, close to the full image
+def test_monitor_stops_centric_runs(params):
+    sequence = spoiled(params)
+    full = reconstruct(Simulator(phantom(sequence), sequence).run())
+    sequence.set_ordering("centric")
+    simulator, monitor = Simulator(phantom(sequence), sequence), ConvergenceMonitor()
+    image = reconstruct(simulator.run(monitor=monitor))
+
+    assert simulator.converged
+    lines = np.count_nonzero(np.abs(simulator.k_space).sum(axis=0))
+    assert monitor.minimum * N <= lines < 0.75 * N
+    assert monitor.changes[-1] < monitor.tolerance
+    assert np.sum((image - full)**2) < 0.1 * np.sum(full**2)
+
+
+# Orders that leave gaps or read the center last run to the end, as runs that never get under the tolerance
+@pytest.mark.parametrize("ordering, tolerance", [("interleaved", 0.01), ("random", 0.01), ("reverse_centric", 0.01),
+                                                 ("centric", 1e-4)])
+def test_monitor_runs_to_the_end(params, ordering, tolerance):
+    sequence = spoiled(params)
+    sequence.set_ordering(ordering, seed=3)
+    simulator = Simulator(phantom(sequence), sequence)
+    simulator.run(monitor=ConvergenceMonitor(tolerance))
+    assert not simulator.converged
+    assert np.all(np.abs(simulator.k_space).sum(axis=0) > 0)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator, simulate
+from MemoryPlanner import MIN_CHUNK_ROWS, estimate_memory, plan_memory
+
+
+N = 512
+WHOLE = estimate_memory(N)
+SMALLEST = estimate_memory(N, chunk_rows=MIN_CHUNK_ROWS)
+
+
+def test_whole_tables_when_they_fit():
+    plan = plan_memory(N, WHOLE)
+    assert plan.fits and not plan.degraded
+    assert plan.chunk_rows is None
+    assert plan.peak == WHOLE
+
+
+# The largest power of two chunk under the budget
+@pytest.mark.parametrize("budget", np.linspace(SMALLEST, WHOLE - 1, 9).astype(int).tolist())
+def test_largest_chunk_under_the_budget(budget):
+    plan = plan_memory(N, budget)
+    assert plan.fits and plan.degraded
+    assert plan.chunk_rows & (plan.chunk_rows - 1) == 0
+    assert MIN_CHUNK_ROWS <= plan.chunk_rows <= N
+    assert estimate_memory(N, chunk_rows=plan.chunk_rows) <= budget
+    if plan.chunk_rows < N:
+        assert estimate_memory(N, chunk_rows=2 * plan.chunk_rows) > budget
+    assert plan.peak <= budget
+
+
+# Chunks stop at MIN_CHUNK_ROWS, the snapshots get what is left and more workers are dropped
+def test_snapshots_and_workers_fit_the_rest():
+    plan = plan_memory(N, SMALLEST + 1000, workers=4, snapshot_bytes=10**9)
+    assert plan.fits
+    assert (plan.chunk_rows, plan.workers, plan.snapshot_bytes) == (MIN_CHUNK_ROWS, 1, 1000)
+    assert not plan_memory(N, SMALLEST - 1).fits
+
+
+# Chunked encoding tables read the same k space
+def test_chunked_run_matches(params):
+    N = 2 * MIN_CHUNK_ROWS
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    sequence = load_sequence(params("GE_T1"))
+    budget = estimate_memory(N, chunk_rows=MIN_CHUNK_ROWS)
+    assert plan_memory(N, budget).chunk_rows == MIN_CHUNK_ROWS
+
+    chunked, _ = simulate(phantom.copy(), sequence, memory_budget=budget)
+    np.testing.assert_allclose(chunked, Simulator(phantom.copy(), sequence).run(), rtol=1e-9, atol=1e-9)
+    with pytest.raises(MemoryError):
+        simulate(phantom.copy(), sequence, memory_budget=budget - 1)
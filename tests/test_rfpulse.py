@@ -0,0 +1,49 @@
+import copy
+
+import numpy as np
+import pytest
+
+from MRISequence import load_sequence
+from RFPulse import pulse_waveform, pulse_rotations
+from Server import JobServer, check_pulse_shapes
+
+
+@pytest.mark.parametrize("shape", ["sinc", "gaussian", [0.2, 1, 0.2]])
+def test_on_resonance_flip_angle(shape):
+    rotation = pulse_rotations(90, pulse_waveform(shape), 4, np.zeros(1))[0]
+    np.testing.assert_allclose(rotation @ [0, 0, 1], [0, 1, 0], atol=1e-9)
+
+
+@pytest.mark.parametrize("samples", [[1, -1], [0.5, -1, 0.5], [0, 0], [1, np.nan]])
+def test_unscalable_waveforms(samples):
+    with pytest.raises(ValueError):
+        pulse_waveform(samples)
+
+
+def test_zero_area_rotation():
+    with pytest.raises(ValueError):
+        pulse_rotations(90, np.array([1.0, -1.0]), 4, np.zeros(1))
+
+
+def shaped(params, shape):
+    sequence = copy.deepcopy(params("SE"))
+    sequence["component"]["RF"][0].update({"shape": shape, "samples": 32})
+    return sequence
+
+
+# Server side files are never read from a job payload
+def test_server_refuses_pulse_files(params, tmp_path):
+    path = tmp_path / "pulse.npy"
+    np.save(path, np.ones(8))
+    with pytest.raises(ValueError):
+        JobServer().submit({"sequence": shaped(params, str(path)), "phantom": {"kind": "constant", "size": 8}})
+
+
+def test_server_refuses_zero_area_samples(params):
+    with pytest.raises(ValueError):
+        JobServer().submit({"sequence": shaped(params, [1, -1, 1, -1]), "phantom": {"kind": "constant", "size": 8}})
+
+
+@pytest.mark.parametrize("shape", ["sinc", [0.5, 1, 0.5]])
+def test_server_accepts_inline_shapes(params, shape):
+    check_pulse_shapes(load_sequence(shaped(params, shape)))
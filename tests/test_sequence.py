@@ -0,0 +1,80 @@
+import copy
+import os
+
+import pytest
+
+from MRISequence import evaluate_time, load_sequence
+from Server import JobServer
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("10", 10),
+    ("2.5", 2.5),
+    ("TE", 20),
+    ("TE/2", 10),
+    ("TR - TE", 480),
+    ("-(TE + 2) * 2", -44),
+])
+def test_time_expressions(expression, expected):
+    assert evaluate_time(expression, 20, 500) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('true')",
+    "open('/etc/passwd')",
+    "TE.__class__",
+    "[TE]",
+    "TE ** 2",
+    "TE // 2",
+    "True",
+    "'TE'",
+    "X",
+    "TE / 0",
+    "TE +",
+])
+def test_time_expressions_rejected(expression):
+    with pytest.raises(ValueError):
+        evaluate_time(expression, 20, 500)
+
+
+def test_unset_interval_rejected():
+    with pytest.raises(ValueError):
+        evaluate_time("TE/2", None, 500)
+
+
+# A sequence payload with code in a time is refused before anything runs
+def test_submit_rejects_code(params, tmp_path):
+    marker = tmp_path / "pwned"
+    sequence = copy.deepcopy(params("SE"))
+    sequence["component"]["RF"][0]["time"] = f"__import__('os').system('touch {marker}')"
+
+    with pytest.raises(ValueError):
+        JobServer().submit({"sequence": sequence, "phantom": {"kind": "constant", "size": 8}})
+    assert not os.path.exists(marker)
+
+
+def test_bundled_sequences_load(params):
+    for name in ("SE", "GE_T1", "Bssf"):
+        sequence = load_sequence(params(name))
+        assert sequence.get_components()
+
+
+def test_waveform_is_reused(params):
+    sequence = load_sequence(params("SE"))
+    assert sequence.get_waveform() is sequence.get_waveform()
+
+
+# Components edited in place (sequence editors) recompile the waveform
+def test_waveform_follows_edits(params):
+    sequence = load_sequence(params("SE"))
+    waveform = sequence.get_waveform()
+    pulse = next(component for component in sequence.get_components() if type(component).__name__ == "RFComponent")
+
+    pulse.angle = 45
+    edited = sequence.get_waveform()
+    assert edited is not waveform
+    assert ("RF", 45) in edited.operations
+    assert edited.rf[0] == waveform.rf[0] / 2
+
+    sequence.set_TR(300)
+    assert sequence.get_waveform().TR == 300
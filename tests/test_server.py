@@ -0,0 +1,120 @@
+import asyncio
+import gc
+import time
+
+import pytest
+
+from Metrics import REGISTRY
+from Server import JobServer, SimulationClient, DONE
+
+
+PHANTOM = {"kind": "shepp_logan", "size": 8}
+
+
+# Run a blocking client against a server started on a free port
+def serve(server:JobServer, client_calls):
+    async def main():
+        await server.start(port=0)
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, client_calls, SimulationClient(port=port, timeout=30))
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_fetched_results_are_released(params):
+    server = JobServer()
+
+    def calls(client):
+        job = client.submit(params("GE_T1"), PHANTOM)
+        client.wait(job)
+        client.result(job)
+        return job
+
+    job = serve(server, calls)
+    assert job not in server.jobs
+
+
+def test_arrays_are_released_one_by_one(params):
+    server = JobServer()
+
+    def calls(client):
+        job = client.submit(params("GE_T1"), PHANTOM)
+        client.wait(job)
+        client.request("GET", f"/jobs/{job}/result?array=image")
+        with pytest.raises(RuntimeError, match="already fetched"):
+            client.request("GET", f"/jobs/{job}/result?array=image")
+        kept = job in server.jobs
+        client.request("GET", f"/jobs/{job}/result?array=k_space")
+        return job, kept
+
+    job, kept = serve(server, calls)
+    assert kept and job not in server.jobs
+
+
+def test_finished_jobs_are_limited(params):
+    server = JobServer(max_finished=2)
+
+    def calls(client):
+        jobs = [client.submit(params("GE_T1"), PHANTOM) for _ in range(4)]
+        client.wait(jobs[-1]) # One worker, the jobs end in order
+        # Listing the jobs forgets the oldest finished ones
+        return jobs, [status["id"] for status in client.list()]
+
+    jobs, listed = serve(server, calls)
+    assert listed == jobs[-2:]
+
+
+def test_finished_jobs_expire(params):
+    server = JobServer(job_ttl=60)
+
+    def calls(client):
+        job = client.submit(params("GE_T1"), PHANTOM)
+        return job, client.wait(job)["state"]
+
+    (job, state) = serve(server, calls)
+    assert state == DONE
+    server.forget_finished()
+    assert job in server.jobs
+    server.jobs[job].ended = time.time() - 61
+    server.forget_finished()
+    assert job not in server.jobs
+
+
+def test_metrics_collector_does_not_keep_the_server():
+    gc.collect()
+    REGISTRY.render()
+    collectors = len(REGISTRY.collectors)
+    server = JobServer()
+    assert len(REGISTRY.collectors) == collectors + 1
+    del server
+    gc.collect()
+    REGISTRY.render()
+    assert len(REGISTRY.collectors) == collectors
+
+
+# An error after the response head closes the connection instead of writing a second status line
+def test_errors_after_the_head_drop_the_connection():
+    class Failing(JobServer):
+        async def route(self, writer, method, parts, query, body):
+            self.respond_head(writer, 200, "application/x-ndjson")
+            await writer.drain()
+            raise RuntimeError("stream failed")
+
+    async def main():
+        server = Failing()
+        await server.start(port=0)
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /jobs/1/events HTTP/1.1\r\n\r\n")
+            data = await reader.read()
+            writer.close()
+            return data
+        finally:
+            await server.stop()
+
+    data = asyncio.run(main())
+    assert data.startswith(b"HTTP/1.1 200")
+    assert b"400" not in data
@@ -0,0 +1,70 @@
+import copy
+
+import numpy as np
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import Simulator, SnapshotStore, SNAPSHOT_SHARE
+
+
+N = 16
+
+
+def phantom():
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    phantom.dB = np.random.default_rng(1).uniform(-20, 20, (N, N))
+    return phantom
+
+
+# Run the edited sequence after the original one with a shared store, and without a store
+def edited_run(params, edit, store=None):
+    store = SnapshotStore() if store is None else store
+    Simulator(phantom(), load_sequence(params("SE")), store).run()
+    hits = store.hits
+
+    edited = copy.deepcopy(params("SE"))
+    edit(edited)
+    simulator = Simulator(phantom(), load_sequence(edited), store)
+    k_space = simulator.run()
+    reference = Simulator(phantom(), load_sequence(edited))
+    fresh = reference.run()
+    return k_space, fresh, store.hits - hits, simulator
+
+
+def flip_phase_encoding(params):
+    params["component"]["PE"]["multi"][0]["sign"] = False
+
+
+def edit_last_angle(params):
+    params["component"]["RF"][-1]["flipAngle"] = 170
+
+
+# Edits leaving the magnetization chain unchanged only encode again: every readout state is shared
+def test_unchanged_chain_is_shared(params):
+    k_space, fresh, hits, simulator = edited_run(params, flip_phase_encoding)
+    np.testing.assert_allclose(k_space, fresh)
+    assert hits >= N
+    assert "RF" not in simulator.operation_seconds # No pulse applied again
+
+
+# An edited angle changes every TR after it: only the boundaries of the first TR before it are shared
+def test_edited_chain_shares_its_prefix(params):
+    k_space, fresh, hits, _ = edited_run(params, edit_last_angle)
+    np.testing.assert_allclose(k_space, fresh)
+    assert hits == 2 # After the excitation and the relaxation before the edited pulse
+
+
+# A small store keeps every stride-th readout state instead of churning through all of them
+def test_readout_states_fit_the_store(params):
+    state_bytes = N * N * 3 * 8
+    store = SnapshotStore(max_bytes=8 * state_bytes)
+    simulator = Simulator(phantom(), load_sequence(params("SE")), store)
+    stride = simulator.snapshot_stride(N)
+    assert (N + 1) / stride <= SNAPSHOT_SHARE * 8
+    simulator.run()
+    assert len(store) <= 8
+
+    k_space, fresh, hits, _ = edited_run(params, flip_phase_encoding, store)
+    np.testing.assert_allclose(k_space, fresh)
+    assert hits > 0
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from Phantom import Phantom
+from MRISequence import load_sequence
+from Simulator import simulate, simulate_iter
+from Coils import coil_sensitivities
+
+
+N = 16
+
+
+def phantom():
+    phantom = Phantom()
+    phantom.setImage(np.random.default_rng(0).uniform(50, 250, (N, N)))
+    phantom.dB = np.random.default_rng(1).uniform(-20, 20, (N, N))
+    return phantom
+
+
+# Lines streamed in acquisition order, C x N samples with coils
+def streamed(sequence, **options):
+    streamed_phantom = phantom()
+    lines = list(simulate_iter(streamed_phantom, sequence, **options))
+    shape = (N, N) if options.get("coils") is None else (len(options["coils"]), N, N)
+    k_space = np.zeros(shape, dtype=complex)
+    for pe_index, k_line in lines:
+        k_space[..., pe_index] = k_line
+    return [pe_index for pe_index, _ in lines], k_space, streamed_phantom.M
+
+
+@pytest.mark.parametrize("name", ["SE", "GE_T1", "Bssf"])
+def test_stream_matches_simulate(params, name):
+    sequence = load_sequence(params(name))
+    order, k_space, M = streamed(sequence)
+    assert order == sequence.get_pe_order(N)
+
+    reference = phantom()
+    expected, _ = simulate(reference, sequence)
+    np.testing.assert_allclose(k_space, expected)
+    np.testing.assert_allclose(M, reference.M)
+
+
+def test_stream_with_coils_and_lines(params):
+    sequence = load_sequence(params("SE"))
+    coils = coil_sensitivities(N, 4)
+    lines = list(range(0, N, 3))
+    order, k_space, M = streamed(sequence, coils=coils, lines=lines)
+    assert order == lines
+
+    reference = phantom()
+    expected, _ = simulate(reference, sequence, coils=coils, lines=lines)
+    np.testing.assert_allclose(k_space, expected)
+    np.testing.assert_allclose(M, reference.M)
+
+
+def test_stream_checks_the_memory_budget(params):
+    with pytest.raises(MemoryError):
+        simulate_iter(phantom(), load_sequence(params("SE")), memory_budget=1024)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import read_image, read_numpy
+
+
+def save(tmp_path, array:np.ndarray):
+    path = str(tmp_path / "phantom.png")
+    Image.fromarray(array.astype(np.uint8)).save(path)
+    return path
+
+
+@pytest.mark.parametrize("shape", [(40, 100), (100, 40)])
+def test_non_square_images_are_padded(tmp_path, shape):
+    array = np.full(shape, 200)
+    image = read_image(save(tmp_path, array))
+    assert image.shape == (100, 100)
+    # Nothing is cropped, the padding is background
+    assert image.sum() == array.sum()
+    assert image[0, 0] == 0 and image[50, 50] == 200
+
+
+def test_non_square_images_are_resized(tmp_path):
+    array = np.full((300, 1200), 200)
+    image = read_image(save(tmp_path, array), 64)
+    assert image.shape == (64, 64)
+    # The full width is kept, centered between background rows
+    np.testing.assert_allclose(image[32], 200)
+    assert np.all(image[:20] == 0) and np.all(image[-20:] == 0)
+
+
+def test_thin_images(tmp_path):
+    image = read_image(save(tmp_path, np.full((4000, 3), 200)), 64)
+    assert image.shape == (64, 64)
+    assert image.max() > 0
+
+
+# Two tissues side by side, a smooth off resonance and a uniform B1+
+def maps(N:int):
+    array = np.zeros((N, N, 6))
+    left = np.arange(N) < N // 2 + 1
+    array[:, :, 0] = np.where(left, 100, 200)
+    array[:, :, 1:4] = np.where(left[:, None], [[500, 50, 40]], [[1500, 150, 90]])[None]
+    array[:, :, 4] = np.linspace(-10, 10, N)[None]
+    array[:, :, 5] = 0.9
+    return array
+
+
+def test_numpy_phantoms_keep_their_size(tmp_path):
+    path = str(tmp_path / "phantom.npy")
+    np.save(path, maps(50))
+    np.testing.assert_array_equal(read_numpy(path), maps(50))
+
+
+# Relaxation times of existing tissues only, the other maps averaged
+@pytest.mark.parametrize("size", [16, 100])
+def test_relaxation_maps_are_not_averaged(tmp_path, size):
+    path = str(tmp_path / "phantom.npy")
+    np.save(path, maps(50))
+    array = read_numpy(path, size)
+    assert array.shape == (size, size, 6)
+
+    tissues = {tuple(tissue) for tissue in array[:, :, 1:4].reshape(-1, 3)}
+    assert tissues == {(500, 50, 40), (1500, 150, 90)}
+    # Each voxel takes all its relaxation times from one source voxel, the PD of the boundary is mixed
+    assert np.all((array[:, :, 1] == 500) == (array[:, :, 2] == 50))
+    if size < 50:
+        assert np.any((array[:, :, 0] > 100) & (array[:, :, 0] < 200))
+    np.testing.assert_allclose(array[:, :, 4].mean(), 0, atol=1e-9)
+    np.testing.assert_allclose(array[:, :, 5], 0.9)
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+
+from PhantomViewer import PhantomViewer
+from Viewer import viewer
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def phantom_viewer(app):
+    canvas = PhantomViewer()
+    canvas.setConstant(8, 100)
+    return canvas
+
+
+def test_records_follow_in_place_edits(phantom_viewer):
+    phantom = phantom_viewer.phantom
+    assert phantom_viewer.voxelRecords()["t1"][2, 3] == phantom.t1[2, 3]
+    phantom.t1[2, 3] = 1234
+    phantom.changed()
+    assert phantom_viewer.voxelRecords()["t1"][2, 3] == 1234
+
+
+def test_records_follow_setters(phantom_viewer):
+    phantom = phantom_viewer.phantom
+    phantom_viewer.voxelRecords()
+    B1 = np.full((8, 8), 0.5)
+    phantom.set_B1(B1)
+    np.testing.assert_allclose(phantom_viewer.voxelRecords()["B1"], 0.5)
+    # The same array edited in place and set again
+    B1[0, 0] = 2
+    phantom.set_B1(B1)
+    assert phantom_viewer.voxelRecords()["B1"][0, 0] == 2
+
+
+def test_records_follow_replaced_magnetization(phantom_viewer):
+    phantom = phantom_viewer.phantom
+    phantom_viewer.voxelRecords()
+    phantom.M = np.ones_like(phantom.M)
+    np.testing.assert_allclose(phantom_viewer.voxelRecords()["M"], 1)
+
+
+def test_base_viewer_hover_without_annotation(app):
+    canvas = viewer()
+    canvas.drawData(np.zeros((8, 8)))
+    canvas.hover_position = (2, 3)
+    canvas.flushHover()
+
+
+def test_live_updates_reuse_the_pyramid(app):
+    canvas = viewer()
+    image = np.zeros((16, 16))
+    canvas.drawData2(image)
+    pyramid = canvas.pyramid
+    pyramid.level(2)
+    image[:, 3] = 5
+    canvas.drawData2(image, regions=[np.s_[:, 3]])
+    assert canvas.pyramid is pyramid
+    # The coarser levels are rebuilt from the edited base when drawn
+    assert len(pyramid.levels) == 1
+    assert pyramid.level(1)[0, 1] == 2.5
+    assert (pyramid.vmin, pyramid.vmax) == (0, 5)
+
+
+def test_updated_regions_widen_the_limits(app):
+    canvas = viewer()
+    image = np.ones((8, 8))
+    canvas.drawData2(image)
+    image[2] = -3
+    canvas.updateData(image, region=np.s_[2])
+    image[:, 5] = 7
+    canvas.updateData(image, region=np.s_[:, 5])
+    canvas.flushData()
+    assert (canvas.pyramid.vmin, canvas.pyramid.vmax) == (-3, 7)
+    # A new array is rescanned
+    canvas.updateData(np.full((8, 8), 2.0), region=np.s_[0])
+    canvas.flushData()
+    assert (canvas.pyramid.vmin, canvas.pyramid.vmax) == (2, 2)
+
+
+def test_named_pyramids_are_not_updated_by_live_images(app):
+    canvas = viewer()
+    named = np.arange(64.0).reshape(8, 8)
+    canvas.drawData2(named, key="T1")
+    pyramid = canvas.pyramid
+    canvas.drawData2(np.zeros((8, 8)))
+    assert canvas.pyramid is not pyramid
+    assert pyramid.levels[0] is named and pyramid.vmax == 63
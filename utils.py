@@ -1,5 +1,10 @@
+import os
 import numpy as np
 from collections import Counter
+from PIL import Image
+
+# T1, T2 & T2* channels of numpy phantoms (see Phantom), resampled without mixing tissues
+RELAXATION_CHANNELS = (1, 2, 3)
 
 # Scale function
 def scale_image(image:np.ndarray, a_min=0, a_max=255):
@@ -34,3 +39,85 @@ def find_most_frequent_pixels(image, top_n=10):
     top_pixel_intensities = [pixel_intensity for pixel_intensity, count in sorted_pixel_counts[:top_n]]
 
     return top_pixel_intensities
+
+# Center the first two axes in a square, padded with zeros (background) so nothing is cut off
+def pad_square(image:np.ndarray):
+    height, width = image.shape[:2]
+    size = max(height, width)
+    top, left = (size - height) // 2, (size - width) // 2
+    padding = [(top, size - height - top), (left, size - width - left)] + [(0, 0)] * (image.ndim - 2)
+    return np.pad(image, padding)
+
+# Weights (size x n) averaging n samples into size bins by overlap
+def area_weights(n:int, size:int):
+    edges = np.linspace(0, n, size + 1)
+    samples = np.arange(n)
+    overlap = np.minimum(edges[1:, None], samples + 1) - np.maximum(edges[:-1, None], samples)
+    overlap = np.clip(overlap, 0, None)
+    return overlap / overlap.sum(axis=1, keepdims=True)
+
+# Area (box) resampling of the first two axes to size x size, read block by block
+def area_resize(image:np.ndarray, size:int, block:int=256):
+    if image.shape[0] == size and image.shape[1] == size:
+        return np.array(image, dtype=float)
+
+    rows = area_weights(image.shape[0], size)
+    cols = area_weights(image.shape[1], size)
+    result = np.zeros((size, size) + image.shape[2:])
+    for start in range(0, image.shape[0], block):
+        # Only one block of a memory mapped array is loaded at a time
+        chunk = np.asarray(image[start:start + block], dtype=float)
+        chunk = np.tensordot(chunk, cols, axes=([1], [1]))                  # (block, ..., size)
+        chunk = np.tensordot(rows[:, start:start + block], chunk, axes=1)   # (size, ..., size)
+        result += np.moveaxis(chunk, -1, 1)
+    return result
+
+# Nearest neighbour resampling of the first two axes to size x size, only the rows kept are read
+def nearest_resize(image:np.ndarray, size:int):
+    rows = ((np.arange(size) + 0.5) * image.shape[0] / size).astype(int)
+    cols = ((np.arange(size) + 0.5) * image.shape[1] / size).astype(int)
+    return np.array(image[rows][:, cols], dtype=float)
+
+# Half size image: mean of every 2x2 block (the last row / column repeated for odd sizes)
+def half_resize(image:np.ndarray):
+    image = np.asarray(image, dtype=float)
+    padding = [(0, image.shape[0] % 2), (0, image.shape[1] % 2)] + [(0, 0)] * (image.ndim - 2)
+    image = np.pad(image, padding, mode='edge')
+    height, width = image.shape[0] // 2, image.shape[1] // 2
+    return image.reshape((height, 2, width, 2) + image.shape[2:]).mean(axis=(1, 3))
+
+# Read an image as a size x size grayscale array (first channel), non square images are padded
+def read_image(path:str, size:int=None):
+    with Image.open(path) as image:
+        if size is not None:
+            # Let the decoder downscale (JPEG) to the smallest scale still above the target
+            image.draft(image.mode, (size, size))
+        if image.mode == "P":
+            image = image.convert("RGBA")
+        if size is not None and max(image.size) >= 2 * size:
+            # Integer box reduction in the decoder (the padded square stays above the target), the rest is area resampled below
+            image = image.reduce(max(image.size) // size)
+        array = np.asarray(image)
+
+    if array.ndim > 2:
+        array = array[:,:,0]
+    array = pad_square(array)
+    return np.array(array, dtype=float) if size is None else area_resize(array, size)
+
+# Read a numpy phantom, NxN image or NxNxC maps (PD, T1, T2, T2*[, dB, B1]), as size x size
+def read_numpy(path, size:int=None):
+    # Memory map files, only the blocks being resampled are read
+    array = np.load(path, mmap_mode='r' if isinstance(path, (str, os.PathLike)) else None)
+    if not (array.ndim == 2 or (array.ndim == 3 and 4 <= array.shape[2] <= 6)):
+        raise ValueError(f"Numpy phantoms must be NxN images or NxNx4..6 maps, got {array.shape}")
+    if array.shape[0] != array.shape[1] or array.shape[0] == 0:
+        raise ValueError(f"Numpy phantoms must be square, got {array.shape[0]}x{array.shape[1]}")
+
+    resized = area_resize(array, array.shape[0] if size is None else size)
+    if array.ndim == 3 and resized.shape[0] != array.shape[0]:
+        # Relaxation times of one source voxel (averages would be tissues that do not exist), PD, dB & B1+ by area
+        resized[:, :, RELAXATION_CHANNELS] = nearest_resize(array, resized.shape[0])[:, :, RELAXATION_CHANNELS]
+    array = resized
+    if not np.all(np.isfinite(array)):
+        raise ValueError("Numpy phantom has non finite values")
+    return array